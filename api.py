@@ -0,0 +1,274 @@
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from batch_recommender import plato_properties
+from dish_store import DishStore
+from menu_repository import DEFAULT_MONGO_URI, get_repository
+from recommendation_table import RecommendationTable
+from recommender import WineRecommender
+from embedding_index import EMBEDDING_INDEX_PATH, EmbeddingSearch
+from similarity_engine import SimilarityEngine
+from telemetry import annotate, current_spans, render_prometheus, span, start_trace
+from wine_inventory import WineInventory
+from wine_ranking import PRICE_TIERS, price_tiers
+from wine_store import load_wine_catalogue
+
+# Servicio HTTP de recomendación. Se arranca con:
+#   uvicorn api:app --host 0.0.0.0 --port 8000 --workers 4
+# Cada proceso carga el catálogo y los platos una vez y responde desde memoria.
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Estado compartido por todas las peticiones del proceso
+state: Dict[str, Any] = {}
+
+
+class NarrativeRequest(BaseModel):
+    plato: str
+    vino: Dict[str, Any]
+    restaurante: Optional[str] = None
+
+
+class InventoryReplace(BaseModel):
+    """Inventario completo de un restaurante; los vinos se identifican como 'bodega|vino|año'"""
+    vinos: List[str]
+    precios: Dict[str, float] = {}
+
+
+class InventoryChange(BaseModel):
+    """Altas, bajas y precios de carta (``null`` vuelve al precio del catálogo)"""
+    alta: List[str] = []
+    baja: List[str] = []
+    precios: Dict[str, Optional[float]] = {}
+
+
+def _records(df: pd.DataFrame) -> List[Dict]:
+    """Convierte un DataFrame en registros JSON (sin tipos de NumPy ni NaN)"""
+    if df.empty:
+        return []
+    return json.loads(df.to_json(orient='records', force_ascii=False))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    load_dotenv()
+
+    recommender = WineRecommender()
+    with span('load_wine_data', cache='miss') as attributes:
+        recommender.set_catalogue(await asyncio.to_thread(load_wine_catalogue))
+        attributes['rows'] = len(recommender.df_vinos)
+    if os.getenv('LLM_STUB_LATENCY'):
+        from llm_stub import StubLLM
+        recommender.model = StubLLM(latency=float(os.getenv('LLM_STUB_LATENCY')))
+    logger.info(f"Catálogo cargado: {len(recommender.df_vinos)} vinos")
+
+    repository = get_repository(os.getenv('MONGO_URI', DEFAULT_MONGO_URI))
+    dish_store = DishStore(repository).start()
+    await asyncio.to_thread(dish_store.wait_until_loaded)
+
+    # Existencias y precios por restaurante sobre el catálogo compartido
+    recommender.inventory = await asyncio.to_thread(WineInventory(repository).load)
+    recommender.inventory.set_catalogue(recommender.df_vinos)
+
+    table = RecommendationTable(repository)
+    await asyncio.to_thread(table.set_catalogue, recommender.df_vinos, recommender.wine_index)
+
+    state.update(recommender=recommender, dish_store=dish_store, table=table, platos={},
+                 engine_lock=asyncio.Lock())
+    # SIMILARITY_ENGINE=1: motor multiatributo; SIMILARITY_ENGINE=embeddings: índice de embeddings en disco
+    if os.getenv('SIMILARITY_ENGINE') == 'embeddings':
+        recommender.similarity_engine = await asyncio.to_thread(
+            EmbeddingSearch.open, EMBEDDING_INDEX_PATH, recommender.df_vinos
+        )
+    elif os.getenv('SIMILARITY_ENGINE') == '1':
+        await _refresh_similarity_engine()
+    yield
+    dish_store.stop()
+
+
+app = FastAPI(title="Sumiller Digital", lifespan=lifespan)
+
+
+@app.middleware('http')
+async def trace_requests(request: Request, call_next):
+    """Una traza por petición; los tiempos por etapa se devuelven en la cabecera Server-Timing"""
+    start_trace()
+    with span('http', path=request.url.path):
+        response = await call_next(request)
+    response.headers['Server-Timing'] = ', '.join(
+        f"{s['stage']};dur={s['duration_ms']}" for s in current_spans()
+    )
+    return response
+
+
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """Métricas del proceso en formato de texto de Prometheus"""
+    return PlainTextResponse(render_prometheus(), media_type='text/plain; version=0.0.4')
+
+
+async def _refresh_similarity_engine() -> None:
+    """Reajusta el motor multiatributo si cambió el menú (los perfiles por tipo salen de los platos)"""
+    recommender: WineRecommender = state['recommender']
+    dish_store: DishStore = state['dish_store']
+    version = dish_store.version
+    if state.get('engine_version') == version:
+        return
+    # Un solo reajuste por cambio de menú: las peticiones que llegan mientras tanto lo esperan
+    async with state['engine_lock']:
+        version = dish_store.version
+        if state.get('engine_version') == version:
+            return
+        platos = await asyncio.to_thread(dish_store.repository.find_platos)
+        engine = SimilarityEngine()
+        await asyncio.to_thread(engine.fit, recommender.df_vinos, platos, recommender.wine_index)
+        recommender.similarity_engine = engine
+        state['engine_version'] = version
+
+
+async def _get_plato(nombre_plato: str, restaurante: Optional[str]) -> Dict:
+    """Documento completo del plato, cacheado mientras no cambie la versión del menú"""
+    dish_store: DishStore = state['dish_store']
+    key = (nombre_plato, restaurante, dish_store.version)
+    platos = state['platos']
+    with span('load_plato', cache='hit' if key in platos else 'miss'):
+        if key not in platos:
+            plato = await asyncio.to_thread(dish_store.repository.find_plato, nombre_plato, restaurante)
+            if plato is None:
+                raise HTTPException(status_code=404, detail=f"No se encontró el plato '{nombre_plato}'")
+            # Solo se conservan los platos de la versión actual
+            if any(k[2] != dish_store.version for k in platos):
+                platos.clear()
+            platos[key] = plato
+        return platos[key]
+
+
+@app.get('/health')
+async def health() -> Dict:
+    recommender: WineRecommender = state['recommender']
+    dish_store: DishStore = state['dish_store']
+    return {
+        'vinos': len(recommender.df_vinos),
+        'platos': dish_store.count(),
+        'sincronizacion': dish_store.mode,
+        'version_menu': dish_store.version,
+        'inventarios': len(recommender.inventory),
+    }
+
+
+@app.get('/categorias')
+async def categorias(restaurante: Optional[str] = None) -> List[str]:
+    return state['dish_store'].categories(restaurante)
+
+
+@app.get('/platos')
+async def platos(categoria: str, restaurante: Optional[str] = None) -> List[str]:
+    return state['dish_store'].dish_names(categoria, restaurante)
+
+
+@app.get('/platos/{nombre_plato}')
+async def plato(nombre_plato: str, restaurante: Optional[str] = None) -> Dict:
+    return await _get_plato(nombre_plato, restaurante)
+
+
+@app.get('/recomendaciones')
+async def recomendaciones(plato: str, restaurante: Optional[str] = None,
+                          top_k: int = Query(1, ge=1, le=20),
+                          tramos: int = Query(len(PRICE_TIERS), ge=1, le=10)) -> Dict:
+    """Los ``top_k`` mejores vinos por tipo y rango de precio (``tramos`` rangos) para un plato"""
+    recommender: WineRecommender = state['recommender']
+    table: RecommendationTable = state['table']
+    plato_data = await _get_plato(plato, restaurante)
+    record = state['dish_store'].get(plato, restaurante)
+    if record is not None:
+        acidity, body, recommended_types = record.acidez, record.cuerpo, list(record.maridaje)
+    else:
+        acidity, body, recommended_types = plato_properties(plato_data)
+    restaurante = restaurante or plato_data.get('restaurante')
+
+    with span('recommend_wines', top_k=top_k, tramos=tramos):
+        if isinstance(recommender.similarity_engine, SimilarityEngine):
+            await _refresh_similarity_engine()
+        wines = None
+        # La tabla materializada solo guarda el mejor vino de los tres rangos por defecto,
+        # calculado por acidez y cuerpo sobre todo el catálogo: no vale para restaurantes
+        # con inventario ni con el motor multiatributo
+        if (top_k == 1 and tramos == len(PRICE_TIERS) and recommender.stock_for(restaurante) is None
+                and recommender.similarity_engine is None):
+            try:
+                await asyncio.to_thread(table.sync, state['dish_store'].version)
+                wines = table.get(plato, restaurante)
+            except Exception as e:
+                logger.error(f"Error en la tabla de recomendaciones: {e}")
+            annotate(cache='miss' if wines is None else 'hit')
+        if wines is None:
+            # El ranking es CPU: fuera del bucle de eventos para no detener las demás peticiones
+            wines = await asyncio.to_thread(recommender.rank_wines, recommender.df_vinos, acidity, body,
+                                            recommended_types, top_k, price_tiers(tramos), restaurante,
+                                            plato=plato_data)
+            if top_k == 1:
+                wines = wines.drop(columns='rank', errors='ignore')
+    return {
+        'plato': plato,
+        'acidez': acidity,
+        'cuerpo': body,
+        'tipos_recomendados': recommended_types,
+        'vinos': _records(wines),
+    }
+
+
+@app.post('/narrativa')
+async def narrativa(request: NarrativeRequest) -> Dict:
+    """Narrativa del maridaje (desde la caché o generada con Gemini)"""
+    recommender: WineRecommender = state['recommender']
+    plato_data = await _get_plato(request.plato, request.restaurante)
+    text = await asyncio.to_thread(
+        recommender.generate_poetic_recommendation, request.vino, request.plato, plato_data
+    )
+    return {'plato': request.plato, 'narrativa': text}
+
+
+def _inventory_summary(restaurante: str) -> Dict:
+    stock = state['recommender'].stock_for(restaurante)
+    if stock is None:
+        raise HTTPException(status_code=404, detail=f"El restaurante '{restaurante}' no tiene inventario")
+    return {'restaurante': restaurante, 'en_stock': len(stock), 'precios_carta': len(stock.price_positions),
+            'version': stock.version}
+
+
+@app.get('/restaurantes/{restaurante}/inventario')
+async def inventario(restaurante: str) -> Dict:
+    return _inventory_summary(restaurante)
+
+
+@app.put('/restaurantes/{restaurante}/inventario')
+async def sustituir_inventario(restaurante: str, request: InventoryReplace) -> Dict:
+    """Sustituye las existencias y precios de carta del restaurante (sin recargar el catálogo)"""
+    inventory: WineInventory = state['recommender'].inventory
+    return await asyncio.to_thread(inventory.replace, restaurante, request.vinos, request.precios)
+
+
+@app.patch('/restaurantes/{restaurante}/inventario')
+async def actualizar_inventario(restaurante: str, request: InventoryChange) -> Dict:
+    """Altas y bajas de vinos y cambios de precio de carta"""
+    inventory: WineInventory = state['recommender'].inventory
+    return await asyncio.to_thread(inventory.update, restaurante, request.alta, request.baja, request.precios)
+
+
+@app.delete('/restaurantes/{restaurante}/inventario')
+async def eliminar_inventario(restaurante: str) -> Dict:
+    """Elimina el inventario: el restaurante vuelve a recibir recomendaciones de todo el catálogo"""
+    summary = _inventory_summary(restaurante)
+    await asyncio.to_thread(state['recommender'].inventory.remove, restaurante)
+    return summary
@@ -0,0 +1,49 @@
+import json
+import urllib.parse
+import urllib.request
+from typing import Dict, Optional
+
+import pandas as pd
+
+
+def _json_default(value):
+    """Serializa escalares de NumPy/pandas y cualquier otro valor como texto"""
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+class RecommenderClient:
+    """Cliente del servicio HTTP de recomendación (``api.py``) para la app y las tablets"""
+
+    def __init__(self, base_url: str, timeout: float = 30.0):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def _request(self, path: str, params: Optional[Dict] = None, body: Optional[Dict] = None):
+        url = self.base_url + path
+        params = {k: v for k, v in (params or {}).items() if v is not None}
+        if params:
+            url += '?' + urllib.parse.urlencode(params)
+
+        data = None
+        headers = {'Accept': 'application/json'}
+        if body is not None:
+            data = json.dumps(body, default=_json_default, ensure_ascii=False).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+
+        request = urllib.request.Request(url, data=data, headers=headers)
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def recommendations(self, plato: str, restaurante: Optional[str] = None,
+                        top_k: int = 1, tramos: Optional[int] = None) -> pd.DataFrame:
+        """Vinos recomendados para un plato (``top_k`` por tipo y rango de precio)"""
+        params = {'plato': plato, 'restaurante': restaurante, 'top_k': top_k, 'tramos': tramos}
+        result = self._request('/recomendaciones', params)
+        return pd.DataFrame(result['vinos'])
+
+    def narrative(self, wine_data: Dict, plato: str, restaurante: Optional[str] = None) -> str:
+        """Narrativa del maridaje entre un vino y un plato"""
+        body = {'plato': plato, 'vino': wine_data, 'restaurante': restaurante}
+        return self._request('/narrativa', body=body)['narrativa']
@@ -1,18 +1,31 @@
+from startup import STARTUP, STARTUP_WARMUP, Warmup
 import streamlit as st
 import pandas as pd
-import numpy as np
-import pymongo
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, Optional
 import logging
-import google.generativeai as genai
 import os
+import uuid
 from dotenv import load_dotenv
+from wine_index import WineIndex
+from wine_store import WINE_CSV_PATH, WINE_STORE_PATH, load_wine_catalogue
+from batch_recommender import plato_properties
+from recommender import WineRecommender
+from api_client import RecommenderClient
+from menu_repository import get_repository
+from dish_store import DishStore
+from recommendation_table import RecommendationTable, catalogue_version
+from wine_inventory import WineInventory
+from similarity_engine import SimilarityEngine
+from embedding_index import EMBEDDING_INDEX_PATH, EmbeddingSearch
+from narrative_prefetch import NarrativePrefetcher
+from narratives import GEMINI_MODEL, NarrativeCache, narrative_key, pairing_fields, shared_narrative_stream
+from telemetry import annotate, current_spans, render_prometheus, span, start_metrics_server, start_trace
 
 # Cargar variables de entorno
 load_dotenv()
 
-# Configurar Gemini API
-genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+# El SDK de Gemini (el import más lento) no se carga aquí sino en get_gemini_model
+STARTUP.mark('importaciones')
 
 # Configuración de la página
 st.set_page_config(
@@ -26,302 +39,224 @@ st.set_page_config(
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class WineRecommendationApp:
+class WineRecommendationApp(WineRecommender):
     def __init__(self):
-        self.df_vinos = None
-        self.df_platos = None
+        super().__init__()
         self.mongo_client = None
-        self.wine_types = []  # Se llenará cuando se carguen los datos
+        # Si está definida, la app delega ranking y narrativas en el servicio HTTP (api.py)
+        api_url = os.getenv('RECOMMENDER_API_URL')
+        self.api_client = RecommenderClient(api_url) if api_url else None
         
-    @st.cache_data
+    @st.cache_resource
     def load_wine_data(_self) -> pd.DataFrame:
-        """Carga el dataset de vinos desde CSV"""
+        """Carga el dataset de vinos desde el almacén columnar (o el CSV si no existe)
+        
+        El almacén se mapea en memoria sin copiar, así que el DataFrame se
+        comparte entre sesiones y no debe modificarse in situ.
+        """
         try:
-            df = pd.read_csv('./data/vinos.csv')
-            
-            if 'type' in df.columns:
-                df['type'] = df['type'].str.lower()
+            with STARTUP.phase('catalogo_vinos'):
+                df = load_wine_catalogue(WINE_CSV_PATH, WINE_STORE_PATH)
             logger.info(f"Dataset de vinos cargado: {len(df)} registros")
+            # Solo se ejecuta si no estaba en la caché de Streamlit
+            annotate(cache='miss', rows=len(df))
             return df
         except FileNotFoundError:
-            st.error("❌ No se encontró el archivo './data/vinos.csv'")
+            st.error(f"❌ No se encontró el archivo '{WINE_CSV_PATH}'")
             return pd.DataFrame()
         except Exception as e:
             st.error(f"❌ Error al cargar el dataset de vinos: {str(e)}")
             return pd.DataFrame()
     
-    @st.cache_data
-    def load_platos_from_mongodb(_self, connection_string: str = "mongodb://localhost:27017/") -> pd.DataFrame:
-        """Carga los platos desde MongoDB"""
-        try:
-            client = pymongo.MongoClient(connection_string)
-            db = client['menu_database']  # Cambiado a menu_database
-            collection = db['platos']
-            
-            # Obtener todos los documentos
-            platos_data = list(collection.find())
-            
-            if not platos_data:
-                st.warning("⚠️ No se encontraron platos en la base de datos MongoDB")
-                return pd.DataFrame()
-            
-            # Convertir a DataFrame
-            df = pd.DataFrame(platos_data)
-            
-            # Eliminar el campo _id si existe
-            if '_id' in df.columns:
-                df = df.drop('_id', axis=1)
-            
-            logger.info(f"Platos cargados desde MongoDB: {len(df)} registros")
-            return df
-            
-        except Exception as e:
-            st.error(f"❌ Error al conectar con MongoDB: {str(e)}")
-            return pd.DataFrame()
+    @st.cache_resource
+    def build_wine_index(_self, df_vinos: pd.DataFrame) -> WineIndex:
+        """Construye el índice espacial de vinos una sola vez por catálogo"""
+        index = WineIndex(df_vinos)
+        logger.info(f"Índice de vinos construido: {len(index.wine_types)} tipos")
+        return index
     
-    def get_categories(self, df_platos: pd.DataFrame) -> List[str]:
-        """Obtiene las categorías únicas de platos"""
-        if df_platos.empty or 'categoria' not in df_platos.columns:
-            return []
-        return sorted(df_platos['categoria'].unique().tolist())
+    @st.cache_resource
+    def get_dish_store(_self, connection_string: str) -> DishStore:
+        """Copia en memoria de los platos, compartida por todas las sesiones del proceso"""
+        return DishStore(get_repository(connection_string)).start()
     
-    def get_platos_by_category(self, df_platos: pd.DataFrame, categoria: str) -> List[str]:
-        """Obtiene los platos de una categoría específica"""
-        if df_platos.empty or 'nombre_plato' not in df_platos.columns:
-            return []
-        platos_filtrados = df_platos[df_platos['categoria'] == categoria]
-        return sorted(platos_filtrados['nombre_plato'].unique().tolist())
+    @st.cache_resource
+    def get_recommendation_table(_self, connection_string: str) -> RecommendationTable:
+        """Tabla materializada de recomendaciones, compartida por todas las sesiones del proceso"""
+        return RecommendationTable(get_repository(connection_string))
     
-    def get_plato_properties(self, df_platos: pd.DataFrame, nombre_plato: str) -> Tuple[float, float, List[str]]:
-        """Obtiene las propiedades de acidez, cuerpo y maridajes recomendados de un plato"""
-        plato_data = df_platos[df_platos['nombre_plato'] == nombre_plato]
-        if plato_data.empty:
-            return 0.0, 0.0, []
-        
-        # Convertir a float y manejar el caso donde termina en punto
-        def clean_number(val):
-            if isinstance(val, str):
-                return float(val.rstrip('.'))
-            return float(val)
-        
-        acidity = clean_number(plato_data.iloc[0]['acidez']) if 'acidez' in plato_data.columns else 0.0
-        body = clean_number(plato_data.iloc[0]['cuerpo']) if 'cuerpo' in plato_data.columns else 0.0
-        
-        # Obtener maridajes recomendados
-        maridajes = plato_data.iloc[0].get('maridaje', [])
-        if isinstance(maridajes, str):
-            # Si es una cadena, convertir a lista y limpiar
-            maridajes = [m.strip().lower() for m in maridajes.split(',')]
-        elif not isinstance(maridajes, list):
-            maridajes = []
-        
-        return acidity, body, maridajes
+    @st.cache_resource
+    def get_wine_inventory(_self, connection_string: str) -> WineInventory:
+        """Existencias y precios de carta de cada restaurante, compartidos por todas las sesiones"""
+        return WineInventory(get_repository(connection_string)).load()
     
-    def filter_wines_by_similarity(self, df_vinos: pd.DataFrame, target_acidity: float, 
-                                 target_body: float, wine_type: str, 
-                                 recommended_types: List[str], tolerance: float = 0.4) -> pd.DataFrame:
-        """Filtra vinos por similitud en acidez y cuerpo, considerando los maridajes recomendados
+    @st.cache_resource(max_entries=1)
+    def build_similarity_engine(_self, connection_string: str, dish_version: int,
+                                catalogue_version: str) -> SimilarityEngine:
+        """Motor de similitud multiatributo, reajustado cuando cambia el menú o el catálogo de vinos
         
-        Los valores de acidez y cuerpo deben estar normalizados entre 0 y 1.
-        La tolerancia por defecto es 0.4 para permitir encontrar valores aproximados.
+        ``catalogue_version`` es la huella de ``_self.df_vinos``: forma parte de la
+        clave de la caché para que un catálogo nuevo no siga usando el motor anterior.
         """
-        # Verificar si el tipo de vino está en los maridajes recomendados
-        if wine_type.lower() not in [t.lower() for t in recommended_types]:
-            return pd.DataFrame()
-            
-        # Filtrar por tipo de vino
-        df_filtered = df_vinos[df_vinos['type'].str.lower() == wine_type.lower()].copy()
-        
-        if df_filtered.empty:
-            return df_filtered
-            
-        # Asegurar que los valores estén entre 0 y 1
-        target_acidity = np.clip(target_acidity / 5.0, 0, 1)
-        target_body = np.clip(target_body / 5.0, 0, 1)
-        
-        # Normalizar valores del DataFrame
-        df_filtered['acidity_norm'] = df_filtered['acidity'] / 5.0
-        df_filtered['body_norm'] = df_filtered['body'] / 5.0
-            
-        # Calcular distancia euclidiana normalizada para similitud
-        df_filtered['distance'] = np.sqrt(
-            (df_filtered['acidity_norm'] - target_acidity) ** 2 + 
-            (df_filtered['body_norm'] - target_body) ** 2
-        )
-        
-        # La distancia máxima posible en un espacio normalizado 2D es √2 ≈ 1.414
-        # Ajustamos la tolerancia para encontrar más coincidencias si es necesario
-        if df_filtered[df_filtered['distance'] <= tolerance].empty:
-            # Si no hay coincidencias, aumentamos gradualmente la tolerancia
-            tolerance = min(tolerance * 1.5, 0.8)  # máximo 0.8 para evitar coincidencias muy lejanas
+        platos = get_repository(connection_string).find_platos()
+        return SimilarityEngine().fit(_self.df_vinos, platos, _self.wine_index)
+    
+    @st.cache_resource(max_entries=1)
+    def open_embedding_index(_self, path: str, catalogue_version: str) -> EmbeddingSearch:
+        """Índice de embeddings de los vinos, mapeado en memoria una sola vez por catálogo
         
-        # Filtrar por tolerancia y ordenar por distancia
-        df_filtered = df_filtered[df_filtered['distance'] <= tolerance]
-        df_filtered = df_filtered.sort_values('distance')
+        Con un catálogo nuevo (otra ``catalogue_version``) se vuelve a abrir y a
+        comprobar que el índice guardado corresponde a ``_self.df_vinos``.
+        """
+        return EmbeddingSearch.open(path, _self.df_vinos)
+    
+    @st.cache_data
+    def load_plato(_self, connection_string: str, nombre_plato: str,
+                   restaurante: Optional[str] = None, version: int = 0) -> Dict:
+        """Carga el documento completo del plato seleccionado
         
-        # Eliminar columnas temporales de normalización
-        df_filtered = df_filtered.drop(['acidity_norm', 'body_norm'], axis=1)
+        ``version`` es la versión del almacén de platos: al cambiar el menú
+        cambia la clave de la caché y el plato se vuelve a leer.
+        """
+        try:
+            plato = get_repository(connection_string).find_plato(nombre_plato, restaurante) or {}
+            annotate(cache='miss', rows=1 if plato else 0)
+            return plato
+        except Exception as e:
+            st.error(f"❌ Error al conectar con MongoDB: {str(e)}")
+            return {}
+    
+    def lookup_recommendations(self, connection_string: str, dish_version: int, nombre_plato: str,
+                               restaurante: Optional[str] = None) -> Optional[pd.DataFrame]:
+        """Recomendaciones precalculadas del plato (None si no se pueden obtener de la tabla)
         
-        return df_filtered
+        La tabla solo se recalcula cuando cambia el catálogo o la versión del
+        menú, y entonces únicamente para los platos modificados.
+        """
+        try:
+            table = self.get_recommendation_table(connection_string)
+            table.set_catalogue(self.df_vinos, self.wine_index)
+            table.sync(dish_version)
+            return table.get(nombre_plato, restaurante)
+        except Exception as e:
+            logger.error(f"Error en la tabla de recomendaciones: {str(e)}")
+            return None
     
-    def divide_wines_by_price_ranges(self, df_wines: pd.DataFrame) -> Dict[str, pd.DataFrame]:
-        """Divide los vinos en tres rangos de precio (tercios)"""
-        if df_wines.empty:
-            return {"Económico": pd.DataFrame(), "Intermedio": pd.DataFrame(), "Premium": pd.DataFrame()}
-        
-        # Calcular percentiles
-        p33 = df_wines['price'].quantile(0.33)
-        p66 = df_wines['price'].quantile(0.66)
-        
-        economico = df_wines[df_wines['price'] <= p33]
-        intermedio = df_wines[(df_wines['price'] > p33) & (df_wines['price'] <= p66)]
-        premium = df_wines[df_wines['price'] > p66]
-        
-        return {
-            "Económico": economico,
-            "Intermedio": intermedio,
-            "Premium": premium
-        }
+    @st.cache_resource
+    def get_gemini_model(_self):
+        """Crea el modelo de Gemini una sola vez por proceso, importando el SDK en ese momento"""
+        with STARTUP.phase('modelo_llm'):
+            import google.generativeai as genai
+            genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+            return genai.GenerativeModel(GEMINI_MODEL)
     
-    def select_best_wine_in_range(self, df_range: pd.DataFrame) -> Optional[pd.Series]:
-        """Selecciona el mejor vino en un rango de precio basado en rating y reviews"""
-        if df_range.empty:
-            return None
+    @st.cache_resource
+    def get_narrative_cache(_self) -> NarrativeCache:
+        """Abre la caché persistente de narrativas una sola vez por proceso"""
+        return NarrativeCache()
+    
+    @st.cache_resource
+    def get_narrative_prefetcher(_self) -> NarrativePrefetcher:
+        """Generador de narrativas en segundo plano, compartido por todas las sesiones"""
+        return NarrativePrefetcher(_self.get_narrative_cache(), _self.get_gemini_model())
+    
+    def prefetch_narratives(self, recommended_wines: pd.DataFrame, plato_name: str, plato_data: Dict) -> None:
+        """Empieza a generar las narrativas de todos los vinos mostrados (y cancela las de opciones abandonadas)"""
+        session = st.session_state.setdefault('narrative_session', uuid.uuid4().hex)
+        with span('prefetch_narratives', candidates=len(recommended_wines)):
+            pairings = [pairing_fields(wine, plato_name, plato_data)
+                        for wine in recommended_wines.to_dict('records')]
+            annotate(queued=self.get_narrative_prefetcher().prefetch(session, pairings))
+    
+    def render_poetic_recommendation(self, wine_data: Dict, plato_name: str, plato_data: Dict) -> str:
+        """Muestra la recomendación en streaming, escribiendo cada fragmento según llega
         
-        # Calcular score combinando rating y número de reviews
-        df_temp = df_range.copy()
-        df_temp['score'] = df_temp['rating'] * np.log(df_temp['num_reviews'] + 1)
+        Si el stream falla o se detiene más allá del plazo configurado, se
+        sustituye lo mostrado por la recomendación básica.
+        """
+        placeholder = st.empty()
+        with span('generate_poetic_recommendation', streaming=True):
+            try:
+                wine_info, plato_info = pairing_fields(wine_data, plato_name, plato_data)
+                
+                cache = self.get_narrative_cache()
+                key = narrative_key(wine_info, plato_info)
+                narrative = cache.get(key)
+                annotate(cache='miss' if narrative is None else 'hit')
+                
+                if narrative is None:
+                    # Si otra sesión (o la generación anticipada) ya la está generando, se muestra esa llamada
+                    for narrative in shared_narrative_stream(self.get_gemini_model(), cache, key,
+                                                             wine_info, plato_info):
+                        placeholder.markdown(narrative)
+                    if narrative is None:
+                        raise Exception("No se generó respuesta")
+                    
+            except Exception as e:
+                logger.error(f"Error generando recomendación en streaming: {str(e)}")
+                annotate(fallback=True)
+                narrative = self._generate_fallback_recommendation(wine_data, plato_name)
+        
+        placeholder.markdown(narrative)
+        return narrative
+
+    @st.cache_resource
+    def start_warmup(_self, connection_string: str) -> Warmup:
+        """Precarga (una vez por proceso) catálogo, platos, inventarios, caché de narrativas y modelo
         
-        # Seleccionar el vino con mejor score
-        best_wine = df_temp.loc[df_temp['score'].idxmax()]
-        return best_wine
+        Las tareas llaman a los mismos recursos cacheados que la página, así que
+        la primera ejecución solo espera a lo que aún no esté listo cuando lo necesita.
+        """
+        def wine_catalogue():
+            df = _self.load_wine_data()
+            if not df.empty:
+                _self.build_wine_index(df)
+        
+        def dishes():
+            _self.get_dish_store(connection_string).wait_until_loaded()
+            _self.get_wine_inventory(connection_string)
+        
+        return Warmup().start({
+            'precarga_catalogo': wine_catalogue,
+            'precarga_mongodb': dishes,
+            'precarga_llm': lambda: (_self.get_narrative_cache(), _self.get_gemini_model()),
+        })
     
-    def recommend_wines(self, df_vinos: pd.DataFrame, target_acidity: float, 
-                       target_body: float, recommended_types: List[str]) -> pd.DataFrame:
-        """Recomienda vinos basándose en los maridajes sugeridos para el plato y 
-        la similitud de acidez y cuerpo"""
-        recommendations = []
-        
-        # Filtrar wine_types para incluir solo los tipos recomendados
-        valid_types = [t for t in self.wine_types if t.lower() in [rt.lower() for rt in recommended_types]]
-        
-        for wine_type in valid_types:
-            # Filtrar vinos por tipo y similitud
-            filtered_wines = self.filter_wines_by_similarity(
-                df_vinos, target_acidity, target_body, wine_type, recommended_types
-            )
-            
-            if filtered_wines.empty:
-                continue
-            
-            # Dividir en rangos de precio
-            price_ranges = self.divide_wines_by_price_ranges(filtered_wines)
-            
-            # Seleccionar mejor vino de cada rango
-            for range_name, df_range in price_ranges.items():
-                best_wine = self.select_best_wine_in_range(df_range)
-                if best_wine is not None:
-                    wine_data = best_wine.to_dict()
-                    wine_data['price_range'] = range_name
-                    wine_data['wine_type_category'] = wine_type.capitalize()
-                    recommendations.append(wine_data)
-        
-        return pd.DataFrame(recommendations)
+    @st.cache_resource
+    def start_metrics_exporter(_self, port: int):
+        """Arranca (una vez por proceso) el endpoint /metrics de Prometheus"""
+        return start_metrics_server(port)
     
-    def generate_poetic_recommendation(self, wine_data: Dict, plato_name: str, plato_data: Dict) -> str:
-        """Genera una recomendación poética y narrativa del maridaje usando Gemini API"""
-        try:
-            # Preparar los datos para el prompt
-            wine_info = {
-                "nombre": wine_data.get('wine', 'Vino seleccionado'),
-                "bodega": wine_data.get('winery', ''),
-                "año": wine_data.get('year', ''),
-                "tipo": wine_data.get('type', '').lower(),
-                "país": wine_data.get('country', ''),
-                "región": wine_data.get('region', ''),
-                "acidez": wine_data.get('acidity', 0),
-                "cuerpo": wine_data.get('body', 0)
-            }
-
-            plato_info = {
-                "nombre": plato_name,
-                "descripción": plato_data.get('descripcion', ''),
-                "acidez": plato_data.get('acidez', 0),
-                "cuerpo": plato_data.get('cuerpo', 0),
-                "ingredientes": plato_data.get('ingredientes_clave', [])
-            }
-
-            # Crear el prompt para Gemini
-            prompt = f"""
-            Eres un sommelier experto en maridajes. Genera una descripción profesional y clara del 
-            maridaje entre un vino y un plato. Usa un lenguaje elegante y preciso, evitando tanto 
-            tecnicismos excesivos como expresiones demasiado poéticas o metafóricas.
-
-            VINO:
-            - Nombre: {wine_info['nombre']}
-            - Bodega: {wine_info['bodega']}
-            - Año: {wine_info['año']}
-            - Tipo: {wine_info['tipo']}
-            - Región: {wine_info['región']}, {wine_info['país']}
-            - Acidez: {wine_info['acidez']}/5
-            - Cuerpo: {wine_info['cuerpo']}/5
-
-            PLATO:
-            - Nombre: {plato_info['nombre']}
-            - Descripción: {plato_info['descripción']}
-            - Acidez: {plato_info['acidez']}/5
-            - Cuerpo: {plato_info['cuerpo']}/5
-            - Ingredientes clave: {', '.join(plato_info['ingredientes'])}
-
-            Por favor, genera una recomendación que incluya:
-            1. Un título descriptivo y elegante
-            2. Una explicación clara del equilibrio entre el vino y el plato
-            3. Una descripción precisa de aromas y texturas
-            4. Recomendaciones prácticas de servicio y temperatura
-            5. Una breve conclusión sobre la experiencia de maridaje
-
-            El formato debe ser en Markdown e incluir emojis apropiados.
-            Usa un tono profesional y accesible, como un experto compartiendo su conocimiento 
-            de manera clara y directa. Evita metáforas elaboradas o lenguaje demasiado florido.
-            
-            La descripción debe enfocarse en aspectos tangibles y prácticos del maridaje, 
-            destacando características específicas que hacen que esta combinación funcione bien.
-            """
-
-            # Llamar a Gemini API
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            response = model.generate_content(prompt)
-            
-            # Procesar y devolver la respuesta
-            if response.text:
-                return response.text
-            else:
-                raise Exception("No se generó respuesta")
-
-        except Exception as e:
-            logger.error(f"Error generando recomendación: {str(e)}")
-            return self._generate_fallback_recommendation(wine_data, plato_name)
+    def render_debug_panel(self):
+        """Muestra los tiempos de cada etapa de esta ejecución y las métricas del proceso"""
+        st.markdown("---")
+        st.header("🐞 Depuración")
+        spans = current_spans()
+        if spans:
+            rows = [{'etapa': s['stage'], 'ms': s['duration_ms'], 'error': s.get('error', ''),
+                     **{k: str(v) for k, v in s['attributes'].items()}} for s in spans]
+            st.dataframe(pd.DataFrame(rows), use_container_width=True)
+            st.caption(f"Traza {spans[0]['trace_id']}: {sum(s['duration_ms'] for s in spans if s['parent'] is None):.1f} ms en etapas medidas")
+        with st.expander("🚀 Arranque del proceso"):
+            st.dataframe(pd.DataFrame(STARTUP.report()), use_container_width=True)
+        with st.expander("📈 Métricas (formato Prometheus)"):
+            st.code(render_prometheus(), language='text')
 
-    def _generate_fallback_recommendation(self, wine_data: Dict, plato_name: str) -> str:
-        """Genera una recomendación básica en caso de error con la API"""
-        return f"""
-        ### 🍷 Recomendación de Maridaje
-        
-        ---
-        
-        **{wine_data.get('wine', 'Vino seleccionado')}** 
-        *{wine_data.get('winery', '')} ({wine_data.get('year', '')})*
-        
-        Esta combinación de vino y **{plato_name}** ofrece un equilibrio de sabores 
-        y texturas que complementan las características de ambos elementos.
+    def run(self):
+        """Función principal de la aplicación: dibuja la página y, si se pide, el panel de depuración"""
+        start_trace()
+        if os.getenv('METRICS_PORT'):
+            self.start_metrics_exporter(int(os.getenv('METRICS_PORT')))
         
-        ---
-        """
+        self.render_page()
+        STARTUP.mark('primera_pagina')
         
+        if st.sidebar.checkbox("🐞 Panel de depuración", value=os.getenv('DEBUG_PANEL') == '1',
+                               help="Tiempos por etapa (MongoDB, catálogo, ranking, Gemini) de esta ejecución"):
+            self.render_debug_panel()
 
-    
-    def run(self):
-        """Función principal de la aplicación"""
+    def render_page(self):
+        """Página principal de la aplicación"""
         # Título principal
         st.title("🍷 Maridaje Perfecto")
         st.markdown("### *Descubre el vino ideal para tu plato favorito*")
@@ -335,42 +270,97 @@ class WineRecommendationApp:
                 value="mongodb://localhost:27017/",
                 help="Cadena de conexión a MongoDB"
             )
+            if STARTUP_WARMUP:
+                self.start_warmup(mongo_connection)
+            restaurante = st.text_input(
+                "🏠 Restaurante",
+                value=os.getenv('RESTAURANTE', ''),
+                help="Filtra el menú por restaurante (vacío = todos)"
+            ) or None
+            
+            top_k = st.slider(
+                "🏅 Vinos por rango de precio",
+                min_value=1, max_value=5, value=1,
+                help="Cuántos vinos mostrar de cada tipo y rango de precio"
+            )
+            
+            engines = ["Acidez y cuerpo", "Multiatributo", "Embeddings"]
+            default_engine = {'1': 1, 'embeddings': 2}.get(os.getenv('SIMILARITY_ENGINE', ''), 0)
+            engine_mode = st.selectbox(
+                "🧬 Motor de maridaje",
+                engines,
+                index=default_engine,
+                help="Multiatributo compara también proteína, cocción, salsa y texto; "
+                     "Embeddings usa el índice de embeddings de los vinos (embedding_index.py)"
+            )
             
+            streaming_mode = st.checkbox(
+                "⚡ Narrativa en streaming",
+                value=True,
+                help="Muestra la recomendación a medida que se genera"
+            )
+            prefetch_mode = st.checkbox(
+                "⏩ Anticipar narrativas",
+                value=os.getenv('NARRATIVE_PREFETCH', '1') != '0',
+                help="Genera en segundo plano las narrativas de todos los vinos mostrados "
+                     "para que cambiar de opción sea inmediato"
+            )
+            
+            dish_store = self.get_dish_store(mongo_connection)
+            self.inventory = self.get_wine_inventory(mongo_connection)
             if st.button("🔄 Recargar Datos"):
-                st.cache_data.clear()
+                # Solo se resincronizan los platos y los inventarios; la caché de vinos se conserva
+                dish_store.refresh()
+                self.inventory.load()
                 st.rerun()
+            st.caption(f"Sincronización de platos: {dish_store.mode} (versión {dish_store.version})")
         
         # Cargar datos
         with st.spinner("Cargando datos..."):
-            self.df_vinos = self.load_wine_data()
-            self.df_platos = self.load_platos_from_mongodb(mongo_connection)
+            with span('load_wine_data', cache='hit'):
+                self.df_vinos = self.load_wine_data()
+            dish_store.wait_until_loaded()
+            # Una sola versión del menú para toda la página aunque cambie mientras se dibuja
+            menu = dish_store.catalogue()
+            num_platos = menu.count(restaurante)
             
-            # Actualizar lista de tipos de vino
+            # Actualizar lista de tipos de vino e índice de búsqueda
             if not self.df_vinos.empty and 'type' in self.df_vinos.columns:
-                self.wine_types = sorted(self.df_vinos['type'].unique().tolist())
+                self.set_catalogue(self.df_vinos, self.build_wine_index(self.df_vinos))
+                self.similarity_engine = None
+                if engine_mode == "Multiatributo":
+                    self.similarity_engine = self.build_similarity_engine(mongo_connection, menu.version,
+                                                                          catalogue_version(self.df_vinos))
+                elif engine_mode == "Embeddings":
+                    try:
+                        self.similarity_engine = self.open_embedding_index(EMBEDDING_INDEX_PATH,
+                                                                           catalogue_version(self.df_vinos))
+                    except (OSError, ValueError) as e:
+                        st.warning(f"⚠️ Índice de embeddings no disponible ({e}); se usa acidez y cuerpo")
         
         # Verificar que los datos se cargaron correctamente
         if self.df_vinos.empty:
             st.error("❌ No se pudieron cargar los datos de vinos")
             return
         
-        if self.df_platos.empty:
+        if num_platos == 0:
             st.error("❌ No se pudieron cargar los datos de platos")
             return
         
         # Mostrar estadísticas básicas
         col1, col2 = st.columns(2)
+        stock = self.stock_for(restaurante)
         with col1:
-            st.metric("🍷 Vinos disponibles", len(self.df_vinos))
+            st.metric("🍷 Vinos disponibles", len(stock) if stock is not None else len(self.df_vinos))
         with col2:
-            st.metric("🍽️ Platos disponibles", len(self.df_platos))
+            st.metric("🍽️ Platos disponibles", num_platos)
         
         st.markdown("---")
         
         # Paso 2: Selección de platos
         st.header("1️⃣ Selecciona tu plato")
         
-        categories = self.get_categories(self.df_platos)
+        categories = menu.categories(restaurante)
         
         if not categories:
             st.error("❌ No se encontraron categorías de platos")
@@ -384,7 +374,7 @@ class WineRecommendationApp:
         )
         
         # Selección de plato
-        platos_in_category = self.get_platos_by_category(self.df_platos, selected_category)
+        platos_in_category = menu.dish_names(selected_category, restaurante)
         
         if not platos_in_category:
             st.warning(f"⚠️ No se encontraron platos en la categoría '{selected_category}'")
@@ -396,8 +386,17 @@ class WineRecommendationApp:
             index=0
         )
         
-        # Obtener propiedades del plato
-        plato_acidity, plato_body, recommended_types = self.get_plato_properties(self.df_platos, selected_plato)
+        # Propiedades del plato ya interpretadas en el catálogo del menú; el documento
+        # completo solo hace falta para la narrativa y el motor multiatributo
+        record = menu.get(selected_plato, restaurante)
+        with span('load_plato', cache='hit'):
+            plato_data = self.load_plato(mongo_connection, selected_plato, restaurante, menu.version)
+        if record is not None:
+            plato_acidity, plato_body, recommended_types = record.acidez, record.cuerpo, list(record.maridaje)
+            restaurante = restaurante or record.restaurante
+        else:
+            plato_acidity, plato_body, recommended_types = plato_properties(plato_data)
+            restaurante = restaurante or plato_data.get('restaurante')
         
         # Mostrar propiedades del plato
         st.info(f"**Plato seleccionado:** {selected_plato}")
@@ -416,8 +415,22 @@ class WineRecommendationApp:
         # Paso 3: Recomendación de vinos
         st.header("2️⃣ Vinos recomendados")
         
-        with st.spinner("Analizando maridajes..."):
-            recommended_wines = self.recommend_wines(self.df_vinos, plato_acidity, plato_body, recommended_types)
+        with st.spinner("Analizando maridajes..."), span('recommend_wines'):
+            if self.api_client is not None:
+                annotate(remote=True)
+                recommended_wines = self.api_client.recommendations(selected_plato, restaurante, top_k)
+            else:
+                recommended_wines = None
+                # La tabla precalculada guarda un vino por rango, por acidez y cuerpo y sobre
+                # todo el catálogo (sin las existencias del restaurante)
+                if top_k == 1 and self.stock_for(restaurante) is None and self.similarity_engine is None:
+                    recommended_wines = self.lookup_recommendations(mongo_connection, menu.version,
+                                                                    selected_plato, restaurante)
+                    annotate(cache='miss' if recommended_wines is None else 'hit')
+                if recommended_wines is None:
+                    recommended_wines = self.rank_wines(self.df_vinos, plato_acidity, plato_body,
+                                                        recommended_types, top_k, restaurante=restaurante,
+                                                        plato=plato_data)
         
         if recommended_wines.empty:
             st.warning("⚠️ No se encontraron vinos compatibles con este plato")
@@ -435,10 +448,16 @@ class WineRecommendationApp:
         # Mostrar tabla de vinos
         display_columns = ['wine', 'winery', 'type', 'price', 'rating', 'num_reviews', 
                           'country', 'region', 'year', 'price_range']
+        if top_k > 1:
+            display_columns.append('rank')
         
         available_columns = [col for col in display_columns if col in recommended_wines.columns]
         st.dataframe(recommended_wines[available_columns], use_container_width=True)
         
+        # Las narrativas de todas las opciones se generan mientras el comensal elige
+        if prefetch_mode and self.api_client is None:
+            self.prefetch_narratives(recommended_wines, selected_plato, plato_data)
+        
         st.markdown("---")
         
         # Paso 4: Selección final
@@ -459,14 +478,17 @@ class WineRecommendationApp:
             # Paso 5: Recomendación poética
             st.header("4️⃣ Tu maridaje perfecto")
             
-            # Obtener datos completos del plato
-            plato_data = self.df_platos[self.df_platos['nombre_plato'] == selected_plato].iloc[0].to_dict()
-            
-            poetic_recommendation = self.generate_poetic_recommendation(
-                selected_wine_data, selected_plato, plato_data
-            )
-            
-            st.markdown(poetic_recommendation)
+            if self.api_client is not None:
+                with st.spinner("Creando tu recomendación personalizada..."):
+                    st.markdown(self.api_client.narrative(selected_wine_data, selected_plato, restaurante))
+            elif streaming_mode:
+                self.render_poetic_recommendation(selected_wine_data, selected_plato, plato_data)
+            else:
+                poetic_recommendation = self.generate_poetic_recommendation(
+                    selected_wine_data, selected_plato, plato_data
+                )
+                
+                st.markdown(poetic_recommendation)
             
             # Información adicional del vino seleccionado
             with st.expander("📊 Detalles técnicos del vino"):
@@ -0,0 +1,206 @@
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from wine_index import ESCALA_ORGANOLEPTICA, WineIndex
+from wine_ranking import PRICE_TIERS, score_arrays
+from wine_store import WINE_CSV_PATH, load_wine_catalogue
+
+logger = logging.getLogger(__name__)
+
+# Rangos de precio en el mismo orden que muestra la aplicación
+PRICE_RANGES = tuple(name for name, _ in PRICE_TIERS)
+
+# Número máximo de celdas (platos x vinos) de cada matriz de distancias
+MAX_MATRIX_CELLS = 4_000_000
+
+
+def plato_properties(plato: Dict) -> Tuple[float, float, List[str]]:
+    """Obtiene acidez, cuerpo y maridajes recomendados de un documento de plato"""
+    # Convertir a float y manejar el caso donde termina en punto
+    def clean_number(val):
+        if isinstance(val, str):
+            return float(val.rstrip('.'))
+        return float(val)
+
+    acidity = clean_number(plato['acidez']) if 'acidez' in plato else 0.0
+    body = clean_number(plato['cuerpo']) if 'cuerpo' in plato else 0.0
+
+    # Obtener maridajes recomendados
+    maridajes = plato.get('maridaje', [])
+    if isinstance(maridajes, str):
+        # Si es una cadena, convertir a lista y limpiar
+        maridajes = [m.strip().lower() for m in maridajes.split(',')]
+    elif not isinstance(maridajes, list):
+        maridajes = []
+
+    return acidity, body, maridajes
+
+
+class BatchRecommender:
+    """Calcula las recomendaciones de todos los platos de un menú en una sola pasada.
+
+    Para cada tipo de vino se construye una matriz de distancias (platos x vinos)
+    por broadcasting, se calculan los cuantiles de precio por plato sobre los
+    vinos que cumplen la tolerancia y se elige, en cada rango de precio, el vino
+    con mayor score = rating * log(num_reviews + 1). El resultado coincide con
+    llamar a ``WineRecommendationApp.recommend_wines`` plato a plato.
+    """
+
+    def __init__(self, df_vinos: pd.DataFrame, wine_index: Optional[WineIndex] = None,
+                 tolerance: float = 0.4):
+        self.df_vinos = df_vinos
+        self.wine_index = wine_index if wine_index is not None else WineIndex(df_vinos)
+        self.tolerance = tolerance
+
+        self._price, self._score = score_arrays(df_vinos)
+
+    def recommend_all(self, platos: Union[pd.DataFrame, Iterable[Dict]]) -> pd.DataFrame:
+        """Recomienda vinos para todos los platos de la colección.
+
+        Args:
+            platos: DataFrame o iterable de documentos de ``menu_database.platos``.
+
+        Returns:
+            Un DataFrame con una fila por (plato, tipo de vino, rango de precio),
+            con las columnas del catálogo más ``nombre_plato``, ``distance``,
+            ``score``, ``price_range`` y ``wine_type_category``.
+        """
+        platos = self._as_list(platos)
+        return self._build_frame(platos, self._compute_picks(platos))
+
+    def recommend_each(self, platos: Union[pd.DataFrame, Iterable[Dict]]) -> List[pd.DataFrame]:
+        """Como ``recommend_all``, pero devuelve un DataFrame por plato.
+
+        Cada DataFrame tiene las mismas columnas que ``recommend_wines`` (sin
+        ``nombre_plato``), así que sirve aunque haya platos con el mismo nombre.
+        """
+        platos = self._as_list(platos)
+        picks = self._compute_picks(platos)
+        frame = self._build_frame(platos, picks)
+        if frame.empty:
+            return [pd.DataFrame() for _ in platos]
+
+        frame = frame.drop(columns='nombre_plato')
+        dish_of_row = np.array([k[0] for k in sorted(picks)])
+        bounds = np.searchsorted(dish_of_row, np.arange(len(platos) + 1))
+        return [frame.iloc[bounds[i]:bounds[i + 1]].reset_index(drop=True) if bounds[i] < bounds[i + 1]
+                else pd.DataFrame() for i in range(len(platos))]
+
+    @staticmethod
+    def _as_list(platos: Union[pd.DataFrame, Iterable[Dict]]) -> List[Dict]:
+        if isinstance(platos, pd.DataFrame):
+            return platos.to_dict('records')
+        return list(platos)
+
+    def _compute_picks(self, platos: List[Dict]) -> Dict[Tuple[int, str, int], Tuple[int, float, float]]:
+        """Elige el mejor vino de cada (plato, tipo, rango de precio)"""
+        targets = np.zeros((len(platos), 2))
+        dishes_by_type: Dict[str, List[int]] = {}
+        catalogue_types = set(self.wine_index.wine_types)
+
+        for i, plato in enumerate(platos):
+            acidity, body, maridajes = plato_properties(plato)
+            targets[i] = acidity, body
+            for wine_type in {m.lower() for m in maridajes} & catalogue_types:
+                dishes_by_type.setdefault(wine_type, []).append(i)
+
+        targets = np.clip(targets / ESCALA_ORGANOLEPTICA, 0, 1)
+
+        # (plato, tipo, rango) -> (posición del vino, distancia, score)
+        picks: Dict[Tuple[int, str, int], Tuple[int, float, float]] = {}
+        for wine_type, dish_ids in dishes_by_type.items():
+            rows, acidity, body = self.wine_index.arrays(wine_type)
+            if rows.size == 0:
+                continue
+            chunk = max(1, MAX_MATRIX_CELLS // rows.size)
+            for start in range(0, len(dish_ids), chunk):
+                ids = np.asarray(dish_ids[start:start + chunk])
+                self._pick_for_type(wine_type, ids, targets[ids], rows, acidity, body, picks)
+
+        return picks
+
+    def _pick_for_type(self, wine_type: str, dish_ids: np.ndarray, targets: np.ndarray,
+                       rows: np.ndarray, acidity: np.ndarray, body: np.ndarray,
+                       picks: Dict[Tuple[int, str, int], Tuple[int, float, float]]) -> None:
+        """Selecciona el mejor vino de cada rango para un bloque de platos y un tipo"""
+        distances = np.sqrt((acidity[None, :] - targets[:, 0:1]) ** 2 +
+                            (body[None, :] - targets[:, 1:2]) ** 2)
+
+        # Si un plato no tiene vinos dentro de la tolerancia, se amplía (máximo 0.8)
+        within = distances <= self.tolerance
+        widened = distances <= min(self.tolerance * 1.5, 0.8)
+        selected = np.where(within.any(axis=1)[:, None], within, widened)
+
+        price = np.broadcast_to(self._price[rows], distances.shape)
+        masked_price = np.where(selected, price, np.nan)
+        has_prices = ~np.isnan(masked_price).all(axis=1)
+        if not has_prices.any():
+            return
+
+        p33 = np.full(len(dish_ids), np.nan)
+        p66 = np.full(len(dish_ids), np.nan)
+        p33[has_prices], p66[has_prices] = np.nanquantile(masked_price[has_prices], [0.33, 0.66], axis=1)
+
+        tiers = (
+            selected & (price <= p33[:, None]),
+            selected & (price > p33[:, None]) & (price <= p66[:, None]),
+            selected & (price > p66[:, None]),
+        )
+
+        score = np.broadcast_to(self._score[rows], distances.shape)
+        for tier, tier_mask in enumerate(tiers):
+            tier_score = np.where(tier_mask, score, -np.inf)
+            best_score = tier_score.max(axis=1)
+            # A igualdad de score gana el vino más cercano, como en la búsqueda por plato
+            ties = tier_mask & (tier_score == best_score[:, None])
+            best = np.where(ties, distances, np.inf).argmin(axis=1)
+            for k in np.flatnonzero(tier_mask.any(axis=1)):
+                picks[(int(dish_ids[k]), wine_type, tier)] = (
+                    int(rows[best[k]]), float(distances[k, best[k]]), float(score[k, best[k]])
+                )
+
+    def _build_frame(self, platos: List[Dict],
+                     picks: Dict[Tuple[int, str, int], Tuple[int, float, float]]) -> pd.DataFrame:
+        """Construye el DataFrame de resultados en el orden plato -> tipo -> rango"""
+        if not picks:
+            return pd.DataFrame()
+
+        keys = sorted(picks)
+        positions = [picks[k][0] for k in keys]
+
+        result = self.df_vinos.iloc[positions].reset_index(drop=True)
+        result.insert(0, 'nombre_plato', [platos[k[0]].get('nombre_plato', '') for k in keys])
+        result['distance'] = [picks[k][1] for k in keys]
+        result['score'] = [picks[k][2] for k in keys]
+        result['price_range'] = [PRICE_RANGES[k[2]] for k in keys]
+        result['wine_type_category'] = [k[1].capitalize() for k in keys]
+        return result
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Precalcula las recomendaciones de todo el menú y las guarda en CSV"""
+    from menu_repository import get_repository
+
+    parser = argparse.ArgumentParser(description="Recomendaciones de vino para todos los platos del menú")
+    parser.add_argument('--vinos', default=WINE_CSV_PATH, help="Ruta del dataset de vinos")
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/', help="Conexión a MongoDB")
+    parser.add_argument('--salida', default='./data/recomendaciones.csv', help="Fichero CSV de salida")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    df_vinos = load_wine_catalogue(args.vinos)
+
+    platos = get_repository(args.mongo_uri).find_platos()
+
+    recomendaciones = BatchRecommender(df_vinos).recommend_all(platos)
+    recomendaciones.to_csv(args.salida, index=False)
+    logger.info(f"Recomendaciones guardadas en {args.salida}: {len(recomendaciones)} filas "
+                f"para {len(platos)} platos")
+
+
+if __name__ == "__main__":
+    main()
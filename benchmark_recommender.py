@@ -0,0 +1,235 @@
+import argparse
+import datetime
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from recommender import WineRecommender
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+BENCHMARK_OUTPUT_PATH = './data/benchmark_recomendador.json'
+
+# Valores con la misma forma que el dataset de Kaggle (wines_SPA.csv) tras la limpieza de vinos.ipynb
+WINE_TYPES = ['Toro Red', 'Tempranillo', 'Rioja Red', 'Ribera Del Duero Red', 'Red', 'Priorat Red',
+              'Albarino', 'Sherry', 'Cava', 'Verdejo', 'Rioja White', 'Mencia', 'Grenache', 'Sparkling',
+              'Monastrell', 'Syrah', 'Chardonnay', 'Cabernet Sauvignon', 'Pedro Ximenez', 'Montsant Red',
+              'Sauvignon Blanc']
+REGIONS = ['Toro', 'Vino de Espana', 'Ribera del Duero', 'Rioja', 'Priorato', 'Jerez-Xeres-Sherry',
+           'Rias Baixas', 'Cava', 'Rueda', 'Bierzo', 'Montsant', 'Jumilla', 'Penedes', 'Campo de Borja']
+BODY_LEVELS = np.array([2, 3, 4, 5])
+ACIDITY_LEVELS = np.array([1, 2, 3])
+
+
+def synthetic_catalogue(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """Genera un catálogo con el esquema de ``data/vinos.csv``.
+
+    Las columnas de texto se crean como categóricas (igual que las carga el
+    almacén columnar) para poder generar millones de filas sin millones de
+    cadenas de Python. Cuerpo y acidez toman los niveles discretos del dataset
+    original, escalados a 0-1, y un ~15% de vinos no tiene tipo, cuerpo ni acidez.
+    """
+    rng = np.random.default_rng(seed)
+    n_names = max(1, min(n_rows, 50_000))
+
+    def categorical(labels: List[str], size: int) -> pd.Categorical:
+        return pd.Categorical.from_codes(rng.integers(0, len(labels), size), categories=labels)
+
+    years = [str(y) for y in range(1910, 2022)] + ['N.V.']
+    df = pd.DataFrame({
+        'winery': categorical([f'Bodega {i}' for i in range(max(1, n_names // 15))], n_rows),
+        'wine': categorical([f'Vino {i}' for i in range(n_names)], n_rows),
+        'year': categorical(years, n_rows),
+        'rating': np.round(rng.uniform(4.2, 4.9, n_rows), 1),
+        'num_reviews': np.minimum(rng.lognormal(5.0, 1.3, n_rows).astype(np.int64) + 25, 32_624),
+        'region': categorical(REGIONS, n_rows),
+        'price': np.round(np.clip(rng.lognormal(3.4, 1.0, n_rows), 4.99, 3_119.0), 2),
+        'type': categorical(WINE_TYPES, n_rows),
+        'body': (rng.choice(BODY_LEVELS, n_rows) - 2) / 3.0,
+        'acidity': (rng.choice(ACIDITY_LEVELS, n_rows) - 1) / 2.0,
+    })
+
+    missing = rng.random(n_rows) < 0.15
+    df.loc[missing, ['body', 'acidity']] = np.nan
+    df.loc[missing & (rng.random(n_rows) < 0.1), 'type'] = np.nan
+    # La aplicación trabaja con los tipos en minúsculas
+    df['type'] = df['type'].cat.rename_categories(str.lower)
+    return df
+
+
+def synthetic_platos(n_platos: int, seed: int = 0) -> List[Dict]:
+    """Platos con acidez y cuerpo (0-5) y 2-4 maridajes del catálogo"""
+    rng = np.random.default_rng(seed + 1)
+    types = [t.lower() for t in WINE_TYPES]
+    return [
+        {
+            'nombre_plato': f'Plato {i}',
+            'acidez': round(float(rng.uniform(0, 5)), 1),
+            'cuerpo': round(float(rng.uniform(0, 5)), 1),
+            'maridaje': list(rng.choice(types, int(rng.integers(2, 5)), replace=False)),
+        }
+        for i in range(n_platos)
+    ]
+
+
+def _stats(latencies: List[float]) -> Dict[str, float]:
+    values = np.asarray(latencies) * 1000
+    total = float(values.sum()) / 1000
+    return {
+        'llamadas': len(values),
+        'media_ms': round(float(values.mean()), 4),
+        'p50_ms': round(float(np.percentile(values, 50)), 4),
+        'p90_ms': round(float(np.percentile(values, 90)), 4),
+        'p95_ms': round(float(np.percentile(values, 95)), 4),
+        'p99_ms': round(float(np.percentile(values, 99)), 4),
+        'max_ms': round(float(values.max()), 4),
+        'por_segundo': round(len(values) / total, 2) if total else None,
+    }
+
+
+def _peak_memory_mb(call: Callable[[], object]) -> float:
+    """Memoria máxima reservada durante una llamada (tracemalloc también registra los arrays de NumPy)"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 2 ** 20, 3)
+
+
+def _max_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux lo devuelve en KiB y macOS en bytes
+    return round(rss / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+
+def benchmark_size(n_rows: int, platos: List[Dict], seed: int = 0, memory_samples: int = 5) -> Dict:
+    """Mide las funciones del camino de recomendación para un tamaño de catálogo"""
+    start = time.perf_counter()
+    df_vinos = synthetic_catalogue(n_rows, seed)
+    generation_s = time.perf_counter() - start
+
+    recommender = WineRecommender()
+    start = time.perf_counter()
+    recommender.set_catalogue(df_vinos)
+    index_s = time.perf_counter() - start
+
+    # Argumentos de cada llamada: (acidez, cuerpo, maridajes, tipo evaluado)
+    cases = []
+    for plato in platos:
+        wine_type = next((t for t in plato['maridaje'] if t in recommender.wine_types), plato['maridaje'][0])
+        cases.append((plato['acidez'], plato['cuerpo'], plato['maridaje'], wine_type))
+
+    def filter_call(case):
+        acidity, body, maridajes, wine_type = case
+        return recommender.filter_wines_by_similarity(df_vinos, acidity, body, wine_type, maridajes)
+
+    filtered = [filter_call(case) for case in cases]
+    ranges = [recommender.divide_wines_by_price_ranges(df) for df in filtered]
+    range_frames = [df_range for r in ranges for df_range in r.values()]
+
+    functions = {
+        'filter_wines_by_similarity': (filter_call, cases),
+        'divide_wines_by_price_ranges': (recommender.divide_wines_by_price_ranges, filtered),
+        'select_best_wine_in_range': (recommender.select_best_wine_in_range, range_frames),
+        'recommend_wines': (lambda case: recommender.recommend_wines(df_vinos, case[0], case[1], case[2]), cases),
+        'rank_wines_top5': (lambda case: recommender.rank_wines(df_vinos, case[0], case[1], case[2], top_k=5), cases),
+    }
+
+    results = {}
+    for name, (function, arguments) in functions.items():
+        function(arguments[0])  # calentamiento
+        latencies = []
+        for argument in arguments:
+            t0 = time.perf_counter()
+            function(argument)
+            latencies.append(time.perf_counter() - t0)
+        results[name] = _stats(latencies)
+        step = max(1, len(arguments) // memory_samples)
+        results[name]['pico_memoria_mb'] = max(_peak_memory_mb(lambda a=a: function(a)) for a in arguments[::step])
+        logger.info(f"{n_rows:>11,} vinos | {name:<30} p50 {results[name]['p50_ms']:.3f} ms "
+                    f"p99 {results[name]['p99_ms']:.3f} ms")
+
+    return {
+        'filas': n_rows,
+        'platos': len(platos),
+        'generacion_catalogo_s': round(generation_s, 3),
+        'construccion_indice_s': round(index_s, 3),
+        'memoria_catalogo_mb': round(df_vinos.memory_usage(deep=True).sum() / 2 ** 20, 1),
+        'max_rss_mb': _max_rss_mb(),
+        'funciones': results,
+    }
+
+
+def run_benchmark(sizes: List[int], n_platos: int = 200, seed: int = 0) -> Dict:
+    """Ejecuta el benchmark para cada tamaño de catálogo (de menor a mayor).
+
+    Si un tamaño agota la memoria se registra el error y no se prueban los
+    tamaños mayores.
+    """
+    platos = synthetic_platos(n_platos, seed)
+    report = {
+        'metadatos': {
+            'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+            'semilla': seed,
+        },
+        'resultados': [],
+    }
+    for n_rows in sorted(sizes):
+        try:
+            report['resultados'].append(benchmark_size(n_rows, platos, seed))
+        except MemoryError as e:
+            logger.error(f"Memoria agotada con {n_rows:,} vinos: {e}")
+            report['resultados'].append({'filas': n_rows, 'error': f'MemoryError: {e}'})
+            break
+        finally:
+            gc.collect()
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Benchmark del camino de recomendación con catálogos sintéticos"""
+    parser = argparse.ArgumentParser(description="Benchmark de recommend_wines y sus funciones con catálogos sintéticos")
+    parser.add_argument('--filas', type=int, nargs='+', default=DEFAULT_SIZES, help="Tamaños de catálogo")
+    parser.add_argument('--platos', type=int, default=200, help="Platos (consultas) por tamaño")
+    parser.add_argument('--semilla', type=int, default=0, help="Semilla de los datos sintéticos")
+    parser.add_argument('--salida', default=BENCHMARK_OUTPUT_PATH, help="Fichero JSON con los resultados")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    report = run_benchmark(args.filas, args.platos, args.semilla)
+
+    directory = os.path.dirname(args.salida)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(f"Resultados guardados en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
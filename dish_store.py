@@ -0,0 +1,253 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+import pymongo
+
+from batch_recommender import plato_properties
+from menu_repository import MenuRepository, document_fingerprint
+
+logger = logging.getLogger(__name__)
+
+# Campos de cada plato que se mantienen en memoria para los selectores y el ranking
+SUMMARY_FIELDS = ['nombre_plato', 'categoria', 'restaurante', 'acidez', 'cuerpo', 'maridaje']
+
+# Código de error de MongoDB cuando el servidor no admite change streams (standalone)
+CHANGE_STREAM_NOT_SUPPORTED = 40573
+
+
+class DishRecord(NamedTuple):
+    """Resumen inmutable de un plato con sus propiedades ya interpretadas"""
+    nombre_plato: Optional[str]
+    categoria: Optional[str]
+    restaurante: Optional[str]
+    acidez: float
+    cuerpo: float
+    maridaje: Tuple[str, ...]
+
+    @classmethod
+    def from_document(cls, document: Dict) -> 'DishRecord':
+        try:
+            acidity, body, maridajes = plato_properties(document)
+        except (TypeError, ValueError):
+            logger.warning(f"Acidez o cuerpo no numéricos en el plato {document.get('nombre_plato')!r}")
+            acidity, body, maridajes = 0.0, 0.0, plato_properties({'maridaje': document.get('maridaje')})[2]
+        return cls(document.get('nombre_plato'), document.get('categoria'), document.get('restaurante'),
+                   acidity, body, tuple(maridajes))
+
+
+class DishCatalogue:
+    """Índices de los platos de una versión del menú, construidos una sola vez.
+
+    Resuelve con diccionarios el número de platos, las categorías, los platos
+    de cada categoría (ya ordenados) y el registro de un plato por nombre,
+    para todos los restaurantes (``None``) y para cada uno. No se modifica:
+    cada versión del menú tiene su propio catálogo.
+    """
+
+    def __init__(self, records: Iterable[DishRecord], version: int = 0):
+        self.version = version
+        self._by_name: Dict[Tuple[Optional[str], str], DishRecord] = {}
+        counts: Dict[Optional[str], int] = {}
+        names: Dict[Tuple[Optional[str], str], set] = {}
+
+        for record in records:
+            scopes = (None, record.restaurante) if record.restaurante else (None,)
+            for scope in scopes:
+                counts[scope] = counts.get(scope, 0) + 1
+                if record.nombre_plato is not None:
+                    self._by_name.setdefault((scope, record.nombre_plato), record)
+                    if record.categoria is not None:
+                        names.setdefault((scope, record.categoria), set()).add(record.nombre_plato)
+
+        self._counts = counts
+        self._names = {key: sorted(values) for key, values in names.items()}
+        categories: Dict[Optional[str], List[str]] = {}
+        for scope, categoria in sorted(names, key=lambda k: (str(k[0]), k[1])):
+            categories.setdefault(scope, []).append(categoria)
+        self._categories = categories
+
+    def __len__(self) -> int:
+        return self._counts.get(None, 0)
+
+    def count(self, restaurante: Optional[str] = None) -> int:
+        return self._counts.get(restaurante or None, 0)
+
+    def categories(self, restaurante: Optional[str] = None) -> List[str]:
+        return list(self._categories.get(restaurante or None, []))
+
+    def dish_names(self, categoria: str, restaurante: Optional[str] = None) -> List[str]:
+        return list(self._names.get((restaurante or None, categoria), []))
+
+    def get(self, nombre_plato: str, restaurante: Optional[str] = None) -> Optional[DishRecord]:
+        """Registro de un plato por nombre (de cualquier restaurante si no se indica)"""
+        return self._by_name.get((restaurante or None, nombre_plato))
+
+
+class DishStore:
+    """Copia en memoria de los platos del menú que se actualiza de forma incremental.
+
+    Se carga una vez y después aplica los eventos del change stream de
+    ``menu_database.platos`` (insert/update/replace/delete) según llegan. En
+    servidores standalone, sin change streams, consulta la colección cada
+    ``poll_interval`` segundos y aplica solo las diferencias. Cada cambio
+    incrementa ``version``, que sirve para invalidar las cachés que dependan
+    de los platos, y las consultas se resuelven con el ``DishCatalogue`` de
+    esa versión.
+    """
+
+    def __init__(self, repository: MenuRepository, poll_interval: float = 30.0):
+        self.repository = repository
+        self.poll_interval = poll_interval
+        self.version = 0
+        self.mode = 'inicial'
+        self.last_error: Optional[str] = None
+        self.loaded = threading.Event()
+
+        self._records: Dict[Any, DishRecord] = {}
+        self._hashes: Dict[Any, str] = {}
+        self._catalogue: Optional[DishCatalogue] = None
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # --- Ciclo de vida -------------------------------------------------
+
+    def start(self) -> 'DishStore':
+        """Arranca el hilo que mantiene la copia sincronizada"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='dish-store', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def refresh(self) -> bool:
+        """Sincroniza con la colección completa; devuelve True si hubo cambios"""
+        try:
+            documents = self.repository.find_platos(include_id=True)
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"Error sincronizando platos: {e}")
+            return False
+
+        self.last_error = None
+        hashes = {doc['_id']: self._hash(doc) for doc in documents}
+        with self._lock:
+            self.loaded.set()
+            if hashes == self._hashes:
+                return False
+            self._records = {doc['_id']: DishRecord.from_document(doc) for doc in documents}
+            self._hashes = hashes
+            self.version += 1
+        logger.info(f"Platos sincronizados: {len(documents)} registros (versión {self.version})")
+        return True
+
+    # --- Aplicación de eventos ----------------------------------------
+
+    def apply_change(self, event: Dict) -> None:
+        """Aplica un evento del change stream a la copia en memoria"""
+        operation = event.get('operationType')
+        dish_id = event.get('documentKey', {}).get('_id')
+        document = event.get('fullDocument')
+
+        with self._lock:
+            if operation in ('insert', 'update', 'replace'):
+                if document is None:
+                    # El documento se borró antes de poder leerlo: llegará su 'delete'
+                    return
+                self._records[dish_id] = DishRecord.from_document(document)
+                self._hashes.pop(dish_id, None)
+            elif operation == 'delete':
+                self._records.pop(dish_id, None)
+                self._hashes.pop(dish_id, None)
+            elif operation in ('drop', 'rename', 'dropDatabase', 'invalidate'):
+                self._records.clear()
+                self._hashes.clear()
+            else:
+                return
+            self.version += 1
+
+    @staticmethod
+    def _hash(document: Dict) -> str:
+        return document_fingerprint(document)
+
+    # --- Sincronización en segundo plano ------------------------------
+
+    def _run(self) -> None:
+        resume_token = None
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                with self.repository.watch(SUMMARY_FIELDS, resume_after=resume_token) as stream:
+                    # El stream se abre antes de la carga para no perder cambios intermedios
+                    if resume_token is None:
+                        self.refresh()
+                    self.mode = 'change_stream'
+                    backoff = 1.0
+                    while not self._stop.is_set() and stream.alive:
+                        event = stream.try_next()
+                        resume_token = stream.resume_token
+                        if event is not None:
+                            self.apply_change(event)
+            except pymongo.errors.OperationFailure as e:
+                if e.code == CHANGE_STREAM_NOT_SUPPORTED or 'replica set' in str(e).lower():
+                    logger.info("Change streams no disponibles; se usará sondeo periódico")
+                    self._poll()
+                    return
+                # Si el token ya no es válido (historial perdido) se vuelve a cargar todo
+                resume_token = None
+                self._wait_after_error(e, backoff)
+                backoff = min(backoff * 2, 60.0)
+            except Exception as e:
+                self._wait_after_error(e, backoff)
+                backoff = min(backoff * 2, 60.0)
+
+    def _poll(self) -> None:
+        self.mode = 'sondeo'
+        self.refresh()
+        while not self._stop.wait(self.poll_interval):
+            self.refresh()
+
+    def _wait_after_error(self, error: Exception, delay: float) -> None:
+        self.last_error = str(error)
+        self.mode = 'reconectando'
+        logger.warning(f"Change stream de platos interrumpido, reintento en {delay:.0f}s: {error}")
+        self._stop.wait(delay)
+
+    # --- Consultas -----------------------------------------------------
+
+    def catalogue(self) -> DishCatalogue:
+        """Catálogo indexado de la versión actual (se construye la primera vez que se pide)"""
+        with self._lock:
+            if self._catalogue is None or self._catalogue.version != self.version:
+                self._catalogue = DishCatalogue(self._records.values(), self.version)
+            return self._catalogue
+
+    def count(self, restaurante: Optional[str] = None) -> int:
+        """Número de platos del menú"""
+        return self.catalogue().count(restaurante)
+
+    def categories(self, restaurante: Optional[str] = None) -> List[str]:
+        """Categorías únicas de platos"""
+        return self.catalogue().categories(restaurante)
+
+    def dish_names(self, categoria: str, restaurante: Optional[str] = None) -> List[str]:
+        """Nombres de los platos de una categoría"""
+        return self.catalogue().dish_names(categoria, restaurante)
+
+    def get(self, nombre_plato: str, restaurante: Optional[str] = None) -> Optional[DishRecord]:
+        """Registro (con acidez, cuerpo y maridajes ya interpretados) de un plato"""
+        return self.catalogue().get(nombre_plato, restaurante)
+
+    def wait_until_loaded(self, timeout: float = 5.0) -> bool:
+        """Espera a la primera carga (o a un error) para no mostrar un menú vacío al arrancar"""
+        deadline = time.monotonic() + timeout
+        while not self.loaded.is_set() and self.last_error is None and time.monotonic() < deadline:
+            self.loaded.wait(0.05)
+        return self.loaded.is_set()
@@ -0,0 +1,345 @@
+import argparse
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from menu_repository import normalize_dish_name
+from recommendation_table import catalogue_version
+from similarity_engine import DEFAULT_POOL, TextFeatures, _as_text, _normalize_rows
+from wine_inventory import wine_keys
+from wine_store import WINE_CSV_PATH, WINE_STORE_PATH, load_wine_catalogue
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_INDEX_PATH = os.getenv('EMBEDDING_INDEX_PATH', './data/indice_vinos')
+DEFAULT_EMBEDDINGS = 'hashing:256'
+
+META_FILE = 'meta.json'
+INDEX_FORMAT_VERSION = 1
+
+# Número máximo de celdas (vinos x centroides) de cada bloque al asignar listas
+MAX_ASSIGN_CELLS = 8_000_000
+
+WINE_TEXT_FIELDS = ('wine', 'winery', 'region', 'type', 'description', 'descripcion')
+DISH_TEXT_FIELDS = ('nombre_plato', 'descripcion', 'ingredientes_clave')
+
+
+def wine_texts(df_vinos: pd.DataFrame) -> List[str]:
+    """Texto de cada vino para el modelo de embeddings (nombre, bodega, región, tipo y descripción si la hay)"""
+    fields = [f for f in WINE_TEXT_FIELDS if f in df_vinos.columns]
+    columns = [df_vinos[f].astype(str).replace('nan', '').to_numpy(dtype=object) for f in fields]
+    return [' '.join(v for v in values if v) for values in zip(*columns)]
+
+
+def dish_text(plato: Dict) -> str:
+    """Texto del plato para el modelo de embeddings (nombre, descripción e ingredientes)"""
+    return ' '.join(t for t in (_as_text(plato.get(f)) for f in DISH_TEXT_FIELDS) if t)
+
+
+class HashingEmbedder:
+    """Embeddings de bolsa de palabras con hashing: no necesitan modelo ni red"""
+
+    def __init__(self, dim: int = 256):
+        self.spec = f'hashing:{dim}'
+        self._features = TextFeatures(dim)
+        self._features.wine_fields = WINE_TEXT_FIELDS
+        self._features.dish_fields = DISH_TEXT_FIELDS
+
+    def embed_wines(self, df_vinos: pd.DataFrame) -> np.ndarray:
+        return self._features.wine_matrix(df_vinos).astype(np.float32)
+
+    def embed_dish(self, plato: Dict) -> Optional[np.ndarray]:
+        return self._features.dish_vector(plato).astype(np.float32)
+
+
+class LocalModelEmbedder:
+    """Modelo de ``sentence-transformers`` cargado desde disco (p.ej. un multilingual-MiniLM descargado).
+
+    ``sentence-transformers`` es opcional: solo se importa al usar este embedder.
+    """
+
+    def __init__(self, model_path: str, batch_size: int = 256):
+        from sentence_transformers import SentenceTransformer
+
+        self.spec = f'modelo:{model_path}'
+        self.batch_size = batch_size
+        self._model = SentenceTransformer(model_path, device='cpu')
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self._model.encode(texts, batch_size=self.batch_size, normalize_embeddings=True,
+                                  convert_to_numpy=True, show_progress_bar=False).astype(np.float32)
+
+    def embed_wines(self, df_vinos: pd.DataFrame) -> np.ndarray:
+        texts = wine_texts(df_vinos)
+        # Los vinos repetidos (misma bodega, nombre y región) se codifican una vez
+        codes, unique = pd.factorize(pd.Series(texts))
+        return self._encode(list(unique))[codes]
+
+    def embed_dish(self, plato: Dict) -> Optional[np.ndarray]:
+        return self._encode([dish_text(plato)])[0]
+
+
+class PrecomputedEmbedder:
+    """Embeddings calculados fuera de línea en un fichero ``.npz``.
+
+    El fichero contiene ``claves`` (``'bodega|vino|año'``) y ``vectores`` de
+    los vinos y, opcionalmente, ``platos`` (nombres) y ``vectores_platos``.
+    Los vinos sin vector quedan fuera del índice; los platos sin vector no
+    tienen embedding y se recomiendan con la búsqueda por acidez y cuerpo.
+    """
+
+    def __init__(self, path: str):
+        self.spec = f'fichero:{path}'
+        data = np.load(path, allow_pickle=False)
+        keys = pd.Index(data['claves'].astype(str))
+        first = ~keys.duplicated()
+        self._wine_keys = keys[first]
+        self._wine_vectors = _normalize_rows(data['vectores'].astype(np.float32)[first])
+        self._dishes: Dict[str, np.ndarray] = {}
+        if 'platos' in data:
+            vectors = _normalize_rows(data['vectores_platos'].astype(np.float32))
+            self._dishes = {normalize_dish_name(n): v for n, v in zip(data['platos'].astype(str), vectors)}
+
+    def embed_wines(self, df_vinos: pd.DataFrame) -> np.ndarray:
+        found = self._wine_keys.get_indexer(wine_keys(df_vinos))
+        vectors = np.zeros((len(df_vinos), self._wine_vectors.shape[1]), dtype=np.float32)
+        vectors[found >= 0] = self._wine_vectors[found[found >= 0]]
+        if (found < 0).any():
+            logger.warning(f"{int((found < 0).sum())} vinos sin embedding en {self.spec}")
+        return vectors
+
+    def embed_dish(self, plato: Dict) -> Optional[np.ndarray]:
+        return self._dishes.get(normalize_dish_name(plato.get('nombre_plato', '')))
+
+
+def embedder_from_spec(spec: str):
+    """Crea el embedder descrito por ``hashing:<dim>``, ``modelo:<ruta>`` o ``fichero:<ruta.npz>``"""
+    kind, _, value = spec.partition(':')
+    if kind == 'hashing':
+        return HashingEmbedder(int(value or 256))
+    if kind == 'modelo':
+        return LocalModelEmbedder(value)
+    if kind == 'fichero':
+        return PrecomputedEmbedder(value)
+    raise ValueError(f"Embeddings desconocidos: {spec}")
+
+
+def spherical_kmeans(vectors: np.ndarray, n_lists: int, iterations: int = 10, sample: int = 50_000,
+                     seed: int = 0) -> np.ndarray:
+    """Centroides (normalizados) de k-means por coseno sobre una muestra de los vectores"""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample:
+        vectors = vectors[rng.choice(len(vectors), sample, replace=False)]
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = (vectors @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = np.bincount(assignment, minlength=n_lists) == 0
+        # Las listas vacías se reinician con vectores al azar
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = _normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """Índice aproximado (IVF) de los embeddings de los vinos, filtrable por tipo.
+
+    Los vectores se reparten en ``n_lists`` listas por su centroide más
+    cercano y se guardan ordenados por (tipo, lista), con una tabla de offsets
+    por tipo y lista (formato CSR, como la rejilla de ``WineIndex``). Una
+    búsqueda solo recorre los vinos del tipo pedido en las listas cuyos
+    centroides más se parecen al plato. Todo son ``.npy`` que se abren con
+    ``mmap_mode='r'``, así que varios procesos comparten las páginas del índice.
+    """
+
+    def __init__(self, vectors: np.ndarray, positions: np.ndarray, centroids: np.ndarray,
+                 offsets: np.ndarray, types: List[str], meta: Dict):
+        self.vectors = vectors
+        self.positions = positions
+        self.centroids = centroids
+        self.offsets = offsets
+        self.types = types
+        self.meta = meta
+        self._type_ids = {t: i for i, t in enumerate(types)}
+
+    @property
+    def n_rows(self) -> int:
+        return self.meta['rows']
+
+    @classmethod
+    def build(cls, df_vinos: pd.DataFrame, vectors: np.ndarray, n_lists: Optional[int] = None,
+              seed: int = 0, meta: Optional[Dict] = None) -> 'IVFIndex':
+        """Construye el índice; los vinos sin tipo o con vector nulo no se indexan"""
+        vectors = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+        type_codes, types = pd.factorize(df_vinos['type'].astype('string').str.lower())
+        valid = np.flatnonzero((type_codes >= 0) & (np.abs(vectors).sum(axis=1) > 0))
+        if valid.size == 0:
+            raise ValueError("Ningún vino tiene tipo y embedding")
+        n_lists = min(n_lists or max(1, min(1024, int(np.sqrt(len(valid))))), len(valid))
+        centroids = spherical_kmeans(vectors[valid], n_lists, seed=seed)
+
+        lists = np.empty(len(valid), dtype=np.int64)
+        chunk = max(1, MAX_ASSIGN_CELLS // n_lists)
+        for start in range(0, len(valid), chunk):
+            lists[start:start + chunk] = (vectors[valid[start:start + chunk]] @ centroids.T).argmax(axis=1)
+
+        keys = type_codes[valid] * n_lists + lists
+        order = np.lexsort((valid, keys))
+        offsets = np.searchsorted(keys[order], np.arange(len(types) * n_lists + 1))
+        meta = dict(meta or {}, rows=len(df_vinos), indexados=len(valid), listas=n_lists,
+                    dimension=int(vectors.shape[1]), version_catalogo=catalogue_version(df_vinos))
+        return cls(np.ascontiguousarray(vectors[valid[order]]), valid[order].astype(np.int64), centroids,
+                   offsets, [str(t) for t in types], meta)
+
+    def save(self, path: str) -> str:
+        os.makedirs(path, exist_ok=True)
+        for name in ('vectors', 'positions', 'centroids', 'offsets'):
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+        # Los metadatos se escriben al final: un índice a medio generar no es válido
+        with open(os.path.join(path, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump(dict(self.meta, format_version=INDEX_FORMAT_VERSION, tipos=self.types), f, ensure_ascii=False)
+        logger.info(f"Índice de embeddings guardado en {path}: {self.meta['indexados']} vinos, "
+                    f"{self.meta['listas']} listas, dimensión {self.meta['dimension']}")
+        return path
+
+    @classmethod
+    def load(cls, path: str) -> 'IVFIndex':
+        """Abre un índice guardado mapeando sus arrays en memoria (solo lectura)"""
+        with open(os.path.join(path, META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format_version') != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Formato de índice no soportado en {path}")
+        arrays = {name: np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')
+                  for name in ('vectors', 'positions', 'centroids', 'offsets')}
+        return cls(types=meta['tipos'], meta=meta, **arrays)
+
+    def search(self, wine_type: str, query: np.ndarray, k: int = DEFAULT_POOL, nprobe: int = 8,
+               available: Optional[Callable[[np.ndarray], np.ndarray]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Los ``k`` vinos de un tipo más parecidos a ``query`` (posiciones y similitud coseno).
+
+        Se recorren las listas por orden de parecido de su centroide: al menos
+        ``nprobe`` y tantas más como hagan falta para reunir ``k`` candidatos
+        del tipo (y disponibles), de modo que un filtro selectivo no deja la
+        búsqueda sin resultados.
+        """
+        type_id = self._type_ids.get(wine_type.lower())
+        if type_id is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        n_lists = len(self.centroids)
+        bounds = self.offsets[type_id * n_lists:(type_id + 1) * n_lists + 1]
+
+        query = np.asarray(query, dtype=np.float32)
+        lists = np.argsort(-(self.centroids @ query))
+        positions, similarities = [], []
+        found = 0
+        for probed, list_id in enumerate(lists, start=1):
+            start, end = bounds[list_id], bounds[list_id + 1]
+            if end > start:
+                rows = self.positions[start:end]
+                similarity = self.vectors[start:end] @ query
+                if available is not None:
+                    keep = available(rows)
+                    rows, similarity = rows[keep], similarity[keep]
+                positions.append(rows)
+                similarities.append(similarity)
+                found += len(rows)
+            if probed >= nprobe and found >= k:
+                break
+
+        if not positions:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        positions, similarities = np.concatenate(positions), np.concatenate(similarities)
+        if len(positions) > k:
+            best = np.argpartition(-similarities, k - 1)[:k]
+            positions, similarities = positions[best], similarities[best]
+        return positions, similarities
+
+
+class EmbeddingSearch:
+    """Búsqueda por embeddings con la misma interfaz que ``SimilarityEngine``.
+
+    Se asigna a ``WineRecommender.similarity_engine``: ``rank_wines`` toma como
+    candidatos de cada tipo los ``pool`` vinos cuyo embedding más se parece al
+    del plato. Los embeddings de los platos se guardan en una caché LRU.
+    """
+
+    def __init__(self, index: IVFIndex, embedder, pool: int = DEFAULT_POOL, nprobe: int = 8,
+                 cache_size: int = 4096):
+        self.index = index
+        self.embedder = embedder
+        self.pool = pool
+        self.nprobe = nprobe
+        self.cache_size = cache_size
+        self._cache: 'OrderedDict[Tuple[str, str], Optional[np.ndarray]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path: str = EMBEDDING_INDEX_PATH, df_vinos: Optional[pd.DataFrame] = None,
+             **kwargs) -> 'EmbeddingSearch':
+        """Abre el índice guardado con el mismo embedder con que se construyó"""
+        index = IVFIndex.load(path)
+        if df_vinos is not None and index.meta.get('version_catalogo') != catalogue_version(df_vinos):
+            raise ValueError(f"El índice de {path} se construyó con otro catálogo de vinos")
+        return cls(index, embedder_from_spec(index.meta['embeddings']), **kwargs)
+
+    @property
+    def n_rows(self) -> int:
+        return self.index.n_rows
+
+    def dish_vector(self, plato: Dict) -> Optional[np.ndarray]:
+        """Embedding del plato (None si no se puede obtener, p.ej. un plato nuevo sin vector precalculado)"""
+        key = (str(plato.get('nombre_plato', '')), dish_text(plato))
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        vector = self.embedder.embed_dish(plato)
+        with self._lock:
+            self._cache[key] = vector
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return vector
+
+    def search(self, wine_type: str, dish_vector: np.ndarray,
+               available: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+               pool: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Candidatos de un tipo y sus distancias (``1 - coseno``), como ``SimilarityEngine.search``"""
+        positions, similarities = self.index.search(wine_type, dish_vector, pool or self.pool,
+                                                    self.nprobe, available)
+        return positions, 1.0 - similarities.astype(np.float64)
+
+
+def build_embedding_index(df_vinos: pd.DataFrame, embeddings: str = DEFAULT_EMBEDDINGS,
+                          path: str = EMBEDDING_INDEX_PATH, n_lists: Optional[int] = None) -> IVFIndex:
+    """Calcula los embeddings de los vinos, construye el índice IVF y lo guarda en ``path``"""
+    embedder = embedder_from_spec(embeddings)
+    vectors = embedder.embed_wines(df_vinos)
+    index = IVFIndex.build(df_vinos, vectors, n_lists, meta={'embeddings': embedder.spec})
+    index.save(path)
+    return index
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Construye el índice de embeddings del catálogo de vinos (sin conexión a internet)"""
+    parser = argparse.ArgumentParser(description="Índice aproximado de embeddings de los vinos")
+    parser.add_argument('--vinos', default=WINE_CSV_PATH, help="CSV de vinos")
+    parser.add_argument('--almacen', default=WINE_STORE_PATH, help="Almacén columnar de vinos")
+    parser.add_argument('--embeddings', default=DEFAULT_EMBEDDINGS,
+                        help="hashing:<dim>, modelo:<ruta de un modelo local> o fichero:<embeddings.npz>")
+    parser.add_argument('--listas', type=int, default=None, help="Número de listas del IVF (por defecto √n)")
+    parser.add_argument('--salida', default=EMBEDDING_INDEX_PATH, help="Directorio del índice")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    build_embedding_index(load_wine_catalogue(args.vinos, args.almacen), args.embeddings, args.salida, args.listas)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import random
+import threading
+import time
+from typing import Iterator, Optional
+
+
+class StubRateLimitError(Exception):
+    """Error equivalente a un 429 (cuota agotada) de la API de Gemini"""
+    code = 429
+
+
+class StubUsage:
+    """Recuento de tokens aproximado (4 caracteres por token), como ``usage_metadata`` de Gemini"""
+
+    def __init__(self, prompt: str, text: str):
+        self.prompt_token_count = len(prompt) // 4
+        self.candidates_token_count = len(text) // 4
+        self.total_token_count = self.prompt_token_count + self.candidates_token_count
+
+
+class StubResponse:
+    """Respuesta con la misma interfaz mínima que la de ``generate_content``"""
+
+    def __init__(self, text: str, usage_metadata: Optional[StubUsage] = None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class StubLLM:
+    """Modelo local que imita a ``genai.GenerativeModel`` sin acceso a red.
+
+    Permite medir el rendimiento de los flujos que llaman al LLM con una latencia
+    configurable y simular errores genéricos y de cuota (429).
+    """
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.0, failure_rate: float = 0.0,
+                 rate_limit_rate: float = 0.0, chunk_interval: float = 0.05, seed: Optional[int] = None):
+        self.latency = latency
+        self.chunk_interval = chunk_interval
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _sample(self):
+        with self._lock:
+            self.calls += 1
+            return (self._random.random(), self._random.random(),
+                    self._random.uniform(-self.jitter, self.jitter))
+
+    def generate_content(self, prompt: str, stream: bool = False):
+        """Simula una llamada a Gemini devolviendo un Markdown determinista.
+
+        Con ``stream=True`` devuelve un iterador de fragmentos: el primero llega
+        tras la latencia configurada y los siguientes cada ``chunk_interval``.
+        """
+        if stream:
+            return self._stream(prompt)
+
+        roll_rate_limit, roll_failure, delta = self._sample()
+        time.sleep(max(0.0, self.latency + delta))
+        self._raise_simulated_errors(roll_rate_limit, roll_failure)
+        text = self._text(prompt)
+        return StubResponse(text, StubUsage(prompt, text))
+
+    def _stream(self, prompt: str) -> Iterator[StubResponse]:
+        roll_rate_limit, roll_failure, delta = self._sample()
+        time.sleep(max(0.0, self.latency + delta))
+        self._raise_simulated_errors(roll_rate_limit, roll_failure)
+        text = self._text(prompt)
+        lines = text.splitlines(keepends=True)
+        for i, line in enumerate(lines):
+            if i:
+                time.sleep(self.chunk_interval)
+            # Como en Gemini, el recuento de tokens acumulado llega con el último fragmento
+            yield StubResponse(line, StubUsage(prompt, text) if i == len(lines) - 1 else None)
+
+    def _raise_simulated_errors(self, roll_rate_limit: float, roll_failure: float) -> None:
+        if roll_rate_limit < self.rate_limit_rate:
+            raise StubRateLimitError("429 Resource has been exhausted (stub)")
+        if roll_failure < self.failure_rate:
+            raise Exception("Error simulado del LLM (stub)")
+
+    @staticmethod
+    def _text(prompt: str) -> str:
+        return (
+            "### 🍷 Maridaje (stub)\n\n"
+            f"Narrativa generada localmente para un prompt de {len(prompt)} caracteres.\n"
+            "Sirve el vino a la temperatura recomendada."
+        )
@@ -0,0 +1,38 @@
+import threading
+import time
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Indica si un error del LLM corresponde a un límite de cuota (HTTP 429)"""
+    if getattr(error, 'code', None) == 429 or type(error).__name__ in ('ResourceExhausted', 'TooManyRequests'):
+        return True
+    message = str(error).lower()
+    return '429' in message or 'quota' in message or 'resource has been exhausted' in message
+
+
+class Throttle:
+    """Ritmo de llamadas compartido por todos los workers.
+
+    Limita las peticiones por minuto y, cuando un worker recibe un 429,
+    detiene a todos durante el tiempo de espera en lugar de que cada uno
+    siga consumiendo cuota por su cuenta.
+    """
+
+    def __init__(self, requests_per_minute: float = 0):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._paused_until)
+            self._next_slot = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
@@ -0,0 +1,397 @@
+import argparse
+import copy
+import datetime
+import itertools
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pymongo
+
+from benchmark_recommender import WINE_TYPES, _stats, synthetic_catalogue
+from dish_store import CHANGE_STREAM_NOT_SUPPORTED, DishCatalogue, DishStore
+from llm_stub import StubLLM
+from menu_repository import MenuRepository, Plato, normalize_dish_name
+from narratives import NarrativeCache
+from recommender import WineRecommender
+
+logger = logging.getLogger(__name__)
+
+LOAD_TEST_OUTPUT_PATH = './data/prueba_carga.json'
+LOAD_TEST_RESTAURANT = 'El Tribut'
+
+# Vocabulario de las fichas de sala de El Tribut (ver wines.py) para los platos sintéticos
+CATEGORIAS = ['Entrantes', 'Arroces', 'Pescados', 'Carnes', 'Postres']
+PROTEINAS = {'Entrantes': ['verduras', 'marisco', 'queso'], 'Arroces': ['marisco', 'pollo', 'verduras'],
+             'Pescados': ['pescado blanco', 'pescado azul', 'marisco'], 'Carnes': ['ternera', 'cordero', 'cerdo'],
+             'Postres': ['chocolate', 'fruta', 'lácteos']}
+COCCIONES = ['plancha', 'horno', 'brasa', 'guiso', 'frito', 'crudo']
+SALSAS = ['sin salsa', 'romesco', 'alioli', 'vino tinto', 'mantequilla', 'cítricos']
+ALERGENOS = ['gluten', 'lácteos', 'huevo', 'pescado', 'crustáceos', 'frutos secos', 'sulfitos']
+STAGES = ('menu', 'plato', 'ranking', 'narrativa', 'total')
+
+
+def tribut_platos(n_platos: int, seed: int = 0) -> List[Plato]:
+    """Platos con el esquema de ``menu_database.platos`` que produce la ingesta de la carta de El Tribut.
+
+    Como en la carta real, parte de los platos trae los maridajes en una cadena
+    separada por comas y la acidez o el cuerpo como texto (``"3.5."``).
+    """
+    rng = np.random.default_rng(seed + 2)
+    types = [t.lower() for t in WINE_TYPES]
+    platos = []
+    for i in range(n_platos):
+        categoria = CATEGORIAS[i % len(CATEGORIAS)]
+        proteina = str(rng.choice(PROTEINAS[categoria]))
+        maridaje = [str(t) for t in rng.choice(types, int(rng.integers(2, 5)), replace=False)]
+        acidez, cuerpo = round(float(rng.uniform(0, 5)), 1), round(float(rng.uniform(0, 5)), 1)
+        platos.append({
+            'restaurante': LOAD_TEST_RESTAURANT,
+            'nombre_plato': f'{categoria[:-1]} {i} de {proteina}',
+            'categoria': categoria,
+            'descripcion': f'{proteina.capitalize()} a la {rng.choice(COCCIONES)} con guarnición de temporada',
+            'ingredientes_clave': [proteina] + [str(x) for x in rng.choice(['ajo', 'tomate', 'aceite', 'hierbas',
+                                                                             'cebolla', 'limón'], 2, replace=False)],
+            'carne': proteina if categoria == 'Carnes' else 'ninguna',
+            'proteina_principal': proteina,
+            'salsa': str(rng.choice(SALSAS)),
+            'coccion': str(rng.choice(COCCIONES)),
+            'alergenos': [str(x) for x in rng.choice(ALERGENOS, int(rng.integers(0, 3)), replace=False)],
+            'maridaje': ', '.join(maridaje) if i % 3 == 0 else maridaje,
+            'acidez': f'{acidez}.' if i % 4 == 0 else acidez,
+            'cuerpo': cuerpo,
+        })
+    return platos
+
+
+class InMemoryMenuRepository(MenuRepository):
+    """``MenuRepository`` sobre diccionarios en memoria, sin MongoDB ni red.
+
+    Implementa las consultas que usan la aplicación y el servicio (platos,
+    recomendaciones materializadas e inventarios) devolviendo copias de los
+    documentos, como haría el servidor. ``latency`` simula el tiempo de ida y
+    vuelta de cada consulta. No admite change streams, así que ``DishStore`` lo
+    sincroniza por sondeo, igual que con un MongoDB standalone.
+    """
+
+    def __init__(self, platos: Iterable[Plato] = (), latency: float = 0.0):
+        super().__init__(uri='memoria://')
+        self.latency = latency
+        self._platos: Dict[int, Dict] = {}
+        self._recommendations: Dict[Any, Dict] = {}
+        self._inventories: Dict[str, Dict] = {}
+        self._ids = itertools.count(1)
+        self._data_lock = threading.Lock()
+        platos = list(platos)
+        if platos:
+            self.bulk_upsert_platos(platos)
+
+    def _round_trip(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _find(self, query: Dict[str, Any]) -> List[Dict]:
+        self._round_trip()
+        with self._data_lock:
+            return [copy.deepcopy(doc) for doc in self._platos.values()
+                    if all(doc.get(field) == value for field, value in query.items())]
+
+    def is_healthy(self, force: bool = False) -> bool:
+        return True
+
+    def ensure_indexes(self) -> None:
+        pass
+
+    def get_categories(self, restaurante: Optional[str] = None) -> List[str]:
+        return sorted({doc['categoria'] for doc in self._find(self._filter(restaurante)) if doc.get('categoria')})
+
+    def get_dish_names(self, categoria: str, restaurante: Optional[str] = None) -> List[str]:
+        return sorted({doc['nombre_plato'] for doc in self._find(self._filter(restaurante, categoria=categoria))
+                       if 'nombre_plato' in doc})
+
+    def count_platos(self, restaurante: Optional[str] = None) -> int:
+        return len(self._find(self._filter(restaurante)))
+
+    def find_platos(self, categoria: Optional[str] = None, restaurante: Optional[str] = None,
+                    include_id: bool = False) -> List[Plato]:
+        documents = self._find(self._filter(restaurante, categoria=categoria))
+        if not include_id:
+            for doc in documents:
+                doc.pop('_id')
+        return documents
+
+    def find_plato(self, nombre_plato: str, restaurante: Optional[str] = None) -> Optional[Plato]:
+        documents = self._find(self._filter(restaurante, nombre_plato=nombre_plato))
+        if not documents:
+            return None
+        documents[0].pop('_id')
+        return documents[0]
+
+    def watch(self, fields: List[str], resume_after: Optional[Dict] = None):
+        raise pymongo.errors.OperationFailure("Change streams no disponibles en memoria",
+                                              code=CHANGE_STREAM_NOT_SUPPORTED)
+
+    def insert_plato(self, plato: Plato):
+        self._round_trip()
+        with self._data_lock:
+            dish_id = next(self._ids)
+            self._platos[dish_id] = dict(copy.deepcopy(plato), _id=dish_id)
+            return dish_id
+
+    def bulk_upsert_platos(self, platos: List[Plato], restaurante: Optional[str] = None) -> Dict[str, int]:
+        summary = {'insertados': 0, 'actualizados': 0, 'sin_cambios': 0}
+        self._round_trip()
+        with self._data_lock:
+            by_key = {(doc.get('restaurante'), doc.get('nombre_normalizado')): dish_id
+                      for dish_id, doc in self._platos.items()}
+            for plato in platos:
+                document = {k: copy.deepcopy(v) for k, v in plato.items() if k not in ('_id', 'timestamp')}
+                if restaurante is not None:
+                    document['restaurante'] = restaurante
+                document['nombre_normalizado'] = normalize_dish_name(document.get('nombre_plato', ''))
+                key = (document.get('restaurante'), document['nombre_normalizado'])
+                dish_id = by_key.get(key)
+                if dish_id is None:
+                    dish_id = by_key[key] = next(self._ids)
+                    self._platos[dish_id] = dict(document, _id=dish_id, timestamp=datetime.datetime.now())
+                    summary['insertados'] += 1
+                elif any(self._platos[dish_id].get(k) != v for k, v in document.items()):
+                    self._platos[dish_id].update(document)
+                    summary['actualizados'] += 1
+                else:
+                    summary['sin_cambios'] += 1
+        return summary
+
+    def load_recommendations(self, catalogue_version: str) -> List[Dict]:
+        with self._data_lock:
+            return [copy.deepcopy(entry) for entry in self._recommendations.values()
+                    if entry.get('version_catalogo') == catalogue_version]
+
+    def save_recommendations(self, entries: List[Dict]) -> None:
+        with self._data_lock:
+            for entry in entries:
+                self._recommendations[entry['_id']] = copy.deepcopy(entry)
+
+    def delete_recommendations(self, dish_ids: List[Any]) -> None:
+        with self._data_lock:
+            for dish_id in dish_ids:
+                self._recommendations.pop(dish_id, None)
+
+    def load_inventories(self) -> List[Dict]:
+        with self._data_lock:
+            return [copy.deepcopy(document) for document in self._inventories.values()]
+
+    def save_inventory(self, restaurante: str, vinos: List[str], precios: List[Dict]) -> None:
+        with self._data_lock:
+            self._inventories[restaurante] = {'_id': restaurante, 'vinos': list(vinos), 'precios': list(precios),
+                                              'actualizado': datetime.datetime.now()}
+
+    def delete_inventory(self, restaurante: str) -> None:
+        with self._data_lock:
+            self._inventories.pop(restaurante, None)
+
+    def close(self) -> None:
+        pass
+
+
+class LoadTestRecommender(WineRecommender):
+    """``WineRecommender`` que cuenta cuántas veces se recurre a la recomendación de respaldo"""
+
+    def __init__(self):
+        super().__init__()
+        self.fallbacks = 0
+        self._fallbacks_lock = threading.Lock()
+
+    def _generate_fallback_recommendation(self, wine_data: Dict, plato_name: str) -> str:
+        with self._fallbacks_lock:
+            self.fallbacks += 1
+        return super()._generate_fallback_recommendation(wine_data, plato_name)
+
+
+def simulate_diner(recommender: WineRecommender, dish_store: DishStore, names: List[str], weights: np.ndarray,
+                   rng: np.random.Generator, top_k: int = 1) -> Dict[str, float]:
+    """Una visita a la aplicación: elige plato en los selectores, pide el ranking y la narrativa de un vino.
+
+    El plato se elige entre ``names`` con probabilidades ``weights``.
+
+    Returns:
+        Segundos de cada etapa (``STAGES``).
+    """
+    timings = {}
+    start = time.perf_counter()
+    menu = dish_store.catalogue()
+    nombre_plato = names[int(rng.choice(len(names), p=weights))]
+    record = menu.get(nombre_plato, LOAD_TEST_RESTAURANT)
+    menu.categories(LOAD_TEST_RESTAURANT)
+    menu.dish_names(record.categoria, LOAD_TEST_RESTAURANT)
+    timings['menu'] = time.perf_counter() - start
+
+    t0 = time.perf_counter()
+    plato = dish_store.repository.find_plato(nombre_plato, LOAD_TEST_RESTAURANT)
+    timings['plato'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    wines = recommender.rank_wines(recommender.df_vinos, record.acidez, record.cuerpo, list(record.maridaje),
+                                   top_k, restaurante=LOAD_TEST_RESTAURANT, plato=plato)
+    timings['ranking'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    if not wines.empty:
+        wine = wines.iloc[int(rng.integers(len(wines)))].to_dict()
+        recommender.generate_poetic_recommendation(wine, nombre_plato, plato)
+    timings['narrativa'] = time.perf_counter() - t0
+    timings['total'] = time.perf_counter() - start
+    return timings
+
+
+def menu_dish_names(menu: DishCatalogue) -> List[str]:
+    """Nombres de los platos del restaurante de prueba, en el orden de sus categorías"""
+    return [name for categoria in menu.categories(LOAD_TEST_RESTAURANT)
+            for name in menu.dish_names(categoria, LOAD_TEST_RESTAURANT)]
+
+
+def run_load_test(diners: int = 32, requests_per_diner: int = 20, n_platos: int = 40, n_vinos: int = 7500,
+                  llm_latency: float = 0.5, llm_jitter: float = 0.1, llm_failure_rate: float = 0.0,
+                  llm_rate_limit_rate: float = 0.0, mongo_latency: float = 0.002, popularity: float = 1.0,
+                  top_k: int = 1, seed: int = 0, cache_path: Optional[str] = None) -> Dict:
+    """Simula ``diners`` comensales simultáneos haciendo ``requests_per_diner`` visitas cada uno.
+
+    Todo es local: catálogo sintético, ``InMemoryMenuRepository`` con los
+    platos de El Tribut y ``StubLLM`` con la latencia y tasas de error dadas.
+    La popularidad de los platos sigue una ley de Zipf con exponente
+    ``popularity`` (0 = todos igual de probables), de modo que varios
+    comensales coinciden en los platos más pedidos como en un servicio real.
+    """
+    df_vinos = synthetic_catalogue(n_vinos, seed)
+    repository = InMemoryMenuRepository(tribut_platos(n_platos, seed), latency=mongo_latency)
+    dish_store = DishStore(repository).start()
+    dish_store.wait_until_loaded()
+
+    model = StubLLM(latency=llm_latency, jitter=llm_jitter, failure_rate=llm_failure_rate,
+                    rate_limit_rate=llm_rate_limit_rate, seed=seed)
+    recommender = LoadTestRecommender()
+    recommender.set_catalogue(df_vinos)
+    recommender.model = model
+    with tempfile.TemporaryDirectory() as directory:
+        recommender.narrative_cache = NarrativeCache(cache_path or os.path.join(directory, 'narrativas.sqlite'))
+
+        names = menu_dish_names(dish_store.catalogue())
+        n_dishes = len(names)
+        # Los platos más populares se reparten al azar por la carta (no siempre los primeros de la lista)
+        ranks = np.random.default_rng(seed).permutation(n_dishes) + 1
+        weights = 1.0 / ranks ** popularity
+        weights /= weights.sum()
+
+        timings: Dict[str, List[float]] = {stage: [] for stage in STAGES}
+        errors: List[str] = []
+        lock = threading.Lock()
+
+        def diner(diner_id: int) -> None:
+            rng = np.random.default_rng(seed + 1000 + diner_id)
+            for _ in range(requests_per_diner):
+                try:
+                    result = simulate_diner(recommender, dish_store, names, weights, rng, top_k)
+                except Exception as e:
+                    with lock:
+                        errors.append(f'{type(e).__name__}: {e}')
+                    continue
+                with lock:
+                    for stage, seconds in result.items():
+                        timings[stage].append(seconds)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=diners, thread_name_prefix='comensal') as executor:
+            list(executor.map(diner, range(diners)))
+        elapsed = time.perf_counter() - start
+        dish_store.stop()
+
+    completed = len(timings['total'])
+    report = {
+        'metadatos': {
+            'fecha': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'plataforma': platform.platform(),
+            'cpus': os.cpu_count(),
+            'semilla': seed,
+        },
+        'configuracion': {
+            'comensales': diners, 'peticiones_por_comensal': requests_per_diner, 'platos': n_dishes,
+            'vinos': n_vinos, 'latencia_llm_s': llm_latency, 'jitter_llm_s': llm_jitter,
+            'tasa_fallos_llm': llm_failure_rate, 'tasa_cuota_llm': llm_rate_limit_rate,
+            'latencia_mongo_s': mongo_latency, 'popularidad': popularity, 'top_k': top_k,
+        },
+        'duracion_s': round(elapsed, 3),
+        'peticiones': completed,
+        'errores': len(errors),
+        'peticiones_por_segundo': round(completed / elapsed, 2) if elapsed else None,
+        'llamadas_llm': model.calls,
+        'fallbacks': recommender.fallbacks,
+        'tasa_fallback': round(recommender.fallbacks / completed, 4) if completed else None,
+        'etapas': {stage: _stats(values) for stage, values in timings.items() if values},
+    }
+    if errors:
+        report['ejemplos_errores'] = sorted(set(errors))[:5]
+    return report
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Prueba de carga local del flujo de recomendación (sin MongoDB ni Gemini)"""
+    parser = argparse.ArgumentParser(description="Prueba de carga con comensales simultáneos, MongoDB en memoria "
+                                                 "y LLM simulado")
+    parser.add_argument('--comensales', type=int, default=32, help="Comensales (sesiones) simultáneos")
+    parser.add_argument('--peticiones', type=int, default=20, help="Visitas de cada comensal")
+    parser.add_argument('--platos', type=int, default=40, help="Platos de la carta sintética")
+    parser.add_argument('--vinos', type=int, default=7500, help="Vinos del catálogo sintético")
+    parser.add_argument('--latencia-llm', type=float, default=0.5, help="Segundos de cada llamada al LLM")
+    parser.add_argument('--jitter-llm', type=float, default=0.1, help="Variación (±s) de la latencia del LLM")
+    parser.add_argument('--fallos-llm', type=float, default=0.0, help="Fracción de llamadas al LLM que fallan")
+    parser.add_argument('--cuota-llm', type=float, default=0.0, help="Fracción de llamadas que devuelven 429")
+    parser.add_argument('--latencia-mongo', type=float, default=0.002, help="Segundos de cada consulta a MongoDB")
+    parser.add_argument('--popularidad', type=float, default=1.0, help="Exponente de Zipf de la elección de plato")
+    parser.add_argument('--top-k', type=int, default=1, help="Vinos por tipo y rango de precio")
+    parser.add_argument('--semilla', type=int, default=0, help="Semilla de los datos y de los comensales")
+    parser.add_argument('--salida', default=LOAD_TEST_OUTPUT_PATH, help="Fichero JSON con los resultados")
+    parser.add_argument('--max-p95-ms', type=float, help="Falla (código 1) si el p95 total lo supera")
+    parser.add_argument('--max-tasa-fallback', type=float, help="Falla (código 1) si la tasa de fallback la supera")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    # Una línea de traza por etapa y petición ocultaría el resumen
+    logging.getLogger('telemetry').setLevel(logging.WARNING)
+    report = run_load_test(args.comensales, args.peticiones, args.platos, args.vinos, args.latencia_llm,
+                           args.jitter_llm, args.fallos_llm, args.cuota_llm, args.latencia_mongo,
+                           args.popularidad, args.top_k, args.semilla)
+
+    directory = os.path.dirname(args.salida)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    total = report['etapas'].get('total', {})
+    logger.info(f"{report['peticiones']} peticiones en {report['duracion_s']} s "
+                f"({report['peticiones_por_segundo']}/s) | p50 {total.get('p50_ms')} ms p95 {total.get('p95_ms')} ms "
+                f"p99 {total.get('p99_ms')} ms | fallbacks {report['fallbacks']} ({report['tasa_fallback']}) | "
+                f"llamadas al LLM {report['llamadas_llm']} | errores {report['errores']}")
+    logger.info(f"Resultados guardados en {args.salida}")
+
+    failed = report['errores'] > 0
+    if args.max_p95_ms is not None and total.get('p95_ms', float('inf')) > args.max_p95_ms:
+        logger.error(f"p95 total {total.get('p95_ms')} ms supera el máximo de {args.max_p95_ms} ms")
+        failed = True
+    if args.max_tasa_fallback is not None and (report['tasa_fallback'] or 0) > args.max_tasa_fallback:
+        logger.error(f"Tasa de fallback {report['tasa_fallback']} supera el máximo de {args.max_tasa_fallback}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
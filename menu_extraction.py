@@ -0,0 +1,204 @@
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PAGE_CACHE_PATH = os.getenv('PAGE_CACHE_PATH', './data/paginas_pdf.sqlite')
+
+# PDFs abiertos por cada proceso del pool (se reutilizan entre páginas del mismo fichero);
+# como mucho MAX_OPEN_PDFS por proceso, cerrando el usado hace más tiempo
+MAX_OPEN_PDFS = 2
+_open_pdfs: 'OrderedDict[str, Tuple[float, object]]' = OrderedDict()
+
+
+def pdf_hash(pdf_path: str) -> str:
+    """Huella SHA-256 del contenido del PDF (cambia con cualquier edición del fichero)"""
+    digest = hashlib.sha256()
+    with open(pdf_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def page_count(pdf_path: str) -> int:
+    import pdfplumber
+
+    with pdfplumber.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+
+def extract_page(pdf_path: str, page_number: int) -> Tuple[int, str]:
+    """Extrae el texto de una página (numerada desde 0); las páginas sin texto devuelven ''"""
+    import pdfplumber
+
+    # Si el fichero cambia mientras el pool sigue vivo se cierra y se vuelve a abrir
+    mtime = os.path.getmtime(pdf_path)
+    mtime_opened, pdf = _open_pdfs.pop(pdf_path, (None, None))
+    if pdf is not None and mtime_opened != mtime:
+        pdf.close()
+        pdf = None
+    if pdf is None:
+        pdf = pdfplumber.open(pdf_path)
+    _open_pdfs[pdf_path] = (mtime, pdf)
+    while len(_open_pdfs) > MAX_OPEN_PDFS:
+        _, (_, evicted) = _open_pdfs.popitem(last=False)
+        evicted.close()
+    page = pdf.pages[page_number]
+    try:
+        return page_number, page.extract_text() or ''
+    finally:
+        # Libera los objetos de la página ya procesada
+        page.close()
+
+
+class PageTextCache:
+    """Caché persistente (SQLite) del texto de cada página, por huella del PDF y número de página.
+
+    Como la clave es el contenido del fichero, editar un PDF solo obliga a
+    extraer de nuevo ese PDF, y renombrarlo o copiarlo no obliga a nada.
+    """
+
+    def __init__(self, path: str = PAGE_CACHE_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS paginas ("
+                "pdf TEXT NOT NULL, pagina INTEGER NOT NULL, texto TEXT NOT NULL, "
+                "PRIMARY KEY (pdf, pagina))"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS pdfs (pdf TEXT PRIMARY KEY, paginas INTEGER NOT NULL)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_page_count(self, pdf: str) -> Optional[int]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT paginas FROM pdfs WHERE pdf = ?", (pdf,)).fetchone()
+        return row[0] if row else None
+
+    def set_page_count(self, pdf: str, pages: int) -> None:
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO pdfs (pdf, paginas) VALUES (?, ?)", (pdf, pages))
+
+    def get_pages(self, pdf: str) -> Dict[int, str]:
+        """Páginas ya extraídas de un PDF, por número de página"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT pagina, texto FROM paginas WHERE pdf = ?", (pdf,)).fetchall()
+        return dict(rows)
+
+    def set_pages(self, pdf: str, pages: List[Tuple[int, str]]) -> None:
+        if pages:
+            with self._connect() as conn:
+                conn.executemany("INSERT OR REPLACE INTO paginas (pdf, pagina, texto) VALUES (?, ?, ?)",
+                                 [(pdf, number, text) for number, text in pages])
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM paginas")
+            conn.execute("DELETE FROM pdfs")
+
+
+def iter_pdf_pages(pdf_path: str, cache: Optional[PageTextCache] = None,
+                   executor: Optional[Executor] = None, workers: Optional[int] = None) -> Iterator[Tuple[int, str]]:
+    """Devuelve ``(número de página, texto)`` en orden de página según se van extrayendo.
+
+    Las páginas que ya están en la caché no se vuelven a abrir; el resto se
+    reparte entre los procesos de ``executor`` (o de un pool propio con
+    ``workers`` procesos). Cada página extraída se guarda en la caché en
+    cuanto está disponible, de modo que una ejecución interrumpida se puede
+    retomar.
+    """
+    key = pdf_hash(pdf_path)
+    cached = cache.get_pages(key) if cache is not None else {}
+    total = cache.get_page_count(key) if cache is not None else None
+    if total is None:
+        total = page_count(pdf_path)
+        if cache is not None:
+            cache.set_page_count(key, total)
+    missing = [number for number in range(total) if number not in cached]
+
+    if missing:
+        logger.info(f"{os.path.basename(pdf_path)}: {len(missing)} de {total} páginas por extraer")
+
+    if not missing:
+        for number in range(total):
+            yield number, cached[number]
+        return
+
+    own_executor = None
+    if executor is None:
+        workers = min(workers or os.cpu_count() or 1, len(missing))
+        if workers > 1:
+            own_executor = executor = ProcessPoolExecutor(max_workers=workers)
+    try:
+        futures = {}
+        if executor is not None:
+            futures = {number: executor.submit(extract_page, os.path.abspath(pdf_path), number) for number in missing}
+        for number in range(total):
+            if number in cached:
+                yield number, cached[number]
+                continue
+            if executor is None:
+                # Con un solo proceso no compensa el coste de arrancar el pool
+                _, text = extract_page(os.path.abspath(pdf_path), number)
+            else:
+                _, text = futures[number].result()
+            if cache is not None:
+                cache.set_pages(key, [(number, text)])
+            yield number, text
+    finally:
+        if own_executor is not None:
+            own_executor.shutdown(cancel_futures=True)
+        elif executor is None:
+            # En el propio proceso no hay pool que se lleve los PDFs abiertos al terminar
+            _, pdf = _open_pdfs.pop(os.path.abspath(pdf_path), (None, None))
+            if pdf is not None:
+                pdf.close()
+
+
+def extract_pdf_text(pdf_path: str, cache: Optional[PageTextCache] = None,
+                     executor: Optional[Executor] = None, workers: Optional[int] = None) -> str:
+    """Texto completo del PDF, una página por bloque separado por saltos de línea"""
+    return '\n'.join(text for _, text in iter_pdf_pages(pdf_path, cache, executor, workers)) + '\n'
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Extrae el texto de varios PDF de fichas de platos compartiendo un único pool de procesos"""
+    parser = argparse.ArgumentParser(description="Extrae el texto de los PDF de fichas de platos")
+    parser.add_argument('pdfs', nargs='+', help="Ficheros PDF")
+    parser.add_argument('--salida', default='./data/menus_texto', help="Directorio de los .txt generados")
+    parser.add_argument('--cache', default=PAGE_CACHE_PATH, help="Caché de páginas (SQLite)")
+    parser.add_argument('--workers', type=int, default=None, help="Procesos de extracción")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    os.makedirs(args.salida, exist_ok=True)
+    cache = PageTextCache(args.cache)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for pdf_path in args.pdfs:
+            text = extract_pdf_text(pdf_path, cache, executor)
+            output = os.path.join(args.salida, os.path.splitext(os.path.basename(pdf_path))[0] + '.txt')
+            with open(output, 'w', encoding='utf-8') as f:
+                f.write(text)
+            logger.info(f"{pdf_path} -> {output} ({len(text)} caracteres)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,337 @@
+import atexit
+import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple, TypedDict
+
+import pymongo
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MONGO_URI = os.getenv('MONGO_URI', 'mongodb://localhost:27017/')
+DATABASE_NAME = 'menu_database'
+COLLECTION_NAME = 'platos'
+RECOMMENDATIONS_COLLECTION_NAME = 'recomendaciones'
+INVENTORY_COLLECTION_NAME = 'inventario'
+
+
+class Plato(TypedDict, total=False):
+    """Documento de la colección ``menu_database.platos``"""
+    restaurante: str
+    nombre_plato: str
+    nombre_normalizado: str
+    categoria: str
+    descripcion: str
+    ingredientes_clave: List[str]
+    carne: str
+    proteina_principal: str
+    salsa: str
+    coccion: str
+    alergenos: List[str]
+    maridaje: Any  # lista o cadena separada por comas
+    acidez: Any  # float o cadena (p.ej. "3.5.")
+    cuerpo: Any
+    timestamp: Any
+
+
+def normalize_dish_name(nombre_plato: str) -> str:
+    """Nombre de plato sin tildes, en minúsculas y con los espacios normalizados"""
+    text = unicodedata.normalize('NFKD', str(nombre_plato))
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.lower().split())
+
+
+def document_fingerprint(document: Dict) -> str:
+    """Huella estable del contenido de un documento (incluidos ``_id``, fechas y demás tipos BSON)"""
+    encoded = json.dumps(document, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+class MenuRepository:
+    """Acceso a los platos en MongoDB a través de un único cliente con pool de conexiones.
+
+    El cliente se crea en el primer uso (no al importar) y se reutiliza para
+    todas las consultas del proceso; pymongo gestiona el pool de conexiones
+    internamente. ``is_healthy`` comprueba el servidor con ``ping`` y recuerda
+    el resultado durante ``health_interval`` segundos.
+    """
+
+    def __init__(self, uri: str = DEFAULT_MONGO_URI, database: str = DATABASE_NAME,
+                 collection: str = COLLECTION_NAME, max_pool_size: int = 50,
+                 server_selection_timeout_ms: int = 3000, health_interval: float = 30.0):
+        self.uri = uri
+        self.database_name = database
+        self.collection_name = collection
+        self.max_pool_size = max_pool_size
+        self.server_selection_timeout_ms = server_selection_timeout_ms
+        self.health_interval = health_interval
+
+        self._client: Optional[pymongo.MongoClient] = None
+        self._lock = threading.Lock()
+        self._indexes_ready = False
+        self._last_health_check = 0.0
+        self._healthy = False
+
+    @property
+    def client(self) -> pymongo.MongoClient:
+        """Cliente de MongoDB (se crea la primera vez que se necesita)"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = pymongo.MongoClient(
+                        self.uri,
+                        maxPoolSize=self.max_pool_size,
+                        serverSelectionTimeoutMS=self.server_selection_timeout_ms,
+                        connect=False,
+                    )
+        return self._client
+
+    @property
+    def collection(self):
+        return self.client[self.database_name][self.collection_name]
+
+    @property
+    def recommendations(self):
+        """Colección con la tabla materializada de recomendaciones por plato"""
+        return self.client[self.database_name][RECOMMENDATIONS_COLLECTION_NAME]
+
+    @property
+    def inventory(self):
+        """Colección con las existencias y precios de vinos de cada restaurante"""
+        return self.client[self.database_name][INVENTORY_COLLECTION_NAME]
+
+    def is_healthy(self, force: bool = False) -> bool:
+        """Comprueba que el servidor responde, reutilizando el último resultado reciente"""
+        now = time.monotonic()
+        if not force and now - self._last_health_check < self.health_interval:
+            return self._healthy
+        try:
+            self.client.admin.command('ping')
+            self._healthy = True
+        except Exception as e:
+            logger.warning(f"MongoDB no disponible en {self.uri}: {e}")
+            self._healthy = False
+        self._last_health_check = now
+        return self._healthy
+
+    def ensure_indexes(self) -> None:
+        """Crea (una vez por proceso) los índices que usan las consultas de platos"""
+        if self._indexes_ready:
+            return
+        try:
+            self.collection.create_index([('categoria', pymongo.ASCENDING), ('nombre_plato', pymongo.ASCENDING)])
+            self.collection.create_index([('nombre_plato', pymongo.ASCENDING)])
+            self.collection.create_index([('restaurante', pymongo.ASCENDING), ('categoria', pymongo.ASCENDING),
+                                          ('nombre_plato', pymongo.ASCENDING)])
+            # Clave de la ingesta idempotente: los documentos antiguos reciben el campo antes
+            # de crear el índice, para que la siguiente ingesta los actualice en vez de duplicarlos
+            self.backfill_normalized_names()
+            self.collection.create_index([('restaurante', pymongo.ASCENDING), ('nombre_normalizado', pymongo.ASCENDING)],
+                                         unique=True,
+                                         partialFilterExpression={'nombre_normalizado': {'$exists': True}})
+        except pymongo.errors.OperationFailure as e:
+            # Sin permisos de escritura las consultas funcionan igual, solo que sin índices
+            logger.warning(f"No se pudieron crear los índices de platos: {e}")
+        self._indexes_ready = True
+
+    def backfill_normalized_names(self) -> int:
+        """Añade ``nombre_normalizado`` a los platos guardados antes de la ingesta idempotente.
+
+        Si varios documentos antiguos comparten restaurante y nombre normalizado
+        (ingestas repetidas), solo el más reciente recibe la clave; los demás se
+        quedan fuera del índice único y se avisa para que se eliminen a mano.
+
+        Returns:
+            Número de documentos actualizados
+        """
+        legacy = list(self.collection.find({'nombre_normalizado': {'$exists': False}},
+                                           {'restaurante': 1, 'nombre_plato': 1, 'timestamp': 1}))
+        if not legacy:
+            return 0
+        taken = {(doc.get('restaurante'), doc['nombre_normalizado'])
+                 for doc in self.collection.find({'nombre_normalizado': {'$exists': True}},
+                                                 {'restaurante': 1, 'nombre_normalizado': 1, '_id': 0})}
+        newest_first = sorted(legacy, key=lambda doc: doc.get('timestamp') or datetime.datetime.min, reverse=True)
+        operations, duplicates = [], 0
+        for doc in newest_first:
+            key = (doc.get('restaurante'), normalize_dish_name(doc.get('nombre_plato', '')))
+            if key in taken:
+                duplicates += 1
+                continue
+            taken.add(key)
+            operations.append(pymongo.UpdateOne({'_id': doc['_id']}, {'$set': {'nombre_normalizado': key[1]}}))
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        logger.info(f"Platos antiguos con nombre normalizado: {len(operations)}")
+        if duplicates:
+            logger.warning(f"{duplicates} platos antiguos repetidos (mismo restaurante y nombre) se han dejado "
+                           f"sin nombre normalizado; elimínalos para no mostrarlos dos veces")
+        return len(operations)
+
+    @staticmethod
+    def _filter(restaurante: Optional[str] = None, **fields) -> Dict[str, Any]:
+        query: Dict[str, Any] = {k: v for k, v in fields.items() if v is not None}
+        if restaurante:
+            query['restaurante'] = restaurante
+        return query
+
+    def get_categories(self, restaurante: Optional[str] = None) -> List[str]:
+        """Categorías de platos, resueltas con ``distinct`` sobre el índice"""
+        self.ensure_indexes()
+        categories = self.collection.distinct('categoria', self._filter(restaurante))
+        return sorted(c for c in categories if c is not None)
+
+    def get_dish_names(self, categoria: str, restaurante: Optional[str] = None) -> List[str]:
+        """Nombres de los platos de una categoría (consulta proyectada, solo ``nombre_plato``)"""
+        self.ensure_indexes()
+        cursor = self.collection.find(self._filter(restaurante, categoria=categoria),
+                                      {'nombre_plato': 1, '_id': 0})
+        return sorted({doc['nombre_plato'] for doc in cursor if 'nombre_plato' in doc})
+
+    def count_platos(self, restaurante: Optional[str] = None) -> int:
+        """Número de platos del menú"""
+        return self.collection.count_documents(self._filter(restaurante))
+
+    def find_platos(self, categoria: Optional[str] = None, restaurante: Optional[str] = None,
+                    include_id: bool = False) -> List[Plato]:
+        """Devuelve los documentos completos de los platos (sin el campo _id salvo que se pida)"""
+        projection = None if include_id else {'_id': 0}
+        return list(self.collection.find(self._filter(restaurante, categoria=categoria), projection))
+
+    def watch(self, fields: List[str], resume_after: Optional[Dict] = None):
+        """Abre un change stream sobre la colección, proyectando solo ``fields`` del documento"""
+        project = {'operationType': 1, 'documentKey': 1}
+        project.update({f'fullDocument.{field}': 1 for field in ['_id'] + fields})
+        return self.collection.watch([{'$project': project}], full_document='updateLookup',
+                                     resume_after=resume_after, max_await_time_ms=1000)
+
+    def find_plato(self, nombre_plato: str, restaurante: Optional[str] = None) -> Optional[Plato]:
+        """Devuelve el documento completo de un plato por su nombre"""
+        self.ensure_indexes()
+        return self.collection.find_one(self._filter(restaurante, nombre_plato=nombre_plato), {'_id': 0})
+
+    def insert_plato(self, plato: Plato):
+        """Inserta un plato y devuelve su _id"""
+        return self.collection.insert_one(plato).inserted_id
+
+    @staticmethod
+    def _upsert_key(plato: Plato, restaurante: Optional[str] = None) -> Tuple[Tuple, Dict]:
+        """Clave de la ingesta idempotente ``(restaurante, nombre_normalizado)`` y campos a guardar"""
+        document = {k: v for k, v in plato.items() if k not in ('_id', 'timestamp')}
+        if restaurante is not None:
+            document['restaurante'] = restaurante
+        document['nombre_normalizado'] = normalize_dish_name(document.get('nombre_plato', ''))
+        return (document.get('restaurante'), document['nombre_normalizado']), document
+
+    def upsert_plato(self, plato: Plato, restaurante: Optional[str] = None):
+        """Inserta o actualiza un plato (con la misma clave que ``bulk_upsert_platos``) y devuelve su _id"""
+        key, document = self._upsert_key(plato, restaurante)
+        self.ensure_indexes()
+        saved = self.collection.find_one_and_update(
+            {'restaurante': key[0], 'nombre_normalizado': key[1]},
+            {'$set': document, '$setOnInsert': {'timestamp': datetime.datetime.now()}},
+            projection={'_id': 1}, upsert=True, return_document=pymongo.ReturnDocument.AFTER
+        )
+        return saved['_id']
+
+    def bulk_upsert_platos(self, platos: List[Plato], restaurante: Optional[str] = None) -> Dict[str, int]:
+        """Inserta o actualiza un menú completo en una sola operación ``bulk_write``.
+
+        Cada plato se identifica por su nombre normalizado y el restaurante, así
+        que volver a ingerir el mismo menú no duplica documentos. El campo
+        ``timestamp`` solo se fija al insertar.
+
+        Returns:
+            Resumen con el número de platos insertados, actualizados y sin cambios.
+        """
+        documents: Dict[tuple, Dict] = {}
+        for plato in platos:
+            key, document = self._upsert_key(plato, restaurante)
+            if key in documents:
+                logger.warning(f"Plato repetido en la ingesta, se usa la última versión: {document.get('nombre_plato')}")
+            documents[key] = document
+
+        now = datetime.datetime.now()
+        operations = [
+            pymongo.UpdateOne(
+                {'restaurante': key[0], 'nombre_normalizado': key[1]},
+                {'$set': document, '$setOnInsert': {'timestamp': now}},
+                upsert=True
+            )
+            for key, document in documents.items()
+        ]
+
+        if not operations:
+            return {'insertados': 0, 'actualizados': 0, 'sin_cambios': 0}
+
+        self.ensure_indexes()
+        result = self.collection.bulk_write(operations, ordered=False)
+        return {
+            'insertados': result.upserted_count,
+            'actualizados': result.modified_count,
+            'sin_cambios': result.matched_count - result.modified_count,
+        }
+
+    def load_recommendations(self, catalogue_version: str) -> List[Dict]:
+        """Recomendaciones materializadas que se calcularon con una versión del catálogo"""
+        return list(self.recommendations.find({'version_catalogo': catalogue_version}))
+
+    def save_recommendations(self, entries: List[Dict]) -> None:
+        """Guarda (sustituyendo) las recomendaciones de varios platos, una por ``_id`` de plato"""
+        if entries:
+            operations = [pymongo.ReplaceOne({'_id': entry['_id']}, entry, upsert=True) for entry in entries]
+            self.recommendations.bulk_write(operations, ordered=False)
+
+    def delete_recommendations(self, dish_ids: List[Any]) -> None:
+        """Elimina las recomendaciones de platos que ya no existen"""
+        if dish_ids:
+            self.recommendations.delete_many({'_id': {'$in': list(dish_ids)}})
+
+    def load_inventories(self) -> List[Dict]:
+        """Inventarios de vinos de todos los restaurantes (un documento por restaurante)"""
+        return list(self.inventory.find())
+
+    def save_inventory(self, restaurante: str, vinos: List[str], precios: List[Dict]) -> None:
+        """Guarda (sustituyendo) el inventario de un restaurante"""
+        self.inventory.replace_one(
+            {'_id': restaurante},
+            {'_id': restaurante, 'vinos': vinos, 'precios': precios, 'actualizado': datetime.datetime.now()},
+            upsert=True
+        )
+
+    def delete_inventory(self, restaurante: str) -> None:
+        self.inventory.delete_one({'_id': restaurante})
+
+    def close(self) -> None:
+        """Cierra el cliente y su pool de conexiones"""
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+                self._last_health_check = 0.0
+                self._indexes_ready = False
+
+
+_repositories: Dict[str, MenuRepository] = {}
+_repositories_lock = threading.Lock()
+
+
+def get_repository(uri: str = DEFAULT_MONGO_URI) -> MenuRepository:
+    """Repositorio compartido por todo el proceso para una cadena de conexión"""
+    with _repositories_lock:
+        if uri not in _repositories:
+            _repositories[uri] = MenuRepository(uri)
+        return _repositories[uri]
+
+
+@atexit.register
+def close_all() -> None:
+    """Cierra todos los clientes abiertos por el proceso"""
+    with _repositories_lock:
+        for repository in _repositories.values():
+            repository.close()
@@ -0,0 +1,310 @@
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from llm_throttle import Throttle, is_rate_limit_error
+from menu_repository import Plato, normalize_dish_name
+
+logger = logging.getLogger(__name__)
+
+# Tamaño máximo (caracteres) de cada fragmento de texto que se envía al LLM
+MAX_CHUNK_CHARS = 4000
+
+# Mínimo de tipos de vino por plato (el prompt pide entre 2 y 4)
+MIN_MARIDAJES = 2
+
+# Esquema de cada plato: campo -> tipo esperado tras normalizar
+DISH_SCHEMA = {
+    'nombre_plato': str,
+    'categoria': str,
+    'ingredientes_clave': list,
+    'carne': str,
+    'proteina_principal': str,
+    'salsa': str,
+    'coccion': str,
+    'alergenos': list,
+    'maridaje': list,
+    'acidez': float,
+    'cuerpo': float,
+}
+
+MENU_CHUNK_PROMPT = """
+Eres un asistente que convierte texto de menú en JSON estructurado.
+Recibirás a continuación un fragmento de texto (en español/ING/otros) con las fichas de uno o varios platos.
+Devuelve únicamente un JSON (sin texto adicional) con un array de objetos, uno por plato. Cada objeto debe tener EXACTAMENTE estas claves:
+- nombre_plato (string)
+- categoria (string)  # p.ej. Entrante, Principal, Postre
+- ingredientes_clave (array de strings)  # 3-6 ingredientes o componentes clave
+- carne ("Sí" o "No")
+- proteina_principal (string)  # p.ej. Pescado, Ternera, Lácteo, Marisco, N/A
+- salsa (string)  # breve descripción o "N/A"
+- coccion (string)  # p.ej. Frito, Horneado, Crudo / Marinado, etc.
+- alergenos (array de strings)
+- maridaje (array de strings)  # 2-4 tipos de vino {tipos_vino}
+- acidez (número entre 0 y 5)  # acidez percibida del plato
+- cuerpo (número entre 0 y 5)  # intensidad/cuerpo del plato
+
+Normaliza los nombres en español cuando sea posible. Si el fragmento no contiene ningún plato, devuelve [].
+No incluyas explicaciones ni texto fuera del JSON.
+Texto a procesar:
+
+
+{texto}
+
+"""
+
+RETRY_NOTE = """
+Tu respuesta anterior a este mismo fragmento no era válida:
+{errores}
+Corrige esos problemas y devuelve de nuevo el JSON completo.
+"""
+
+
+class InvalidMenuChunk(ValueError):
+    """La respuesta del LLM para un fragmento no es JSON válido o no cumple el esquema"""
+
+
+def split_menu_chunks(pages: Iterable[str], max_chars: int = MAX_CHUNK_CHARS) -> List[str]:
+    """Divide el texto del menú en fragmentos pequeños, idealmente uno por ficha de plato.
+
+    Cada página del PDF de fichas describe normalmente un plato, así que cada
+    página no vacía es un fragmento. Las páginas más largas que ``max_chars``
+    se cortan por párrafos (líneas en blanco) y, si hace falta, por líneas.
+    """
+    chunks = []
+    for page in pages:
+        text = page.strip()
+        if not text:
+            continue
+        if len(text) <= max_chars:
+            chunks.append(text)
+            continue
+
+        current = ''
+        for block in _blocks(text, max_chars):
+            if current and len(current) + len(block) + 2 > max_chars:
+                chunks.append(current)
+                current = ''
+            current = f'{current}\n\n{block}' if current else block
+        if current:
+            chunks.append(current)
+    return chunks
+
+
+def _blocks(text: str, max_chars: int) -> List[str]:
+    blocks = []
+    for paragraph in (p.strip() for p in text.split('\n\n')):
+        if len(paragraph) <= max_chars:
+            if paragraph:
+                blocks.append(paragraph)
+            continue
+        line_block = ''
+        for line in (piece for line in paragraph.splitlines() for piece in _pieces(line, max_chars)):
+            if line_block and len(line_block) + len(line) + 1 > max_chars:
+                blocks.append(line_block)
+                line_block = ''
+            line_block = f'{line_block}\n{line}' if line_block else line
+        if line_block:
+            blocks.append(line_block)
+    return blocks
+
+
+def _pieces(line: str, max_chars: int) -> List[str]:
+    """Parte una línea más larga que ``max_chars`` en trozos consecutivos, por espacios si es posible"""
+    pieces = []
+    while len(line) > max_chars:
+        cut = line.rfind(' ', 0, max_chars + 1)
+        if cut <= 0:
+            cut = max_chars
+        pieces.append(line[:cut].rstrip())
+        line = line[cut:].lstrip()
+    return pieces + [line] if line else pieces
+
+
+def _text_list(value: Any) -> Optional[List[str]]:
+    if isinstance(value, str):
+        value = [v for v in value.split(',')]
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        return None
+    return [v.strip() for v in value if v.strip()]
+
+
+def validate_dish(item: Any, wine_types: Optional[List[str]] = None) -> Tuple[Optional[Plato], List[str]]:
+    """Comprueba un objeto devuelto por el LLM contra ``DISH_SCHEMA`` y lo normaliza.
+
+    Los maridajes deben ser al menos ``MIN_MARIDAJES`` y, si se indican
+    ``wine_types``, tipos de esa lista (sin distinguir tildes ni mayúsculas);
+    se guardan con la grafía del catálogo, que es la que busca la app.
+
+    Returns:
+        El plato normalizado (o None si no es válido) y la lista de errores.
+    """
+    if not isinstance(item, dict):
+        return None, [f"se esperaba un objeto y se recibió {type(item).__name__}"]
+
+    name = item.get('nombre_plato')
+    label = name if isinstance(name, str) and name.strip() else '(sin nombre)'
+    errors = [f"{label}: falta '{field}'" for field in DISH_SCHEMA if field not in item]
+    if errors:
+        return None, errors
+
+    dish: Dict[str, Any] = {}
+    for field, expected in DISH_SCHEMA.items():
+        value = item[field]
+        if expected is float:
+            try:
+                # Igual que en la app, se admiten cadenas como "3.5."
+                value = float(value.rstrip('.')) if isinstance(value, str) else float(value)
+            except (TypeError, ValueError):
+                errors.append(f"{label}: '{field}' no es numérico ({value!r})")
+                continue
+            if not 0.0 <= value <= 5.0:
+                errors.append(f"{label}: '{field}' fuera de rango 0-5 ({value})")
+                continue
+        elif expected is list:
+            value = _text_list(value)
+            if value is None:
+                errors.append(f"{label}: '{field}' debe ser una lista de cadenas")
+                continue
+        elif not isinstance(value, str) or not value.strip():
+            errors.append(f"{label}: '{field}' debe ser una cadena no vacía")
+            continue
+        else:
+            value = value.strip()
+        dish[field] = value
+
+    if 'maridaje' in dish:
+        dish['maridaje'], maridaje_errors = _validate_maridajes(label, dish['maridaje'], wine_types)
+        errors.extend(maridaje_errors)
+
+    if errors:
+        return None, errors
+
+    dish['carne'] = 'Sí' if normalize_dish_name(dish['carne']) in ('si', 'yes') else 'No'
+    return dish, []
+
+
+def _validate_maridajes(label: str, maridajes: List[str],
+                        wine_types: Optional[List[str]]) -> Tuple[List[str], List[str]]:
+    if not wine_types:
+        maridajes = [m.lower() for m in maridajes]
+    else:
+        catalogue = {normalize_dish_name(t): t.lower() for t in wine_types}
+        unknown = [m for m in maridajes if normalize_dish_name(m) not in catalogue]
+        if unknown:
+            return maridajes, [f"{label}: maridajes que no son tipos de vino del catálogo: {', '.join(unknown)}"]
+        maridajes = [catalogue[normalize_dish_name(m)] for m in maridajes]
+    # Sin repetir y en el orden dado (el primero es el preferido)
+    maridajes = list(dict.fromkeys(maridajes))
+    if len(maridajes) < MIN_MARIDAJES:
+        return maridajes, [f"{label}: 'maridaje' necesita al menos {MIN_MARIDAJES} tipos de vino ({len(maridajes)})"]
+    return maridajes, []
+
+
+def parse_chunk_response(raw: str, wine_types: Optional[List[str]] = None) -> List[Plato]:
+    """Interpreta la respuesta del LLM para un fragmento; cualquier plato inválido invalida el fragmento"""
+    text = (raw or '').strip()
+    if text.startswith('```'):
+        # Bloque de código Markdown (```json ... ```)
+        text = text.split('\n', 1)[1] if '\n' in text else ''
+        text = text.rsplit('```', 1)[0]
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise InvalidMenuChunk(f"la respuesta no es JSON válido: {e}")
+
+    if isinstance(data, dict):
+        data = data.get('platos', [data])
+    if not isinstance(data, list):
+        raise InvalidMenuChunk("la respuesta no es un array de platos")
+
+    platos, errors = [], []
+    for item in data:
+        dish, item_errors = validate_dish(item, wine_types)
+        errors.extend(item_errors)
+        if dish is not None:
+            platos.append(dish)
+    if errors:
+        raise InvalidMenuChunk('; '.join(errors))
+    return platos
+
+
+def build_chunk_prompt(chunk: str, wine_types: Optional[List[str]] = None,
+                       previous_error: Optional[str] = None) -> str:
+    tipos_vino = f"elegidos de esta lista: {', '.join(wine_types)}" if wine_types else "(p.ej. albariño, cava, rioja red)"
+    prompt = MENU_CHUNK_PROMPT.format(tipos_vino=tipos_vino, texto=chunk)
+    if previous_error:
+        prompt += RETRY_NOTE.format(errores=previous_error)
+    return prompt
+
+
+def structure_chunk(model, chunk: str, throttle: Throttle, wine_types: Optional[List[str]] = None,
+                    max_retries: int = 3, base_delay: float = 1.0) -> List[Plato]:
+    """Estructura un fragmento, reintentando solo este fragmento si falla la llamada o la validación"""
+    previous_error = None
+    for attempt in range(max_retries + 1):
+        throttle.wait()
+        try:
+            response = model.generate_content(build_chunk_prompt(chunk, wine_types, previous_error))
+            return parse_chunk_response(response.text, wine_types)
+        except InvalidMenuChunk as e:
+            # Se reintenta enseguida indicando al modelo qué estaba mal
+            if attempt == max_retries:
+                raise
+            previous_error = str(e)
+            logger.warning(f"Fragmento inválido, reintento {attempt + 1}/{max_retries}: {e}")
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = base_delay * (2 ** attempt) * (1 + random.random())
+            if is_rate_limit_error(e):
+                throttle.pause(delay)
+            logger.warning(f"Reintento {attempt + 1}/{max_retries} del fragmento en {delay:.1f}s: {e}")
+            time.sleep(delay)
+
+
+def structure_menu(model, chunks: List[str], wine_types: Optional[List[str]] = None, workers: int = 4,
+                   max_retries: int = 3, requests_per_minute: float = 0,
+                   base_delay: float = 1.0) -> Tuple[List[Plato], List[Dict]]:
+    """Convierte los fragmentos del menú en platos con llamadas concurrentes al LLM.
+
+    Los platos se devuelven en el orden de los fragmentos y sin repetir
+    nombres (un plato partido entre dos fragmentos se queda con su primera
+    aparición).
+
+    Returns:
+        Los platos válidos y la lista de fragmentos que fallaron tras los
+        reintentos (``{'fragmento': índice, 'error': mensaje}``).
+    """
+    throttle = Throttle(requests_per_minute)
+    results: Dict[int, List[Plato]] = {}
+    failures = []
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(structure_chunk, model, chunk, throttle, wine_types, max_retries, base_delay): i
+            for i, chunk in enumerate(chunks)
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                failures.append({'fragmento': i, 'error': str(e)})
+                logger.error(f"❌ No se pudo estructurar el fragmento {i}: {e}")
+
+    platos, seen = [], set()
+    for i in sorted(results):
+        for plato in results[i]:
+            key = normalize_dish_name(plato['nombre_plato'])
+            if key not in seen:
+                seen.add(key)
+                platos.append(plato)
+
+    logger.info(f"Menú estructurado: {len(platos)} platos de {len(chunks)} fragmentos "
+                f"({len(failures)} fallidos) en {time.perf_counter() - start:.1f}s")
+    return platos, sorted(failures, key=lambda f: f['fragmento'])
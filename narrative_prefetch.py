@@ -0,0 +1,132 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from narratives import NarrativeCache, narrative_key, shared_narrative_stream
+from telemetry import METRICS, annotate, span
+
+logger = logging.getLogger(__name__)
+
+# Narrativas que se generan a la vez en segundo plano (llamadas simultáneas al LLM)
+NARRATIVE_PREFETCH_WORKERS = int(os.getenv('NARRATIVE_PREFETCH_WORKERS', '4'))
+
+METRICS.describe('sumiller_narrative_prefetch_total', 'counter',
+                 "Narrativas anticipadas por resultado (queued/done/cancelled/error)")
+
+
+class _PrefetchJob:
+    """Narrativa en curso: texto recibido hasta ahora y aviso de cancelación"""
+
+    __slots__ = ('future', 'text', 'cancelled')
+
+    def __init__(self):
+        self.future: Optional[Future] = None
+        self.text = ''
+        self.cancelled = threading.Event()
+
+    def cancel(self) -> bool:
+        """Marca la narrativa como abandonada; True si aún no había empezado (y ya no empezará)"""
+        self.cancelled.set()
+        return self.future is not None and self.future.cancel()
+
+
+class NarrativePrefetcher:
+    """Genera en segundo plano las narrativas de todas las opciones mostradas.
+
+    En cuanto se dibuja la tabla de recomendaciones, ``prefetch`` encola la
+    narrativa de cada vino que no esté ya en la caché persistente, de modo que
+    al cambiar de opción la narrativa ya está guardada o en camino (se genera
+    con ``shared_narrative_stream``, así que quien la pida mientras tanto sigue
+    la misma llamada). Cada sesión declara qué opciones está mostrando: las
+    narrativas que ninguna sesión sigue mostrando (el comensal cambió de plato)
+    se cancelan, las encoladas sin llegar a llamar al LLM y las que están en
+    streaming en el siguiente fragmento, sin guardarse.
+    """
+
+    def __init__(self, cache: NarrativeCache, model, workers: int = NARRATIVE_PREFETCH_WORKERS):
+        self.cache = cache
+        self.model = model
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='narrativas')
+        self._jobs: Dict[str, _PrefetchJob] = {}
+        self._wanted: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def prefetch(self, session: str, pairings: Iterable[Tuple[Dict, Dict]]) -> int:
+        """Encola las narrativas que faltan de las opciones que muestra una sesión.
+
+        Args:
+            session: Identificador de la sesión (o del cliente) que muestra las opciones
+            pairings: ``(wine_info, plato_info)`` de cada opción, como los da ``pairing_fields``
+
+        Returns:
+            Número de narrativas encoladas
+        """
+        pairings = {narrative_key(wine_info, plato_info): (wine_info, plato_info)
+                    for wine_info, plato_info in pairings}
+        with self._lock:
+            abandoned = self._wanted.get(session, set()) - pairings.keys()
+            self._wanted[session] = set(pairings)
+            # Solo se recuerdan las sesiones con alguna narrativa todavía en curso
+            self._wanted = {s: keys for s, keys in self._wanted.items()
+                            if s == session or keys & self._jobs.keys()}
+            still_wanted = set().union(*self._wanted.values())
+            # Las que aún no habían empezado ya no llaman al LLM; las que están en
+            # streaming se detienen en el siguiente fragmento
+            not_started = 0
+            for key in abandoned - still_wanted:
+                job = self._jobs.pop(key, None)
+                if job is not None and job.cancel():
+                    not_started += 1
+            missing = [key for key in pairings if key not in self._jobs]
+
+        if not_started:
+            METRICS.inc('sumiller_narrative_prefetch_total', not_started, result='cancelled')
+        queued = 0
+        for key in missing:
+            if self.cache.get(key) is not None:
+                continue
+            with self._lock:
+                if key in self._jobs:
+                    continue
+                job = self._jobs[key] = _PrefetchJob()
+                job.future = self._executor.submit(self._generate, key, job, *pairings[key])
+            queued += 1
+        if queued:
+            METRICS.inc('sumiller_narrative_prefetch_total', queued, result='queued')
+        return queued
+
+    def close(self) -> None:
+        """Cancela las narrativas pendientes y libera los hilos"""
+        with self._lock:
+            for job in self._jobs.values():
+                job.cancel()
+            self._jobs.clear()
+            self._wanted.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _generate(self, key: str, job: _PrefetchJob, wine_info: Dict, plato_info: Dict) -> None:
+        result = 'error'
+        try:
+            # Puede que otra sesión la haya generado mientras estaba en cola
+            if job.cancelled.is_set() or self.cache.get(key) is not None:
+                result = 'cancelled' if job.cancelled.is_set() else 'done'
+                return
+            with span('prefetch_narrative'):
+                for _ in shared_narrative_stream(self.model, self.cache, key, wine_info, plato_info):
+                    if job.cancelled.is_set():
+                        result = 'cancelled'
+                        annotate(cancelled=True)
+                        return
+            result = 'done'
+        except Exception as e:
+            logger.warning(f"No se pudo anticipar la narrativa de {wine_info.get('nombre')!r}: {e}")
+        finally:
+            METRICS.inc('sumiller_narrative_prefetch_total', result=result)
+            with self._lock:
+                if self._jobs.get(key) is job:
+                    del self._jobs[key]
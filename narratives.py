@@ -0,0 +1,297 @@
+import hashlib
+import json
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
+from single_flight import SingleFlight
+from telemetry import record_llm_usage
+
+# Versión de la plantilla del prompt: cambiarla invalida todas las narrativas cacheadas
+PROMPT_VERSION = "v2"
+
+GEMINI_MODEL = 'gemini-2.5-flash'
+
+# Configuración por defecto de la caché de narrativas
+NARRATIVE_CACHE_PATH = os.getenv('NARRATIVE_CACHE_PATH', './data/narrativas.sqlite')
+NARRATIVE_CACHE_TTL = 30 * 24 * 3600  # 30 días
+NARRATIVE_CACHE_MAX_ENTRIES = 20000
+
+# Segundos sin recibir ningún fragmento tras los que se abandona el streaming
+STREAM_STALL_TIMEOUT = 6.0
+
+# Narrativas que se están generando en el proceso, por clave: las sesiones y
+# peticiones que piden la misma a la vez comparten una sola llamada al LLM
+NARRATIVE_FLIGHTS = SingleFlight('narrativa')
+
+
+def _field(data: Dict, key: str, default):
+    """Valor de un campo, tratando None y NaN (columnas ausentes en un DataFrame) como vacíos"""
+    value = data.get(key, default)
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return default
+    return value
+
+
+def _rounded(value, digits: int = 2):
+    """Redondea valores numéricos (los float32 del almacén columnar no son exactos)"""
+    try:
+        return round(float(value), digits)
+    except (TypeError, ValueError):
+        return value
+
+
+def pairing_fields(wine_data: Dict, plato_name: str, plato_data: Dict) -> Tuple[Dict, Dict]:
+    """Extrae los campos del vino y del plato que intervienen en el prompt"""
+    wine_info = {
+        "nombre": _field(wine_data, 'wine', 'Vino seleccionado'),
+        "bodega": _field(wine_data, 'winery', ''),
+        "año": _field(wine_data, 'year', ''),
+        "tipo": _field(wine_data, 'type', '').lower(),
+        "país": _field(wine_data, 'country', ''),
+        "región": _field(wine_data, 'region', ''),
+        "acidez": _rounded(_field(wine_data, 'acidity', 0)),
+        "cuerpo": _rounded(_field(wine_data, 'body', 0))
+    }
+
+    plato_info = {
+        "nombre": plato_name,
+        "descripción": _field(plato_data, 'descripcion', ''),
+        "acidez": _field(plato_data, 'acidez', 0),
+        "cuerpo": _field(plato_data, 'cuerpo', 0),
+        "ingredientes": _field(plato_data, 'ingredientes_clave', [])
+    }
+
+    return wine_info, plato_info
+
+
+def build_pairing_prompt(wine_info: Dict, plato_info: Dict) -> str:
+    """Crea el prompt de maridaje para Gemini"""
+    return f"""
+            Eres un sommelier experto en maridajes. Genera una descripción profesional y clara del
+            maridaje entre un vino y un plato. Usa un lenguaje elegante y preciso, evitando tanto
+            tecnicismos excesivos como expresiones demasiado poéticas o metafóricas.
+
+            VINO:
+            - Nombre: {wine_info['nombre']}
+            - Bodega: {wine_info['bodega']}
+            - Año: {wine_info['año']}
+            - Tipo: {wine_info['tipo']}
+            - Región: {wine_info['región']}, {wine_info['país']}
+            - Acidez: {wine_info['acidez']}/5
+            - Cuerpo: {wine_info['cuerpo']}/5
+
+            PLATO:
+            - Nombre: {plato_info['nombre']}
+            - Descripción: {plato_info['descripción']}
+            - Acidez: {plato_info['acidez']}/5
+            - Cuerpo: {plato_info['cuerpo']}/5
+            - Ingredientes clave: {', '.join(plato_info['ingredientes'])}
+
+            Por favor, genera una recomendación que incluya:
+            1. Un título descriptivo y elegante
+            2. Una explicación clara del equilibrio entre el vino y el plato
+            3. Una descripción precisa de aromas y texturas
+            4. Recomendaciones prácticas de servicio y temperatura
+            5. Una breve conclusión sobre la experiencia de maridaje
+
+            El formato debe ser en Markdown e incluir emojis apropiados.
+            Usa un tono profesional y accesible, como un experto compartiendo su conocimiento
+            de manera clara y directa. Evita metáforas elaboradas o lenguaje demasiado florido.
+
+            La descripción debe enfocarse en aspectos tangibles y prácticos del maridaje,
+            destacando características específicas que hacen que esta combinación funcione bien.
+            """
+
+
+def generate_narrative(model, wine_info: Dict, plato_info: Dict) -> str:
+    """Llama al modelo y devuelve el texto generado; lanza una excepción si viene vacío"""
+    response = model.generate_content(build_pairing_prompt(wine_info, plato_info))
+    record_llm_usage(response)
+    if not response.text:
+        raise Exception("No se generó respuesta")
+    return response.text
+
+
+def stream_narrative(model, wine_info: Dict, plato_info: Dict,
+                     stall_timeout: float = STREAM_STALL_TIMEOUT) -> Iterator[str]:
+    """Genera la narrativa en streaming, devolviendo los fragmentos según llegan.
+
+    El stream se consume en un hilo aparte para poder aplicar un plazo entre
+    fragmentos: si pasan más de ``stall_timeout`` segundos sin recibir nada
+    (incluido el primer fragmento) se lanza ``TimeoutError``.
+    """
+    chunks: queue.Queue = queue.Queue()
+    stop = threading.Event()
+    done = object()
+    last_chunk = {}
+
+    def consume():
+        try:
+            for chunk in model.generate_content(build_pairing_prompt(wine_info, plato_info), stream=True):
+                if stop.is_set():
+                    return
+                # El último fragmento trae el recuento de tokens de toda la respuesta
+                last_chunk['response'] = chunk
+                chunks.put(chunk.text)
+            chunks.put(done)
+        except Exception as e:
+            chunks.put(e)
+
+    threading.Thread(target=consume, daemon=True).start()
+
+    received = False
+    try:
+        while True:
+            try:
+                item = chunks.get(timeout=stall_timeout)
+            except queue.Empty:
+                raise TimeoutError(f"El stream no envió datos en {stall_timeout:.1f}s")
+            if item is done:
+                record_llm_usage(last_chunk.get('response'))
+                break
+            if isinstance(item, Exception):
+                raise item
+            if item:
+                received = True
+                yield item
+        if not received:
+            raise Exception("No se generó respuesta")
+    finally:
+        stop.set()
+
+
+def shared_narrative_stream(model, cache: 'NarrativeCache', key: str,
+                            wine_info: Dict, plato_info: Dict) -> Iterator[str]:
+    """Texto acumulado de la narrativa de ``key`` según se genera, guardándola al terminar.
+
+    Si la misma narrativa ya se está generando en el proceso (otra sesión,
+    otra petición o la generación anticipada) se sigue esa llamada en lugar de
+    hacer otra al LLM.
+    """
+    def produce() -> Iterator[str]:
+        # La llamada que la generaba pudo terminar justo antes de empezar esta
+        text = cache.get(key)
+        if text is not None:
+            yield text
+            return
+        text = ""
+        for chunk in stream_narrative(model, wine_info, plato_info):
+            text += chunk
+            yield text
+        cache.set(key, text)
+
+    return NARRATIVE_FLIGHTS.stream(key, produce)
+
+
+def _plain(value):
+    """Convierte escalares de NumPy/pandas a tipos de Python para un hash estable"""
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if hasattr(value, 'item'):
+        value = value.item()
+    # 3 y 3.0 deben producir la misma clave (MongoDB frente a columnas de pandas)
+    if isinstance(value, int) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
+def narrative_key(wine_info: Dict, plato_info: Dict, model_name: str = GEMINI_MODEL) -> str:
+    """Clave de contenido (SHA-256) de una narrativa: campos del prompt + versión + modelo"""
+    payload = {
+        "prompt_version": PROMPT_VERSION,
+        "modelo": model_name,
+        "vino": {k: _plain(v) for k, v in wine_info.items()},
+        "plato": {k: _plain(v) for k, v in plato_info.items()},
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+class NarrativeCache:
+    """Caché persistente en SQLite de las narrativas de maridaje generadas por el LLM.
+
+    Las entradas caducan tras ``ttl`` segundos y, al superar ``max_entries``,
+    se eliminan las menos usadas recientemente (LRU). Cada operación abre su
+    propia conexión, por lo que la caché puede compartirse entre hilos y procesos.
+    """
+
+    def __init__(self, path: str = NARRATIVE_CACHE_PATH, ttl: float = NARRATIVE_CACHE_TTL,
+                 max_entries: int = NARRATIVE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS narrativas (
+                       clave TEXT PRIMARY KEY,
+                       narrativa TEXT NOT NULL,
+                       creada REAL NOT NULL,
+                       ultimo_acceso REAL NOT NULL
+                   )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_ultimo_acceso ON narrativas (ultimo_acceso)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Abre una conexión, confirma la transacción al salir y la cierra"""
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> Optional[str]:
+        """Devuelve la narrativa cacheada o None si no existe o ha caducado"""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT narrativa, creada FROM narrativas WHERE clave = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                conn.execute("DELETE FROM narrativas WHERE clave = ?", (key,))
+                return None
+            conn.execute("UPDATE narrativas SET ultimo_acceso = ? WHERE clave = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, narrative: str) -> None:
+        """Guarda una narrativa y aplica la política de expulsión"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO narrativas (clave, narrativa, creada, ultimo_acceso) VALUES (?, ?, ?, ?)",
+                (key, narrative, now, now)
+            )
+            conn.execute("DELETE FROM narrativas WHERE creada < ?", (now - self.ttl,))
+            conn.execute(
+                """DELETE FROM narrativas WHERE clave IN (
+                       SELECT clave FROM narrativas ORDER BY ultimo_acceso DESC LIMIT -1 OFFSET ?
+                   )""",
+                (self.max_entries,)
+            )
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __len__(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM narrativas").fetchone()[0]
+
+    def clear(self) -> None:
+        """Elimina todas las narrativas cacheadas"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM narrativas")
@@ -0,0 +1,149 @@
+import argparse
+import json
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from batch_recommender import BatchRecommender
+from llm_throttle import Throttle, is_rate_limit_error
+from narratives import GEMINI_MODEL, NARRATIVE_CACHE_PATH, NarrativeCache, generate_narrative, narrative_key, pairing_fields
+from wine_store import WINE_CSV_PATH, load_wine_catalogue
+
+logger = logging.getLogger(__name__)
+
+# Trabajo de generación: (clave de caché, datos del vino, datos del plato)
+Job = Tuple[str, Dict, Dict]
+
+
+def collect_jobs(df_vinos: pd.DataFrame, platos: Iterable[Dict]) -> List[Job]:
+    """Enumera los pares (plato, vino recomendado) sin repetir claves"""
+    platos = list(platos)
+    # Una recomendación por plato (no por nombre): varios restaurantes pueden compartir nombres
+    recommendations = BatchRecommender(df_vinos).recommend_each(platos)
+
+    jobs: Dict[str, Job] = {}
+    for plato, wines in zip(platos, recommendations):
+        for wine_data in wines.to_dict('records'):
+            wine_info, plato_info = pairing_fields(wine_data, plato.get('nombre_plato', ''), plato)
+            key = narrative_key(wine_info, plato_info)
+            jobs.setdefault(key, (key, wine_info, plato_info))
+    return list(jobs.values())
+
+
+def generate_with_retries(model, job: Job, throttle: Throttle, max_retries: int = 5,
+                          base_delay: float = 1.0) -> str:
+    """Genera una narrativa reintentando con espera exponencial (y pausa global ante un 429)"""
+    _, wine_info, plato_info = job
+    for attempt in range(max_retries + 1):
+        throttle.wait()
+        try:
+            return generate_narrative(model, wine_info, plato_info)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = base_delay * (2 ** attempt) * (1 + random.random())
+            if is_rate_limit_error(e):
+                throttle.pause(delay)
+            logger.warning(f"Reintento {attempt + 1}/{max_retries} para '{plato_info['nombre']}' "
+                           f"en {delay:.1f}s: {e}")
+            time.sleep(delay)
+
+
+def pregenerate(model, jobs: List[Job], cache: NarrativeCache, workers: int = 8,
+                max_retries: int = 5, requests_per_minute: float = 0, base_delay: float = 1.0) -> Dict:
+    """Genera en paralelo las narrativas que aún no están en la caché.
+
+    La propia caché actúa como registro de progreso: cada narrativa se guarda
+    en cuanto se genera, así que al relanzar el proceso solo se procesan las
+    que faltan.
+
+    Returns:
+        Resumen con el número de narrativas generadas, ya existentes y fallidas,
+        el tiempo total y el throughput (narrativas/s).
+    """
+    pending = [job for job in jobs if cache.get(job[0]) is None]
+    summary = {"total": len(jobs), "existentes": len(jobs) - len(pending), "generadas": 0, "fallidas": 0}
+    logger.info(f"Narrativas: {summary['total']} en total, {summary['existentes']} ya generadas, "
+                f"{len(pending)} pendientes")
+
+    throttle = Throttle(requests_per_minute)
+    start = time.perf_counter()
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {
+            executor.submit(generate_with_retries, model, job, throttle, max_retries, base_delay): job
+            for job in pending
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            key, _, plato_info = futures[future]
+            try:
+                cache.set(key, future.result())
+                summary["generadas"] += 1
+            except Exception as e:
+                summary["fallidas"] += 1
+                logger.error(f"❌ No se pudo generar la narrativa de '{plato_info['nombre']}': {e}")
+            if done % 50 == 0 or done == len(pending):
+                logger.info(f"Progreso: {done}/{len(pending)}")
+    finally:
+        # Ante una interrupción, las narrativas ya guardadas se conservan
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    summary["segundos"] = round(time.perf_counter() - start, 3)
+    summary["narrativas_por_segundo"] = round(summary["generadas"] / summary["segundos"], 3) if summary["segundos"] else 0.0
+    return summary
+
+
+def load_platos(mongo_uri: str, platos_json: Optional[str] = None) -> List[Dict]:
+    """Carga los platos desde un fichero JSON o desde ``menu_database.platos``"""
+    if platos_json:
+        with open(platos_json, encoding='utf-8') as f:
+            return json.load(f)
+
+    from menu_repository import get_repository
+    return get_repository(mongo_uri).find_platos()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Pregenera todas las narrativas del menú antes del servicio"""
+    parser = argparse.ArgumentParser(description="Pregeneración de narrativas de maridaje")
+    parser.add_argument('--vinos', default=WINE_CSV_PATH, help="Ruta del dataset de vinos")
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017/', help="Conexión a MongoDB")
+    parser.add_argument('--platos-json', help="Leer los platos de un fichero JSON en lugar de MongoDB")
+    parser.add_argument('--cache', default=NARRATIVE_CACHE_PATH, help="Fichero SQLite de la caché de narrativas")
+    parser.add_argument('--workers', type=int, default=8, help="Número máximo de llamadas simultáneas")
+    parser.add_argument('--max-retries', type=int, default=5, help="Reintentos por narrativa")
+    parser.add_argument('--rpm', type=float, default=0, help="Límite de peticiones por minuto (0 = sin límite)")
+    parser.add_argument('--stub-latency', type=float, help="Usar un LLM local simulado con esta latencia (s)")
+    parser.add_argument('--stub-failure-rate', type=float, default=0.0, help="Tasa de errores del LLM simulado")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.stub_latency is not None:
+        from llm_stub import StubLLM
+        model = StubLLM(latency=args.stub_latency, failure_rate=args.stub_failure_rate)
+        base_delay = 0.01
+    else:
+        import os
+        import google.generativeai as genai
+        from dotenv import load_dotenv
+        load_dotenv()
+        genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+        model = genai.GenerativeModel(GEMINI_MODEL)
+        base_delay = 1.0
+
+    df_vinos = load_wine_catalogue(args.vinos)
+
+    jobs = collect_jobs(df_vinos, load_platos(args.mongo_uri, args.platos_json))
+    summary = pregenerate(model, jobs, NarrativeCache(args.cache), workers=args.workers,
+                          max_retries=args.max_retries, requests_per_minute=args.rpm,
+                          base_delay=base_delay)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import datetime
+import hashlib
+import json
+import logging
+import threading
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from batch_recommender import BatchRecommender, plato_properties
+from menu_repository import MenuRepository
+from wine_index import WineIndex
+
+logger = logging.getLogger(__name__)
+
+
+# Huellas ya calculadas por objeto DataFrame (se olvidan cuando el DataFrame se libera)
+_catalogue_versions: Dict[int, Tuple[weakref.ref, str]] = {}
+_catalogue_versions_lock = threading.Lock()
+
+
+def catalogue_version(df_vinos: pd.DataFrame) -> str:
+    """Huella del contenido del catálogo de vinos (cambia si cambia cualquier vino)
+
+    Se calcula una vez por DataFrame: el catálogo es compartido y no se
+    modifica in situ, así que cada ejecución de la app o petición que lo
+    consulte reutiliza la huella en lugar de volver a recorrerlo.
+    """
+    key = id(df_vinos)
+    with _catalogue_versions_lock:
+        cached = _catalogue_versions.get(key)
+    if cached is not None and cached[0]() is df_vinos:
+        return cached[1]
+
+    hashes = pd.util.hash_pandas_object(df_vinos, index=False).to_numpy()
+    digest = hashlib.sha1(hashes.tobytes())
+    digest.update(json.dumps(list(map(str, df_vinos.columns))).encode('utf-8'))
+    version = digest.hexdigest()
+    with _catalogue_versions_lock:
+        _catalogue_versions[key] = (weakref.ref(df_vinos, lambda _: _forget_catalogue(key)), version)
+    return version
+
+
+def _forget_catalogue(key: int) -> None:
+    with _catalogue_versions_lock:
+        _catalogue_versions.pop(key, None)
+
+
+def dish_fingerprint(plato: Dict, tolerance: float) -> str:
+    """Huella de las propiedades del plato de las que dependen sus recomendaciones"""
+    acidity, body, maridajes = plato_properties(plato)
+    encoded = json.dumps([acidity, body, [m.lower() for m in maridajes], tolerance])
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def _records(df: pd.DataFrame) -> List[Dict]:
+    """Filas del DataFrame como tipos de Python (sin NumPy ni NaN) para guardarlas en MongoDB"""
+    if df.empty:
+        return []
+    return json.loads(df.to_json(orient='records', force_ascii=False))
+
+
+class RecommendationTable:
+    """Tabla materializada plato -> vinos recomendados.
+
+    Las recomendaciones de un plato solo dependen de su acidez, cuerpo y
+    maridajes y del catálogo de vinos, así que se calculan una vez y se sirven
+    con una búsqueda en un diccionario. Cada entrada guarda la huella del
+    plato y la versión del catálogo con que se calculó; ``sync`` solo vuelve a
+    calcular (en bloque, con ``BatchRecommender``) los platos nuevos o cuyas
+    propiedades cambiaron, y todos si cambia el catálogo. La tabla se
+    persiste en ``menu_database.recomendaciones`` para que otros procesos o un
+    reinicio no tengan que recalcularla.
+    """
+
+    def __init__(self, repository: MenuRepository, tolerance: float = 0.4):
+        self.repository = repository
+        self.tolerance = tolerance
+        self.catalogue_version: Optional[str] = None
+        self.dish_version: Optional[int] = None
+
+        self._df_vinos: Optional[pd.DataFrame] = None
+        self._batch: Optional[BatchRecommender] = None
+        self._entries: Dict[Any, Dict] = {}
+        self._by_name: Dict[Tuple[Optional[str], str], Any] = {}
+        self._lock = threading.RLock()
+
+    def set_catalogue(self, df_vinos: pd.DataFrame, wine_index: Optional[WineIndex] = None) -> None:
+        """Asocia el catálogo de vinos; si es otro distinto invalida toda la tabla"""
+        with self._lock:
+            if df_vinos is self._df_vinos:
+                return
+            version = catalogue_version(df_vinos)
+            self._df_vinos = df_vinos
+            self._batch = BatchRecommender(df_vinos, wine_index, self.tolerance)
+            if version == self.catalogue_version:
+                return
+
+            self.catalogue_version = version
+            self.dish_version = None
+            self._entries = {}
+            self._by_name = {}
+            try:
+                persisted = self.repository.load_recommendations(version)
+            except Exception as e:
+                logger.warning(f"No se pudieron leer las recomendaciones guardadas: {e}")
+                persisted = []
+            for document in persisted:
+                self._entries[document['_id']] = {
+                    'huella': document['huella'],
+                    'nombre_plato': document.get('nombre_plato'),
+                    'restaurante': document.get('restaurante'),
+                    'vinos': pd.DataFrame(document['vinos']),
+                }
+            logger.info(f"Catálogo {version[:8]}: {len(persisted)} recomendaciones materializadas reutilizadas")
+
+    def sync(self, dish_version: Optional[int] = None, platos: Optional[List[Dict]] = None) -> Dict[str, int]:
+        """Pone la tabla al día con los platos del menú.
+
+        Args:
+            dish_version: versión del menú (p.ej. ``DishStore.version``). Si ya
+                se sincronizó con esa versión no se consulta nada.
+            platos: documentos de los platos (con ``_id``). Por defecto se
+                leen del repositorio.
+
+        Returns:
+            Resumen con los platos recalculados, reutilizados y eliminados.
+        """
+        with self._lock:
+            if self._batch is None:
+                raise RuntimeError("La tabla de recomendaciones no tiene catálogo de vinos")
+            if dish_version is not None and dish_version == self.dish_version:
+                return {'recalculados': 0, 'reutilizados': len(self._entries), 'eliminados': 0}
+
+            if platos is None:
+                platos = self.repository.find_platos(include_id=True)
+
+            fingerprints = {plato['_id']: dish_fingerprint(plato, self.tolerance) for plato in platos}
+            stale = [plato for plato in platos
+                     if self._entries.get(plato['_id'], {}).get('huella') != fingerprints[plato['_id']]]
+            removed = [dish_id for dish_id in self._entries if dish_id not in fingerprints]
+
+            updated = []
+            for plato, wines in zip(stale, self._batch.recommend_each(stale)):
+                entry = {
+                    'huella': fingerprints[plato['_id']],
+                    'nombre_plato': plato.get('nombre_plato'),
+                    'restaurante': plato.get('restaurante'),
+                    'vinos': wines,
+                }
+                self._entries[plato['_id']] = entry
+                updated.append(dict(entry, _id=plato['_id'], vinos=_records(wines),
+                                    version_catalogo=self.catalogue_version,
+                                    actualizado=datetime.datetime.now()))
+            for dish_id in removed:
+                del self._entries[dish_id]
+
+            # Los nombres pueden cambiar sin que cambien las propiedades
+            for plato in platos:
+                entry = self._entries[plato['_id']]
+                entry['nombre_plato'] = plato.get('nombre_plato')
+                entry['restaurante'] = plato.get('restaurante')
+            self._by_name = {}
+            for plato in platos:
+                self._by_name.setdefault((plato.get('restaurante'), plato.get('nombre_plato')), plato['_id'])
+                self._by_name.setdefault((None, plato.get('nombre_plato')), plato['_id'])
+
+            try:
+                self.repository.save_recommendations(updated)
+                self.repository.delete_recommendations(removed)
+            except Exception as e:
+                # La tabla en memoria sigue siendo válida aunque no se pueda persistir
+                logger.warning(f"No se pudieron guardar las recomendaciones materializadas: {e}")
+
+            self.dish_version = dish_version
+            summary = {'recalculados': len(stale), 'reutilizados': len(platos) - len(stale),
+                       'eliminados': len(removed)}
+            if stale or removed:
+                logger.info(f"Tabla de recomendaciones actualizada: {summary}")
+            return summary
+
+    def get(self, nombre_plato: str, restaurante: Optional[str] = None) -> Optional[pd.DataFrame]:
+        """Vinos recomendados para un plato, o None si el plato no está en la tabla"""
+        dish_id = self._by_name.get((restaurante, nombre_plato))
+        entry = self._entries.get(dish_id)
+        return None if entry is None else entry['vinos']
+
+    def __len__(self) -> int:
+        return len(self._entries)
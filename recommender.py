@@ -0,0 +1,309 @@
+import logging
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from batch_recommender import BatchRecommender
+from menu_repository import document_fingerprint
+from narratives import (GEMINI_MODEL, NARRATIVE_FLIGHTS, NarrativeCache, generate_narrative, narrative_key,
+                        pairing_fields)
+from recommendation_table import catalogue_version
+from single_flight import SingleFlight
+from telemetry import annotate, span
+from wine_index import WineIndex
+from wine_inventory import RestaurantInventory, WineInventory
+from similarity_engine import SimilarityEngine
+from wine_ranking import PRICE_TIERS, rank_by_tier, score_arrays
+
+logger = logging.getLogger(__name__)
+
+# Rankings en curso en el proceso: las sesiones que piden el mismo a la vez lo comparten
+RANKING_FLIGHTS = SingleFlight('ranking')
+
+
+class WineRecommender:
+    """Núcleo de recomendación: ranking de vinos por plato y narrativa del maridaje.
+
+    No depende de Streamlit, de modo que lo comparten la aplicación web y el
+    servicio HTTP. El catálogo se fija con ``set_catalogue`` y el modelo de
+    Gemini y la caché de narrativas se crean en el primer uso. Si se asigna
+    ``inventory``, las recomendaciones de un restaurante se limitan a los vinos
+    que tiene en existencias y usan sus precios de carta. Si se asigna
+    ``similarity_engine`` (``SimilarityEngine`` o ``EmbeddingSearch``),
+    ``rank_wines`` elige los candidatos por similitud en lugar de por radio en
+    acidez y cuerpo.
+    
+    Los rankings y narrativas idénticos que se piden a la vez desde varias
+    sesiones o peticiones del proceso se calculan una sola vez (``SingleFlight``).
+    """
+
+    def __init__(self):
+        self.df_vinos = None
+        self.wine_index = None
+        self.wine_types = []  # Se llenará cuando se carguen los datos
+        self.model = None
+        self.narrative_cache = None
+        self.inventory: Optional[WineInventory] = None
+        self.similarity_engine: Optional[SimilarityEngine] = None  # o EmbeddingSearch
+        self._prices: Optional[np.ndarray] = None
+        self._scores: Optional[np.ndarray] = None
+
+    def set_catalogue(self, df_vinos: pd.DataFrame, wine_index: Optional[WineIndex] = None) -> None:
+        """Fija el catálogo de vinos, su lista de tipos y su índice de búsqueda"""
+        self.df_vinos = df_vinos
+        if not df_vinos.empty and 'type' in df_vinos.columns:
+            self.wine_types = sorted(df_vinos['type'].dropna().unique().tolist())
+            self.wine_index = wine_index if wine_index is not None else WineIndex(df_vinos)
+            self._prices, self._scores = score_arrays(df_vinos)
+        if self.inventory is not None:
+            self.inventory.set_catalogue(df_vinos)
+
+    def stock_for(self, restaurante: Optional[str]) -> Optional[RestaurantInventory]:
+        """Inventario del restaurante (None si no tiene y se recomienda sobre todo el catálogo)"""
+        return self.inventory.get(restaurante) if self.inventory is not None else None
+
+    def get_gemini_model(self):
+        """Modelo de Gemini (se crea la primera vez que se necesita)"""
+        if self.model is None:
+            import google.generativeai as genai
+            genai.configure(api_key=os.getenv('GOOGLE_API_KEY'))
+            self.model = genai.GenerativeModel(GEMINI_MODEL)
+        return self.model
+
+    def get_narrative_cache(self) -> NarrativeCache:
+        """Caché persistente de narrativas (se abre la primera vez que se necesita)"""
+        if self.narrative_cache is None:
+            self.narrative_cache = NarrativeCache()
+        return self.narrative_cache
+
+    def filter_wines_by_similarity(self, df_vinos: pd.DataFrame, target_acidity: float, 
+                                 target_body: float, wine_type: str, 
+                                 recommended_types: List[str], tolerance: float = 0.4,
+                                 stock: Optional[RestaurantInventory] = None) -> pd.DataFrame:
+        """Filtra vinos por similitud en acidez y cuerpo, considerando los maridajes recomendados
+        
+        Los valores de acidez y cuerpo deben estar normalizados entre 0 y 1.
+        La tolerancia por defecto es 0.4 para permitir encontrar valores aproximados.
+        Con ``stock`` solo se consideran los vinos en existencias del restaurante,
+        con su precio de carta.
+        """
+        # Verificar si el tipo de vino está en los maridajes recomendados
+        if wine_type.lower() not in [t.lower() for t in recommended_types]:
+            return pd.DataFrame()
+            
+        # Construir el índice si aún no existe (o si el catálogo ha cambiado)
+        if self.wine_index is None or self.wine_index.n_rows != len(df_vinos):
+            self.wine_index = WineIndex(df_vinos)
+        
+        # Buscar por tipo de vino y distancia euclidiana normalizada en el índice.
+        # La distancia máxima posible en un espacio normalizado 2D es √2 ≈ 1.414;
+        # si no hay coincidencias el índice amplía la tolerancia (máximo 0.8)
+        if stock is not None and stock.n_rows != len(df_vinos):
+            raise ValueError(f"El inventario de {stock.restaurante} no corresponde a este catálogo")
+        positions, distances = self.wine_index.search(wine_type, target_acidity, target_body, tolerance,
+                                                      stock.in_stock if stock is not None else None)
+        
+        # Solo se copian las filas seleccionadas, nunca el catálogo
+        df_filtered = df_vinos.iloc[positions].copy()
+        df_filtered['distance'] = distances
+        if stock is not None:
+            df_filtered['price'] = stock.prices(positions, df_filtered['price'].to_numpy(dtype=np.float64))
+        
+        return df_filtered
+    
+    def divide_wines_by_price_ranges(self, df_wines: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        """Divide los vinos en tres rangos de precio (tercios)"""
+        if df_wines.empty:
+            return {"Económico": pd.DataFrame(), "Intermedio": pd.DataFrame(), "Premium": pd.DataFrame()}
+        
+        # Calcular percentiles
+        p33 = df_wines['price'].quantile(0.33)
+        p66 = df_wines['price'].quantile(0.66)
+        
+        economico = df_wines[df_wines['price'] <= p33]
+        intermedio = df_wines[(df_wines['price'] > p33) & (df_wines['price'] <= p66)]
+        premium = df_wines[df_wines['price'] > p66]
+        
+        return {
+            "Económico": economico,
+            "Intermedio": intermedio,
+            "Premium": premium
+        }
+    
+    def select_best_wine_in_range(self, df_range: pd.DataFrame) -> Optional[pd.Series]:
+        """Selecciona el mejor vino en un rango de precio basado en rating y reviews"""
+        if df_range.empty:
+            return None
+        
+        # Calcular score combinando rating y número de reviews
+        df_temp = df_range.copy()
+        df_temp['score'] = df_temp['rating'] * np.log(df_temp['num_reviews'] + 1)
+        
+        # Seleccionar el vino con mejor score
+        best_wine = df_temp.loc[df_temp['score'].idxmax()]
+        return best_wine
+    
+    def recommend_wines(self, df_vinos: pd.DataFrame, target_acidity: float, 
+                       target_body: float, recommended_types: List[str],
+                       restaurante: Optional[str] = None) -> pd.DataFrame:
+        """Recomienda vinos basándose en los maridajes sugeridos para el plato y 
+        la similitud de acidez y cuerpo (solo vinos en existencias si el restaurante tiene inventario)
+        
+        Devuelve el mejor vino de cada tipo y rango de precio; equivale a
+        ``filter_wines_by_similarity`` + ``divide_wines_by_price_ranges`` +
+        ``select_best_wine_in_range`` para cada tipo, resuelto con ``rank_wines``.
+        """
+        recommendations = self.rank_wines(df_vinos, target_acidity, target_body, recommended_types,
+                                          restaurante=restaurante)
+        return recommendations.drop(columns='rank', errors='ignore')
+    
+    def rank_wines(self, df_vinos: pd.DataFrame, target_acidity: float, target_body: float,
+                   recommended_types: List[str], top_k: int = 1,
+                   tiers: Sequence[Tuple[str, float]] = PRICE_TIERS,
+                   restaurante: Optional[str] = None, tolerance: float = 0.4,
+                   plato: Optional[Dict] = None) -> pd.DataFrame:
+        """Los ``top_k`` mejores vinos de cada tipo recomendado y rango de precio
+        
+        Trabaja sobre los arrays de precio y score precalculados del catálogo:
+        los candidatos de la búsqueda no se ordenan ni se copian, cada rango se
+        resuelve con selección parcial y solo se materializan las filas elegidas.
+        ``tiers`` son pares (nombre, cuantil superior); ver ``price_tiers``.
+        
+        Con ``similarity_engine`` y el documento del ``plato``, los candidatos de
+        cada tipo son los más parecidos según el motor (proteína, cocción,
+        salsa, texto...) y ``distance`` es ``1 - similitud``.
+        
+        Las llamadas idénticas simultáneas comparten el resultado, que por eso
+        no debe modificarse in situ.
+        
+        Returns:
+            Una fila por vino elegido, ordenadas por tipo, rango y ``rank`` (1 = mejor).
+        """
+        stock = self.stock_for(restaurante)
+        engine = self.similarity_engine
+        rank = lambda: self._rank_wines(df_vinos, target_acidity, target_body, recommended_types, top_k,
+                                        tiers, stock, engine, tolerance, plato)
+        # Solo se comparten los rankings sobre el catálogo del recomendador (otros DataFrames,
+        # p.ej. subconjuntos creados para una sola llamada, no se repiten y no merece la pena su huella)
+        if df_vinos is not self.df_vinos:
+            return rank()
+        # El inventario y el motor forman parte de la clave como objetos: mientras la llamada
+        # está en curso la clave los mantiene vivos, así que no pueden confundirse con otros
+        key = (catalogue_version(df_vinos), float(target_acidity), float(target_body),
+               tuple(sorted(t.lower() for t in recommended_types)), top_k, tuple(map(tuple, tiers)), tolerance,
+               stock,
+               (engine, document_fingerprint(plato)) if engine is not None and plato is not None else None)
+        return RANKING_FLIGHTS.do(key, rank)
+    
+    def _rank_wines(self, df_vinos: pd.DataFrame, target_acidity: float, target_body: float,
+                    recommended_types: List[str], top_k: int, tiers: Sequence[Tuple[str, float]],
+                    stock: Optional[RestaurantInventory], engine: Optional[SimilarityEngine],
+                    tolerance: float, plato: Optional[Dict]) -> pd.DataFrame:
+        if self.wine_index is None or self.wine_index.n_rows != len(df_vinos):
+            self.wine_index = WineIndex(df_vinos)
+        if self._scores is None or len(self._scores) != len(df_vinos):
+            self._prices, self._scores = score_arrays(df_vinos)
+        if stock is not None and stock.n_rows != len(df_vinos):
+            raise ValueError(f"El inventario de {stock.restaurante} no corresponde a este catálogo")
+        
+        use_engine = engine is not None and plato is not None and engine.n_rows == len(df_vinos)
+        dish_vector = engine.dish_vector(plato) if use_engine else None
+        # Sin vector del plato (p.ej. embeddings precalculados que no lo incluyen) se busca por radio
+        use_engine = dish_vector is not None
+        
+        recommended = {t.lower() for t in recommended_types}
+        chosen, rows_scanned = [], 0
+        for wine_type in self.wine_types:
+            if wine_type.lower() not in recommended:
+                continue
+            available = stock.in_stock if stock is not None else None
+            if use_engine:
+                positions, distances = engine.search(wine_type, dish_vector, available)
+            else:
+                positions, distances = self.wine_index.search(
+                    wine_type, target_acidity, target_body, tolerance, available, sort=False
+                )
+            rows_scanned += len(positions)
+            prices = self._prices[positions]
+            if stock is not None:
+                prices = stock.prices(positions, prices)
+            for tier, ranked in rank_by_tier(positions, distances, prices, self._scores[positions], tiers, top_k):
+                for rank, i in enumerate(ranked, start=1):
+                    chosen.append((positions[i], distances[i], prices[i], self._scores[positions[i]],
+                                   tiers[tier][0], wine_type.capitalize(), rank))
+        
+        annotate(rows=rows_scanned)
+        if use_engine:
+            annotate(similarity_engine=True)
+        if stock is not None:
+            annotate(restaurante=stock.restaurante)
+        if not chosen:
+            return pd.DataFrame()
+        
+        columns = list(zip(*chosen))
+        result = df_vinos.iloc[list(columns[0])].reset_index(drop=True)
+        result['distance'] = columns[1]
+        if stock is not None:
+            result['price'] = columns[2]
+        result['score'] = columns[3]
+        result['price_range'] = columns[4]
+        result['wine_type_category'] = columns[5]
+        result['rank'] = columns[6]
+        return result
+    
+    def recommend_wines_batch(self, df_vinos: pd.DataFrame, df_platos: pd.DataFrame) -> pd.DataFrame:
+        """Recomienda vinos para todos los platos del menú en una sola pasada vectorizada"""
+        if self.wine_index is None or self.wine_index.n_rows != len(df_vinos):
+            self.wine_index = WineIndex(df_vinos)
+        return BatchRecommender(df_vinos, self.wine_index).recommend_all(df_platos)
+    
+    def generate_poetic_recommendation(self, wine_data: Dict, plato_name: str, plato_data: Dict) -> str:
+        """Genera una recomendación poética y narrativa del maridaje usando Gemini API"""
+        with span('generate_poetic_recommendation', streaming=False):
+            try:
+                # Preparar los datos para el prompt
+                wine_info, plato_info = pairing_fields(wine_data, plato_name, plato_data)
+                
+                # Reutilizar la narrativa si este maridaje ya se generó antes
+                cache = self.get_narrative_cache()
+                key = narrative_key(wine_info, plato_info)
+                cached = cache.get(key)
+                if cached is not None:
+                    annotate(cache='hit')
+                    return cached
+                
+                # Llamar a Gemini API (una sola vez si otras sesiones piden la misma narrativa), guardar y devolver
+                annotate(cache='miss')
+                
+                def generate() -> str:
+                    narrative = cache.get(key)
+                    if narrative is not None:
+                        return narrative
+                    narrative = generate_narrative(self.get_gemini_model(), wine_info, plato_info)
+                    cache.set(key, narrative)
+                    return narrative
+                
+                return NARRATIVE_FLIGHTS.do(key, generate)
+
+            except Exception as e:
+                logger.error(f"Error generando recomendación: {str(e)}")
+                annotate(fallback=True)
+                return self._generate_fallback_recommendation(wine_data, plato_name)
+
+    def _generate_fallback_recommendation(self, wine_data: Dict, plato_name: str) -> str:
+        """Genera una recomendación básica en caso de error con la API"""
+        return f"""
+        ### 🍷 Recomendación de Maridaje
+        
+        ---
+        
+        **{wine_data.get('wine', 'Vino seleccionado')}** 
+        *{wine_data.get('winery', '')} ({wine_data.get('year', '')})*
+        
+        Esta combinación de vino y **{plato_name}** ofrece un equilibrio de sabores 
+        y texturas que complementan las características de ambos elementos.
+        
+        ---
+        """
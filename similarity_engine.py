@@ -0,0 +1,286 @@
+import logging
+import re
+import zlib
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from batch_recommender import plato_properties
+from menu_repository import normalize_dish_name
+from wine_index import ESCALA_ORGANOLEPTICA, WineIndex
+
+logger = logging.getLogger(__name__)
+
+# Peso de cada bloque en la similitud combinada (se normalizan para que sumen 1)
+DEFAULT_WEIGHTS = {'organoleptico': 1.0, 'categorias': 0.5, 'texto': 0.25}
+
+# Candidatos por tipo de vino que pasan al reparto por rangos de precio
+DEFAULT_POOL = 100
+
+# Valores que equivalen a no tener el atributo
+_EMPTY_VALUES = {'', 'n/a', 'na', 'ninguna', 'ninguno', 'sin salsa', 'nan', 'none'}
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+
+def _as_text(value) -> str:
+    if isinstance(value, (list, tuple)):
+        return ' '.join(str(v) for v in value)
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ''
+    return str(value)
+
+
+class FeatureBlock:
+    """Bloque de atributos del motor de similitud.
+
+    Proyecta vinos y platos en un mismo espacio de ``dim`` dimensiones, de
+    modo que el producto escalar de un vino y un plato es su similitud en ese
+    bloque (entre 0 y 1). ``fit`` recibe el catálogo y los platos del menú por
+    si el bloque necesita aprender algo de ellos.
+    """
+
+    name = ''
+    dim = 0
+
+    def fit(self, df_vinos: pd.DataFrame, platos: List[Dict]) -> None:
+        pass
+
+    def wine_matrix(self, df_vinos: pd.DataFrame) -> np.ndarray:
+        raise NotImplementedError
+
+    def dish_vector(self, plato: Dict) -> np.ndarray:
+        raise NotImplementedError
+
+
+class OrganolepticFeatures(FeatureBlock):
+    """Acidez y cuerpo normalizados (valor / 5), como en ``WineIndex``.
+
+    Los vectores se amplían a 4 dimensiones para que el producto escalar sea
+    exactamente ``1 - d²/2``, con ``d`` la distancia euclídea entre vino y plato:
+    vino ``(a, c, -(a²+c²)/2, 1)`` y plato ``(a', c', 1, 1 - (a'²+c'²)/2)``.
+    """
+
+    name = 'organoleptico'
+    dim = 4
+
+    def wine_matrix(self, df_vinos: pd.DataFrame) -> np.ndarray:
+        acidity = pd.to_numeric(df_vinos['acidity'], errors='coerce').to_numpy(dtype=np.float64) / ESCALA_ORGANOLEPTICA
+        body = pd.to_numeric(df_vinos['body'], errors='coerce').to_numpy(dtype=np.float64) / ESCALA_ORGANOLEPTICA
+        matrix = np.column_stack([acidity, body, -(acidity ** 2 + body ** 2) / 2, np.ones_like(acidity)])
+        # Los vinos sin acidez o cuerpo no están en el índice y nunca se puntúan
+        return np.nan_to_num(matrix)
+
+    def dish_vector(self, plato: Dict) -> np.ndarray:
+        acidity, body, _ = plato_properties(plato)
+        acidity = float(np.clip(acidity / ESCALA_ORGANOLEPTICA, 0, 1))
+        body = float(np.clip(body / ESCALA_ORGANOLEPTICA, 0, 1))
+        return np.array([acidity, body, 1.0, 1.0 - (acidity ** 2 + body ** 2) / 2])
+
+
+class CategoryFeatures(FeatureBlock):
+    """One-hot de proteína, cocción y salsa del plato frente a un perfil propio de cada vino.
+
+    Cada proteína, cocción o salsa del menú tiene dos cosas aprendidas de los
+    platos que la llevan: los tipos de vino con que se marida (el perfil del
+    tipo, normalizado) y el estilo medio de esos platos (acidez y cuerpo). La
+    afinidad de un vino con ese valor es el peso de su tipo multiplicado por
+    lo cerca que está su estilo del estilo medio (núcleo gaussiano de ancho
+    ``bandwidth`` en la escala 0-1), así que dentro de un mismo tipo un vino
+    fresco y ligero puntúa más con el pescado frito y uno con cuerpo con el
+    guiso de carne. Cada componente está entre 0 y el perfil del tipo, por lo
+    que la similitud con un plato sigue entre 0 y 1.
+    """
+
+    name = 'categorias'
+
+    def __init__(self, fields: Sequence[str] = ('proteina_principal', 'coccion', 'salsa'), bandwidth: float = 0.15):
+        self.fields = tuple(fields)
+        self.bandwidth = bandwidth
+        self.vocabulary: Dict[Tuple[str, str], int] = {}
+        self.dim = 0
+        self._profiles: Dict[str, np.ndarray] = {}
+        self._styles = np.empty((0, 2))
+
+    def _values(self, plato: Dict) -> Iterable[Tuple[str, str]]:
+        for field in self.fields:
+            value = normalize_dish_name(_as_text(plato.get(field)))
+            if value not in _EMPTY_VALUES:
+                yield field, value
+
+    def _one_hot(self, plato: Dict) -> np.ndarray:
+        vector = np.zeros(self.dim)
+        for key in self._values(plato):
+            column = self.vocabulary.get(key)
+            if column is not None:
+                vector[column] = 1.0
+        return vector
+
+    def fit(self, df_vinos: pd.DataFrame, platos: List[Dict]) -> None:
+        self.vocabulary = {}
+        for plato in platos:
+            for key in self._values(plato):
+                self.vocabulary.setdefault(key, len(self.vocabulary))
+        self.dim = len(self.vocabulary)
+
+        profiles: Dict[str, np.ndarray] = {}
+        style_sums, style_counts = np.zeros((self.dim, 2)), np.zeros(self.dim)
+        for plato in platos:
+            one_hot = self._one_hot(plato)
+            acidity, body, maridajes = plato_properties(plato)
+            style = np.clip(np.array([acidity, body]) / ESCALA_ORGANOLEPTICA, 0, 1)
+            style_sums += one_hot[:, None] * style
+            style_counts += one_hot
+            for wine_type in {m.lower() for m in maridajes}:
+                profiles[wine_type] = profiles.get(wine_type, 0) + one_hot
+        self._profiles = {wine_type: _normalize_rows(profile) for wine_type, profile in profiles.items()}
+        self._styles = style_sums / np.maximum(style_counts, 1)[:, None]
+
+    def wine_matrix(self, df_vinos: pd.DataFrame) -> np.ndarray:
+        # Los vinos repetidos (mismo tipo, acidez y cuerpo) se calculan una sola vez
+        type_codes, types = pd.factorize(df_vinos['type'].astype(str).str.lower())
+        acidity = pd.to_numeric(df_vinos['acidity'], errors='coerce').to_numpy(dtype=np.float64) / ESCALA_ORGANOLEPTICA
+        body = pd.to_numeric(df_vinos['body'], errors='coerce').to_numpy(dtype=np.float64) / ESCALA_ORGANOLEPTICA
+        keys = pd.DataFrame({'type': type_codes, 'acidity': acidity, 'body': body}).fillna(-1.0)
+        codes = keys.groupby(list(keys.columns), sort=False).ngroup().to_numpy()
+        uniques = keys.drop_duplicates()
+
+        profiles = np.zeros((len(types) + 1, self.dim))
+        for i, wine_type in enumerate(types):
+            if wine_type in self._profiles:
+                profiles[i] = self._profiles[wine_type]
+        style = uniques[['acidity', 'body']].to_numpy(dtype=np.float64)
+        distances = ((style[:, None, :] - self._styles[None, :, :]) ** 2).sum(axis=-1)
+        affinity = np.exp(-distances / (2 * self.bandwidth ** 2))
+        # El código de tipo -1 (sin tipo) cae en la última fila de perfiles, que es cero,
+        # y los vinos sin acidez o cuerpo (-1) no están en el índice y nunca se puntúan
+        table = (profiles[uniques['type'].to_numpy()] * affinity).astype(np.float32)
+        return table[codes]
+
+    def dish_vector(self, plato: Dict) -> np.ndarray:
+        return _normalize_rows(self._one_hot(plato))
+
+
+class TextFeatures(FeatureBlock):
+    """Bolsa de palabras con hashing (no hay vocabulario que ajustar) de vinos y platos.
+
+    El texto del vino es su nombre, bodega, región y tipo; el del plato su
+    nombre, descripción, ingredientes y maridajes. Los valores repetidos del
+    catálogo (las columnas son casi siempre categóricas) se vectorizan una sola vez.
+    """
+
+    name = 'texto'
+    wine_fields = ('wine', 'winery', 'region', 'type')
+    dish_fields = ('nombre_plato', 'descripcion', 'ingredientes_clave', 'maridaje')
+
+    def __init__(self, dim: int = 64):
+        self.dim = dim
+
+    def _counts(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim)
+        for token in re.findall(r'[a-z0-9]+', normalize_dish_name(text)):
+            vector[zlib.crc32(token.encode('utf-8')) % self.dim] += 1.0
+        return vector
+
+    def wine_matrix(self, df_vinos: pd.DataFrame) -> np.ndarray:
+        matrix = np.zeros((len(df_vinos), self.dim))
+        for field in self.wine_fields:
+            if field not in df_vinos.columns:
+                continue
+            codes, values = pd.factorize(df_vinos[field])
+            table = np.vstack([self._counts(_as_text(v)) for v in values] + [np.zeros(self.dim)])
+            matrix += table[codes]
+        return _normalize_rows(matrix)
+
+    def dish_vector(self, plato: Dict) -> np.ndarray:
+        return _normalize_rows(self._counts(' '.join(_as_text(plato.get(f)) for f in self.dish_fields)))
+
+
+class SimilarityEngine:
+    """Similitud vino-plato combinando varios bloques de atributos.
+
+    Los vectores de los vinos de todos los bloques se concatenan en una única
+    matriz float32 precalculada, ordenada por tipo de vino para que los vinos
+    de cada tipo sean un tramo contiguo. Los pesos solo se aplican al vector
+    del plato, así que la similitud combinada de todos los vinos de un tipo es
+    un único producto matriz-vector (o matriz-matriz para varios platos), y
+    añadir atributos solo añade columnas a ese producto.
+    """
+
+    def __init__(self, blocks: Optional[List[FeatureBlock]] = None, weights: Optional[Dict[str, float]] = None,
+                 pool: int = DEFAULT_POOL):
+        self.blocks = blocks if blocks is not None else [OrganolepticFeatures(), CategoryFeatures(), TextFeatures()]
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        self.pool = pool
+        self.n_rows = 0
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._positions = np.empty(0, dtype=np.int64)
+        self._slices: Dict[str, slice] = {}
+
+    @property
+    def dim(self) -> int:
+        return sum(block.dim for block in self.blocks)
+
+    def fit(self, df_vinos: pd.DataFrame, platos: List[Dict],
+            wine_index: Optional[WineIndex] = None) -> 'SimilarityEngine':
+        """Ajusta los bloques y precalcula la matriz de atributos de los vinos indexados"""
+        wine_index = wine_index if wine_index is not None else WineIndex(df_vinos)
+        for block in self.blocks:
+            block.fit(df_vinos, platos)
+
+        positions, self._slices = [], {}
+        start = 0
+        for wine_type in wine_index.wine_types:
+            rows = np.sort(wine_index.arrays(wine_type)[0])
+            positions.append(rows)
+            self._slices[wine_type] = slice(start, start + len(rows))
+            start += len(rows)
+        self._positions = np.concatenate(positions) if positions else np.empty(0, dtype=np.int64)
+
+        self._matrix = np.empty((len(self._positions), self.dim), dtype=np.float32)
+        column = 0
+        for block in self.blocks:
+            if block.dim:
+                self._matrix[:, column:column + block.dim] = block.wine_matrix(df_vinos)[self._positions]
+            column += block.dim
+        self.n_rows = len(df_vinos)
+        logger.info(f"Motor de similitud: {len(self._positions)} vinos x {self.dim} atributos "
+                    f"({', '.join(f'{b.name}={b.dim}' for b in self.blocks)})")
+        return self
+
+    def dish_vector(self, plato: Dict) -> np.ndarray:
+        """Vector ponderado del plato; su producto con un vino es la similitud combinada (0-1)"""
+        total = sum(self.weights.get(block.name, 0.0) for block in self.blocks if block.dim) or 1.0
+        parts = [block.dish_vector(plato) * (self.weights.get(block.name, 0.0) / total)
+                 for block in self.blocks if block.dim]
+        return np.concatenate(parts).astype(np.float32) if parts else np.empty(0, dtype=np.float32)
+
+    def similarities(self, wine_type: str, dish_vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Posiciones de los vinos de un tipo y su similitud con cada plato (platos x vinos)"""
+        rows = self._slices.get(wine_type.lower())
+        if rows is None:
+            return np.empty(0, dtype=np.int64), np.empty((len(np.atleast_2d(dish_vectors)), 0), dtype=np.float32)
+        return self._positions[rows], np.atleast_2d(dish_vectors) @ self._matrix[rows].T
+
+    def search(self, wine_type: str, dish_vector: np.ndarray,
+               available: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+               pool: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Los ``pool`` vinos de un tipo más parecidos al plato.
+
+        Equivale a ``WineIndex.search`` con similitud en lugar de radio: las
+        distancias devueltas son ``1 - similitud`` y no están ordenadas.
+        """
+        positions, similarity = self.similarities(wine_type, dish_vector)
+        similarity = similarity[0]
+        if available is not None:
+            keep = available(positions)
+            positions, similarity = positions[keep], similarity[keep]
+        pool = pool or self.pool
+        if len(positions) > pool:
+            best = np.argpartition(-similarity, pool - 1)[:pool]
+            positions, similarity = positions[best], similarity[best]
+        return positions, 1.0 - similarity.astype(np.float64)
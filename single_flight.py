@@ -0,0 +1,140 @@
+import threading
+from typing import Callable, Dict, Hashable, Iterator, Optional, Tuple, TypeVar
+
+from telemetry import METRICS, annotate
+
+T = TypeVar('T')
+
+# Máximo de claves en curso por grupo; por encima se calcula sin compartir
+DEFAULT_MAX_KEYS = 1024
+
+METRICS.describe('sumiller_singleflight_total', 'counter',
+                 "Llamadas por grupo y resultado (leader=calculada, coalesced=compartida, bypass=sin compartir)")
+
+
+class _Abandoned(Exception):
+    """La llamada compartida se interrumpió sin resultado (p.ej. la sesión que la calculaba se detuvo)"""
+
+
+_ABANDONED = _Abandoned()
+
+
+class _Call:
+    """Llamada en curso: resultado (o error) final y último valor parcial"""
+
+    __slots__ = ('done', 'result', 'error', 'progress')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.progress = None
+
+
+class SingleFlight:
+    """Comparte entre hilos las llamadas idénticas que coinciden en el tiempo.
+
+    La primera llamada con una clave la calcula y las que llegan mientras
+    tanto con la misma clave esperan y reciben su mismo resultado (o su misma
+    excepción). No es una caché: la clave se olvida al terminar, así que la
+    memoria se limita a las llamadas en curso, y como mucho ``max_keys`` a la
+    vez. Si la llamada se interrumpe sin resultado, una de las que esperaban
+    la vuelve a calcular.
+    """
+
+    def __init__(self, name: str, max_keys: int = DEFAULT_MAX_KEYS, poll: float = 0.05):
+        self.name = name
+        self.max_keys = max_keys
+        self.poll = poll
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    def do(self, key: Hashable, function: Callable[[], T]) -> T:
+        """Resultado de ``function()``, calculado una sola vez entre las llamadas simultáneas con ``key``"""
+        while True:
+            call, leader = self._join(key)
+            if call is None:
+                return function()
+            if leader:
+                try:
+                    result = function()
+                except Exception as e:
+                    self._finish(key, call, error=e)
+                    raise
+                except BaseException:
+                    self._finish(key, call, error=_ABANDONED)
+                    raise
+                self._finish(key, call, result=result)
+                return result
+            call.done.wait()
+            if call.error is _ABANDONED:
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+    def stream(self, key: Hashable, produce: Callable[[], Iterator[T]]) -> Iterator[T]:
+        """Como ``do`` para generadores de valores acumulados (p.ej. el texto recibido hasta ahora).
+
+        Quien calcula consume ``produce()``; las demás llamadas reciben el
+        último valor cada ``poll`` segundos y, al terminar, el valor final.
+        """
+        while True:
+            call, leader = self._join(key)
+            if call is None:
+                yield from produce()
+                return
+            if leader:
+                finished = False
+                try:
+                    for value in produce():
+                        call.progress = value
+                        yield value
+                    finished = True
+                except Exception as e:
+                    self._finish(key, call, error=e)
+                    raise
+                finally:
+                    if not finished and not call.done.is_set():
+                        self._finish(key, call, error=_ABANDONED)
+                self._finish(key, call, result=call.progress)
+                return
+            shown = None
+            while not call.done.wait(self.poll):
+                if call.progress is not shown:
+                    shown = call.progress
+                    yield shown
+            if call.error is _ABANDONED:
+                continue
+            if call.error is not None:
+                raise call.error
+            if call.result is not shown:
+                yield call.result
+            return
+
+    def _join(self, key: Hashable) -> Tuple[Optional[_Call], bool]:
+        """Llamada en curso con ``key`` (o una nueva si no hay) y si le toca calcularla"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None and len(self._calls) >= self.max_keys:
+                result, leader = 'bypass', True
+            elif call is None:
+                call = self._calls[key] = _Call()
+                result, leader = 'leader', True
+            else:
+                result, leader = 'coalesced', False
+        METRICS.inc('sumiller_singleflight_total', group=self.name, result=result)
+        if not leader:
+            annotate(coalesced=True)
+        return call, leader
+
+    def _finish(self, key: Hashable, call: _Call, result=None, error: Optional[BaseException] = None) -> None:
+        call.result, call.error = result, error
+        # Se quita antes de avisar para que los reintentos no encuentren la llamada terminada
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.done.set()
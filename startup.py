@@ -0,0 +1,117 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional
+
+from telemetry import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Con STARTUP_WARMUP=0 no se precarga nada: cada recurso se crea en su primer uso
+STARTUP_WARMUP = os.getenv('STARTUP_WARMUP', '1') != '0'
+
+# Tareas de precarga simultáneas (catálogo, MongoDB y SDK del LLM esperan a cosas distintas)
+WARMUP_WORKERS = 3
+
+METRICS.describe('sumiller_startup_phase_seconds', 'histogram', "Duración de cada fase del arranque del proceso")
+
+
+class StartupReport:
+    """Fases del arranque del proceso: cuándo empezó cada una y cuánto duró.
+
+    El origen es la importación de este módulo, que la aplicación hace antes
+    que cualquier otra. Cada fase se registra una sola vez por proceso (las
+    ejecuciones siguientes del script de Streamlit no la repiten), y las
+    fases de la precarga pueden solaparse con las del hilo principal.
+    """
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self._phases: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._phases
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Mide una fase del arranque (solo la primera vez que se ejecuta)"""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            self._record(name, start, time.perf_counter(), error)
+
+    def mark(self, name: str) -> None:
+        """Registra una fase que empezó en el origen y termina ahora (p.ej. las importaciones)"""
+        self._record(name, self.origin, time.perf_counter())
+
+    def report(self) -> List[Dict]:
+        """Fases registradas en orden de inicio, con tiempos en milisegundos desde el origen"""
+        with self._lock:
+            return sorted((dict(phase) for phase in self._phases.values()), key=lambda p: p['inicio_ms'])
+
+    def _record(self, name: str, start: float, end: float, error: Optional[str] = None) -> None:
+        with self._lock:
+            if name in self._phases:
+                return
+            self._phases[name] = {
+                'fase': name,
+                'hilo': threading.current_thread().name,
+                'inicio_ms': round((start - self.origin) * 1000, 1),
+                'duracion_ms': round((end - start) * 1000, 1),
+                **({'error': error} if error else {}),
+            }
+        METRICS.observe('sumiller_startup_phase_seconds', end - start, phase=name)
+        logger.info(f"Arranque: {name} en {(end - start) * 1000:.0f} ms"
+                    f"{f' ({error})' if error else ''}")
+
+
+STARTUP = StartupReport()
+
+
+class Warmup:
+    """Precarga en segundo plano de los recursos caros mientras se dibuja la primera página.
+
+    Cada tarea es una función que crea (y deja en su caché) un recurso; se
+    registra como fase del arranque. Los fallos solo se registran: quien use
+    el recurso lo volverá a intentar y verá el error en su primer uso.
+    """
+
+    def __init__(self, report: StartupReport = STARTUP, workers: int = WARMUP_WORKERS):
+        self.report = report
+        self.workers = workers
+        self._futures: Dict[str, Future] = {}
+
+    def start(self, tasks: Dict[str, Callable[[], object]]) -> 'Warmup':
+        """Lanza las tareas (``fase -> función``) en hilos de precarga"""
+        executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='precarga')
+        for name, task in tasks.items():
+            self._futures[name] = executor.submit(self._run, name, task)
+        # Los hilos terminan al acabar las tareas; no hace falta esperarlos
+        executor.shutdown(wait=False)
+        return self
+
+    def done(self) -> bool:
+        return all(future.done() for future in self._futures.values())
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        """Espera a que termine la precarga (para pruebas y mediciones)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for future in self._futures.values():
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            future.exception(timeout=remaining)
+
+    def _run(self, name: str, task: Callable[[], object]) -> None:
+        try:
+            with self.report.phase(name):
+                task()
+        except Exception as e:
+            logger.warning(f"Precarga de {name} fallida: {e}")
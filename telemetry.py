@@ -0,0 +1,216 @@
+import contextvars
+import functools
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Límites (segundos) de los buckets del histograma de duración por etapa
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Traza de la petición en curso (una ejecución de la app o una petición HTTP) y pila de spans activos
+_trace: contextvars.ContextVar[Optional[Dict]] = contextvars.ContextVar('trace', default=None)
+_active: contextvars.ContextVar[Tuple[Dict, ...]] = contextvars.ContextVar('active_spans', default=())
+
+
+class MetricsRegistry:
+    """Contadores e histogramas del proceso, exportables en formato de texto de Prometheus"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], Dict[str, Any]] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+
+    def describe(self, name: str, kind: str, text: str) -> None:
+        self._help[name] = (kind, text)
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram['counts'][i] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    @staticmethod
+    def _labels(labels: Tuple, extra: Optional[Tuple] = None) -> str:
+        items = list(labels) + list(extra or ())
+        if not items:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in items)
+        return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + '}'
+
+    def render(self) -> str:
+        """Texto de exposición de Prometheus (versión 0.0.4)"""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {k: dict(v, counts=list(v['counts'])) for k, v in self._histograms.items()}
+
+        lines = []
+        for name in sorted({k[0] for k in counters} | {k[0] for k in histograms}):
+            kind, text = self._help.get(name, ('histogram' if any(k[0] == name for k in histograms) else 'counter', name))
+            lines.append(f'# HELP {name} {text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{self._labels(labels)} {value:g}')
+            for (metric, labels), histogram in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(self.buckets, histogram['counts']):
+                    lines.append(f'{name}_bucket{self._labels(labels, (("le", f"{bound:g}"),))} {count}')
+                lines.append(f'{name}_bucket{self._labels(labels, (("le", "+Inf"),))} {histogram["count"]}')
+                lines.append(f'{name}_sum{self._labels(labels)} {histogram["sum"]:.6f}')
+                lines.append(f'{name}_count{self._labels(labels)} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+
+METRICS = MetricsRegistry()
+METRICS.describe('sumiller_stage_duration_seconds', 'histogram', "Duración de cada etapa de la recomendación")
+METRICS.describe('sumiller_stage_errors_total', 'counter', "Etapas terminadas con excepción")
+METRICS.describe('sumiller_cache_requests_total', 'counter', "Accesos a caché por etapa y resultado (hit/miss)")
+METRICS.describe('sumiller_rows_scanned_total', 'counter', "Filas recorridas por etapa")
+METRICS.describe('sumiller_llm_tokens_total', 'counter', "Tokens del LLM por etapa y tipo (prompt/completion)")
+
+
+def start_trace() -> str:
+    """Empieza una traza nueva para la petición actual y devuelve su identificador"""
+    trace_id = uuid.uuid4().hex[:16]
+    _trace.set({'trace_id': trace_id, 'spans': []})
+    _active.set(())
+    return trace_id
+
+
+def current_spans() -> List[Dict]:
+    """Spans terminados de la traza en curso, en orden de finalización"""
+    trace = _trace.get()
+    return list(trace['spans']) if trace else []
+
+
+def annotate(**attributes) -> None:
+    """Añade atributos (p.ej. ``cache='miss'``, ``rows=...``) al span activo más interno"""
+    active = _active.get()
+    if active:
+        active[-1]['attributes'].update(attributes)
+
+
+def record_llm_usage(response) -> None:
+    """Anota los tokens de una respuesta de Gemini (``usage_metadata``) en el span activo"""
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, 'prompt_token_count', None)
+    completion_tokens = getattr(usage, 'candidates_token_count', None)
+    if prompt_tokens is not None:
+        annotate(tokens_prompt=int(prompt_tokens))
+    if completion_tokens is not None:
+        annotate(tokens_completion=int(completion_tokens))
+
+
+@contextmanager
+def span(stage: str, **attributes) -> Iterator[Dict]:
+    """Mide una etapa: duración, caché, filas recorridas y tokens del LLM.
+
+    Al terminar, el span se añade a la traza en curso, se escribe en el log
+    como una línea JSON y actualiza las métricas del proceso. Los atributos
+    ``cache`` (``hit``/``miss``), ``rows``, ``tokens_prompt`` y
+    ``tokens_completion`` se trasladan a sus métricas.
+    """
+    trace = _trace.get()
+    active = _active.get()
+    record = {
+        'trace_id': trace['trace_id'] if trace else None,
+        'stage': stage,
+        'parent': active[-1]['stage'] if active else None,
+        'attributes': dict(attributes),
+    }
+    token = _active.set(active + (record,))
+    start = time.perf_counter()
+    try:
+        yield record['attributes']
+    except BaseException as e:
+        record['error'] = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        _active.reset(token)
+        record['duration_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        if trace is not None:
+            trace['spans'].append(record)
+        _record_metrics(record)
+        logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def _record_metrics(record: Dict) -> None:
+    stage = record['stage']
+    attributes = record['attributes']
+    METRICS.observe('sumiller_stage_duration_seconds', record['duration_ms'] / 1000, stage=stage)
+    if 'error' in record:
+        METRICS.inc('sumiller_stage_errors_total', stage=stage)
+    if attributes.get('cache') in ('hit', 'miss'):
+        METRICS.inc('sumiller_cache_requests_total', stage=stage, result=attributes['cache'])
+    if attributes.get('rows'):
+        METRICS.inc('sumiller_rows_scanned_total', attributes['rows'], stage=stage)
+    for kind in ('prompt', 'completion'):
+        if attributes.get(f'tokens_{kind}'):
+            METRICS.inc('sumiller_llm_tokens_total', attributes[f'tokens_{kind}'], stage=stage, type=kind)
+
+
+def traced(stage: str):
+    """Decorador equivalente a envolver la función en ``span(stage)``"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def render_prometheus() -> str:
+    return METRICS.render()
+
+
+def start_metrics_server(port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+    """Sirve ``/metrics`` en un hilo aparte (para procesos sin servidor HTTP propio, como Streamlit)"""
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render_prometheus().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f"Métricas de Prometheus disponibles en http://{host}:{port}/metrics")
+    return server
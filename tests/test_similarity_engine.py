@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from similarity_engine import CategoryFeatures, SimilarityEngine
+
+
+def _catalogue() -> pd.DataFrame:
+    # Tintos de todos los estilos en la escala del catálogo (acidez 1-5, cuerpo 1-5)
+    styles = [(acidity, body) for acidity in np.arange(1.0, 5.5, 0.5) for body in np.arange(1.0, 5.5, 0.5)]
+    return pd.DataFrame({
+        'winery': [f'Bodega {i}' for i in range(len(styles))],
+        'wine': [f'Vino {i}' for i in range(len(styles))],
+        'region': 'Rioja',
+        'type': 'tinto',
+        'acidity': [acidity for acidity, _ in styles],
+        'body': [body for _, body in styles],
+    })
+
+
+MENU = [
+    {'nombre_plato': 'Lubina frita', 'proteina_principal': 'pescado', 'coccion': 'frito',
+     'acidez': 4.5, 'cuerpo': 1.5, 'maridaje': ['tinto']},
+    {'nombre_plato': 'Boquerones fritos', 'proteina_principal': 'pescado', 'coccion': 'frito',
+     'acidez': 4.0, 'cuerpo': 2.0, 'maridaje': ['tinto']},
+    {'nombre_plato': 'Rabo de toro', 'proteina_principal': 'ternera', 'coccion': 'guisado',
+     'acidez': 1.5, 'cuerpo': 4.5, 'maridaje': ['tinto']},
+    {'nombre_plato': 'Carrillera', 'proteina_principal': 'ternera', 'coccion': 'guisado',
+     'acidez': 2.0, 'cuerpo': 4.0, 'maridaje': ['tinto']},
+]
+
+
+def test_category_block_varies_within_a_type():
+    df = _catalogue()
+    block = CategoryFeatures()
+    block.fit(df, MENU)
+    matrix = block.wine_matrix(df)
+    # Todos los vinos son del mismo tipo: el bloque solo aporta si distingue entre ellos
+    assert matrix.std(axis=0).max() > 0.05
+
+
+def test_protein_and_cooking_change_the_candidate_pool():
+    df = _catalogue()
+    engine = SimilarityEngine(pool=5).fit(df, MENU)
+    # Mismo estilo (equidistante de ambos grupos de platos) y distinta proteína y cocción
+    fish = {'nombre_plato': 'Plato', 'proteina_principal': 'pescado', 'coccion': 'frito',
+            'acidez': 3.0, 'cuerpo': 3.0, 'maridaje': ['tinto']}
+    meat = dict(fish, proteina_principal='ternera', coccion='guisado')
+
+    fish_pool, _ = engine.search('tinto', engine.dish_vector(fish))
+    meat_pool, _ = engine.search('tinto', engine.dish_vector(meat))
+
+    assert set(fish_pool) != set(meat_pool)
+    assert df['acidity'].iloc[fish_pool].mean() > df['acidity'].iloc[meat_pool].mean()
+    assert df['body'].iloc[fish_pool].mean() < df['body'].iloc[meat_pool].mean()
@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def _run_in_threads(n, target):
+    results, errors = [None] * n, [None] * n
+
+    def run(i):
+        try:
+            results[i] = target()
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    return results, errors
+
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight('prueba')
+    calls, release = [], threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return object()
+
+    def call():
+        return flight.do('clave', compute)
+
+    threading.Timer(0.2, release.set).start()
+    results, errors = _run_in_threads(8, call)
+
+    assert errors == [None] * 8
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert len(flight) == 0
+
+
+def test_error_reaches_every_caller():
+    flight = SingleFlight('prueba')
+    calls, release = [], threading.Event()
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        raise ValueError('fallo')
+
+    threading.Timer(0.2, release.set).start()
+    _, errors = _run_in_threads(4, lambda: flight.do('clave', compute))
+
+    assert len(calls) == 1
+    assert all(isinstance(error, ValueError) for error in errors)
+    # La clave se olvida al terminar: la siguiente llamada vuelve a calcular
+    assert flight.do('clave', lambda: 'ok') == 'ok'
+
+
+def test_follower_retries_when_leader_stream_is_closed():
+    flight = SingleFlight('prueba', poll=0.01)
+    produced = []
+
+    def produce():
+        produced.append(1)
+        for i in range(1, 4):
+            time.sleep(0.05)
+            yield i
+
+    leader = flight.stream('clave', produce)
+    assert next(leader) == 1
+
+    follower_values = []
+    follower = threading.Thread(target=lambda: follower_values.extend(flight.stream('clave', produce)))
+    follower.start()
+    time.sleep(0.1)
+    # El comensal que calculaba se va: su generador se cierra sin resultado
+    leader.close()
+    follower.join(timeout=5)
+
+    assert not follower.is_alive()
+    assert len(produced) == 2
+    assert follower_values[-1] == 3
+    assert len(flight) == 0
+
+
+def test_bypass_above_max_keys():
+    flight = SingleFlight('prueba', max_keys=1)
+    release = threading.Event()
+    busy = threading.Thread(target=lambda: flight.do('ocupada', lambda: release.wait(5)))
+    busy.start()
+    try:
+        deadline = time.monotonic() + 5
+        while len(flight) < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # Sin hueco para otra clave: se calcula sin registrarla
+        assert flight.do('otra', lambda: 'directo') == 'directo'
+        assert len(flight) == 1
+    finally:
+        release.set()
+        busy.join(timeout=5)
+    assert len(flight) == 0
+
+
+def test_base_exception_in_leader_is_not_shared():
+    flight = SingleFlight('prueba')
+
+    def interrupted():
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        flight.do('clave', interrupted)
+    assert flight.do('clave', lambda: 'reintentado') == 'reintentado'
@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Escala de los valores de acidez y cuerpo (0-5) usada para normalizar a 0-1
+ESCALA_ORGANOLEPTICA = 5.0
+
+
+class _TypeGrid:
+    """Rejilla uniforme sobre (acidez, cuerpo) normalizados para un único tipo de vino.
+
+    Los vinos se guardan ordenados por celda en arrays contiguos, con un array de
+    offsets por celda (formato CSR), de modo que una consulta por radio solo
+    recorre las celdas que intersectan la caja que rodea al círculo.
+    """
+
+    def __init__(self, rows: np.ndarray, acidity: np.ndarray, body: np.ndarray, cell_size: float):
+        self.n_cells = max(1, int(np.ceil(1.0 / cell_size)))
+        self.cell_size = cell_size
+
+        cx = self._cell(acidity)
+        cy = self._cell(body)
+        cell_ids = cx * self.n_cells + cy
+
+        # Orden por celda y, dentro de cada celda, por posición original
+        order = np.lexsort((rows, cell_ids))
+        self.rows = np.ascontiguousarray(rows[order])
+        self.acidity = np.ascontiguousarray(acidity[order])
+        self.body = np.ascontiguousarray(body[order])
+        self.offsets = np.searchsorted(cell_ids[order], np.arange(self.n_cells * self.n_cells + 1))
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def _cell(self, values) -> np.ndarray:
+        """Celda de cada valor; los valores fuera de [0, 1] caen en las celdas del borde"""
+        cells = np.floor(np.asarray(values, dtype=np.float64) / self.cell_size).astype(np.int64)
+        return np.clip(cells, 0, self.n_cells - 1)
+
+    def query(self, acidity: float, body: float, radius: float) -> Tuple[np.ndarray, np.ndarray]:
+        """Devuelve (posiciones en el catálogo, distancias) de los vinos a distancia <= radius"""
+        x0, x1 = self._cell([acidity - radius, acidity + radius])
+        y0, y1 = self._cell([body - radius, body + radius])
+
+        # Cada fila de celdas (misma acidez) es un tramo contiguo en los arrays
+        slices = [
+            np.arange(self.offsets[cx * self.n_cells + y0], self.offsets[cx * self.n_cells + y1 + 1])
+            for cx in range(x0, x1 + 1)
+        ]
+        candidates = np.concatenate(slices) if slices else np.empty(0, dtype=np.int64)
+
+        distances = np.sqrt((self.acidity[candidates] - acidity) ** 2 + (self.body[candidates] - body) ** 2)
+        within = distances <= radius
+        return self.rows[candidates[within]], distances[within]
+
+
+class WineIndex:
+    """Índice de vinos construido una sola vez al cargar el catálogo.
+
+    Agrupa los vinos por tipo (en minúsculas) y, para cada tipo, mantiene la
+    acidez y el cuerpo normalizados (valor / 5) en una rejilla espacial que
+    permite resolver las consultas por radio sin recorrer todo el catálogo.
+    Las posiciones devueltas son posiciones (iloc) del DataFrame indexado.
+    """
+
+    def __init__(self, df_vinos: pd.DataFrame, cell_size: float = 0.1):
+        self.n_rows = len(df_vinos)
+        self._grids: Dict[str, _TypeGrid] = {}
+
+        if df_vinos.empty or not {'type', 'acidity', 'body'}.issubset(df_vinos.columns):
+            return
+
+        types = df_vinos['type'].astype(str).str.lower().to_numpy()
+        acidity = pd.to_numeric(df_vinos['acidity'], errors='coerce').to_numpy(dtype=np.float64) / ESCALA_ORGANOLEPTICA
+        body = pd.to_numeric(df_vinos['body'], errors='coerce').to_numpy(dtype=np.float64) / ESCALA_ORGANOLEPTICA
+
+        # Los vinos sin acidez o cuerpo nunca pueden cumplir la tolerancia
+        valid = ~(np.isnan(acidity) | np.isnan(body) | df_vinos['type'].isna().to_numpy())
+        positions = np.flatnonzero(valid)
+        if positions.size == 0:
+            return
+
+        type_names, inverse = np.unique(types[positions], return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(type_names) + 1))
+
+        for i, wine_type in enumerate(type_names):
+            rows = positions[order[bounds[i]:bounds[i + 1]]]
+            self._grids[wine_type] = _TypeGrid(rows, acidity[rows], body[rows], cell_size)
+
+    @property
+    def wine_types(self) -> List[str]:
+        """Tipos de vino presentes en el índice"""
+        return sorted(self._grids)
+
+    def count(self, wine_type: str) -> int:
+        """Número de vinos indexados de un tipo"""
+        grid = self._grids.get(wine_type.lower())
+        return len(grid) if grid is not None else 0
+
+    def arrays(self, wine_type: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Arrays contiguos (posiciones, acidez normalizada, cuerpo normalizado) de un tipo"""
+        grid = self._grids.get(wine_type.lower())
+        if grid is None:
+            empty = np.empty(0, dtype=np.float64)
+            return np.empty(0, dtype=np.int64), empty, empty
+        return grid.rows, grid.acidity, grid.body
+
+    def search(self, wine_type: str, target_acidity: float, target_body: float,
+               tolerance: float = 0.4,
+               available: Optional[Callable[[np.ndarray], np.ndarray]] = None,
+               sort: bool = True) -> Tuple[np.ndarray, np.ndarray]:
+        """Busca los vinos de un tipo cercanos al perfil del plato.
+
+        Aplica la misma regla que la búsqueda original: si ningún vino queda a
+        distancia <= tolerance, la tolerancia se amplía a min(tolerance * 1.5, 0.8).
+        Ambas tolerancias se resuelven con una única consulta a la rejilla.
+        ``available`` (p.ej. ``RestaurantInventory.in_stock``) recibe las
+        posiciones candidatas y devuelve la máscara de las que se pueden
+        recomendar; se aplica antes de decidir si hay que ampliar la tolerancia.
+
+        Returns:
+            (posiciones, distancias) ordenadas por distancia ascendente, o sin
+            ordenar si ``sort`` es False (p.ej. para una selección parcial).
+        """
+        grid = self._grids.get(wine_type.lower())
+        if grid is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        # Asegurar que los valores estén entre 0 y 1
+        acidity = float(np.clip(target_acidity / ESCALA_ORGANOLEPTICA, 0, 1))
+        body = float(np.clip(target_body / ESCALA_ORGANOLEPTICA, 0, 1))
+
+        widened = min(tolerance * 1.5, 0.8)
+        rows, distances = grid.query(acidity, body, max(tolerance, widened))
+        if available is not None:
+            keep = available(rows)
+            rows, distances = rows[keep], distances[keep]
+
+        mask = distances <= tolerance
+        if not mask.any():
+            mask = distances <= widened
+
+        rows, distances = rows[mask], distances[mask]
+        if not sort:
+            return rows, distances
+        order = np.lexsort((rows, distances))
+        return rows[order], distances[order]
@@ -0,0 +1,246 @@
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from menu_repository import MenuRepository
+
+logger = logging.getLogger(__name__)
+
+# Columnas que identifican un vino con independencia de su posición en el catálogo
+WINE_KEY_COLUMNS = ('winery', 'wine', 'year')
+
+
+def wine_keys(df_vinos: pd.DataFrame) -> np.ndarray:
+    """Identificador estable de cada vino: ``'bodega|vino|año'``"""
+    parts = [df_vinos[column].astype(str).to_numpy(dtype=object) for column in WINE_KEY_COLUMNS]
+    return parts[0] + '|' + parts[1] + '|' + parts[2]
+
+
+def _hash_keys(keys) -> np.ndarray:
+    return pd.util.hash_array(np.asarray(keys, dtype=object))
+
+
+def _bit_masks(positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Byte del bitmap y máscara del bit de cada posición (orden de ``np.packbits``)"""
+    return positions >> 3, (0x80 >> (positions & 7)).astype(np.uint8)
+
+
+class RestaurantInventory:
+    """Existencias y precios de carta de un restaurante sobre el catálogo compartido.
+
+    Las existencias son un bitmap con un bit por vino del catálogo (``n/8``
+    bytes) y los precios propios dos arrays paralelos de posiciones ordenadas y
+    precios, de modo que ningún restaurante copia el catálogo. Las instancias
+    no se modifican: cada cambio crea una nueva que sustituye a la anterior, y
+    las consultas en curso siguen usando la versión con la que empezaron.
+    """
+
+    def __init__(self, restaurante: str, n_rows: int, bitmap: Optional[np.ndarray] = None,
+                 price_positions: Optional[np.ndarray] = None, price_values: Optional[np.ndarray] = None,
+                 version: int = 0):
+        self.restaurante = restaurante
+        self.n_rows = n_rows
+        self.bitmap = bitmap if bitmap is not None else np.zeros((n_rows + 7) // 8, dtype=np.uint8)
+        self.price_positions = price_positions if price_positions is not None else np.empty(0, dtype=np.int64)
+        self.price_values = price_values if price_values is not None else np.empty(0, dtype=np.float64)
+        self.version = version
+        self.n_stock = int(np.unpackbits(self.bitmap, count=n_rows).sum())
+
+    def __len__(self) -> int:
+        return self.n_stock
+
+    def in_stock(self, positions: np.ndarray) -> np.ndarray:
+        """Máscara de las posiciones del catálogo que el restaurante tiene en existencias"""
+        byte, mask = _bit_masks(np.asarray(positions, dtype=np.int64))
+        return (self.bitmap[byte] & mask) != 0
+
+    def stock_positions(self) -> np.ndarray:
+        """Posiciones (iloc) de los vinos en existencias"""
+        return np.flatnonzero(np.unpackbits(self.bitmap, count=self.n_rows))
+
+    def prices(self, positions: np.ndarray, base_prices: np.ndarray) -> np.ndarray:
+        """Precios de ``positions``: el de la carta del restaurante si lo tiene y si no el del catálogo"""
+        result = np.array(base_prices, dtype=np.float64)
+        if len(self.price_positions) and len(result):
+            positions = np.asarray(positions, dtype=np.int64)
+            found = np.minimum(np.searchsorted(self.price_positions, positions), len(self.price_positions) - 1)
+            hit = self.price_positions[found] == positions
+            result[hit] = self.price_values[found[hit]]
+        return result
+
+    def with_stock(self, positions: np.ndarray, available: bool = True) -> 'RestaurantInventory':
+        """Copia con las posiciones dadas dadas de alta (o de baja)"""
+        bitmap = self.bitmap.copy()
+        byte, mask = _bit_masks(np.asarray(positions, dtype=np.int64))
+        if available:
+            np.bitwise_or.at(bitmap, byte, mask)
+        else:
+            np.bitwise_and.at(bitmap, byte, ~mask)
+        return RestaurantInventory(self.restaurante, self.n_rows, bitmap,
+                                   self.price_positions, self.price_values, self.version + 1)
+
+    def with_prices(self, positions: np.ndarray, prices: np.ndarray) -> 'RestaurantInventory':
+        """Copia con precios propios para ``positions``; un precio NaN elimina el precio propio"""
+        current = pd.Series(self.price_values, index=self.price_positions)
+        update = pd.Series(np.asarray(prices, dtype=np.float64), index=np.asarray(positions, dtype=np.int64))
+        merged = pd.concat([current[~current.index.isin(update.index)], update[~update.index.duplicated(keep='last')]])
+        merged = merged.dropna().sort_index()
+        return RestaurantInventory(self.restaurante, self.n_rows, self.bitmap,
+                                   merged.index.to_numpy(dtype=np.int64), merged.to_numpy(dtype=np.float64),
+                                   self.version + 1)
+
+
+class WineInventory:
+    """Inventario de vinos de todos los restaurantes servidos por un despliegue.
+
+    Todos los restaurantes comparten el mismo catálogo (y su índice); cada uno
+    solo guarda un ``RestaurantInventory``. Las existencias y los precios se
+    pueden cambiar en caliente sin recargar el catálogo: el cambio sustituye el
+    inventario del restaurante y se persiste en ``menu_database.inventario``,
+    donde los vinos se identifican por ``'bodega|vino|año'`` para que el
+    inventario sobreviva a un catálogo nuevo.
+    """
+
+    def __init__(self, repository: Optional[MenuRepository] = None):
+        self.repository = repository
+        self._df_vinos: Optional[pd.DataFrame] = None
+        self._key_index: Optional[pd.Index] = None
+        self._restaurants: Dict[str, RestaurantInventory] = {}
+        self._documents: Dict[str, Dict] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._restaurants)
+
+    @property
+    def restaurants(self) -> List[str]:
+        return sorted(self._restaurants)
+
+    def get(self, restaurante: Optional[str]) -> Optional[RestaurantInventory]:
+        """Inventario del restaurante, o None si no tiene (se recomienda entonces sobre todo el catálogo)"""
+        return self._restaurants.get(restaurante) if restaurante else None
+
+    def set_catalogue(self, df_vinos: pd.DataFrame) -> None:
+        """Asocia el catálogo compartido; con un catálogo distinto los inventarios se vuelven a resolver"""
+        with self._lock:
+            if df_vinos is self._df_vinos:
+                return
+            self._df_vinos = df_vinos
+            self._key_index = None
+            self._restaurants = self._resolve(self._documents)
+
+    def load(self) -> 'WineInventory':
+        """Lee los inventarios guardados en MongoDB (sustituyendo los que hubiera en memoria)"""
+        if self.repository is None:
+            return self
+        try:
+            documents = self.repository.load_inventories()
+        except Exception as e:
+            logger.warning(f"No se pudieron leer los inventarios de los restaurantes: {e}")
+            return self
+        with self._lock:
+            self._documents = {document['_id']: document for document in documents}
+            self._restaurants = self._resolve(self._documents) if self._df_vinos is not None else {}
+        logger.info(f"Inventarios cargados: {len(self._documents)} restaurantes")
+        return self
+
+    def replace(self, restaurante: str, vinos: Iterable[str],
+                precios: Optional[Dict[str, float]] = None) -> Dict[str, int]:
+        """Sustituye todas las existencias y precios de carta de un restaurante"""
+        with self._lock:
+            self._require_catalogue()
+            positions, unknown = self.positions(vinos)
+            inventory = RestaurantInventory(restaurante, len(self._df_vinos),
+                                            version=self._next_version(restaurante)).with_stock(positions)
+            inventory, unknown_prices = self._apply_prices(inventory, precios or {})
+            return self._commit(inventory, unknown + unknown_prices)
+
+    def update(self, restaurante: str, alta: Iterable[str] = (), baja: Iterable[str] = (),
+               precios: Optional[Dict[str, Optional[float]]] = None) -> Dict[str, int]:
+        """Da de alta o de baja vinos y cambia precios de carta (``None`` vuelve al precio del catálogo)"""
+        with self._lock:
+            self._require_catalogue()
+            inventory = self._restaurants.get(restaurante) or RestaurantInventory(
+                restaurante, len(self._df_vinos), version=self._next_version(restaurante))
+            added, unknown_added = self.positions(alta)
+            removed, unknown_removed = self.positions(baja)
+            inventory = inventory.with_stock(added).with_stock(removed, available=False)
+            inventory, unknown_prices = self._apply_prices(inventory, precios or {})
+            return self._commit(inventory, unknown_added + unknown_removed + unknown_prices)
+
+    def remove(self, restaurante: str) -> None:
+        """Elimina el inventario de un restaurante (vuelve a recomendar sobre todo el catálogo)"""
+        with self._lock:
+            self._restaurants.pop(restaurante, None)
+            self._documents.pop(restaurante, None)
+            if self.repository is not None:
+                self.repository.delete_inventory(restaurante)
+
+    def positions(self, vinos: Iterable[str]) -> Tuple[np.ndarray, int]:
+        """Posiciones del catálogo de los vinos (todas si un vino está repetido) y cuántos no existen"""
+        vinos = list(vinos)
+        if not vinos:
+            return np.empty(0, dtype=np.int64), 0
+        if self._key_index is None:
+            self._key_index = pd.Index(_hash_keys(wine_keys(self._df_vinos)))
+        hashes = _hash_keys(vinos)
+        positions = self._key_index.get_indexer_for(hashes)
+        unknown = len(set(hashes) - set(self._key_index[positions[positions >= 0]]))
+        return positions[positions >= 0].astype(np.int64), unknown
+
+    def _resolve(self, documents: Dict[str, Dict]) -> Dict[str, RestaurantInventory]:
+        # Se construye aparte y se sustituye de una vez: ``get`` no toma el bloqueo y
+        # mientras tanto debe seguir viendo los inventarios anteriores, nunca uno a medias
+        return {restaurante: self._from_document(restaurante, document)
+                for restaurante, document in documents.items()}
+
+    def _require_catalogue(self) -> None:
+        if self._df_vinos is None:
+            raise RuntimeError("El inventario no tiene catálogo de vinos")
+
+    def _next_version(self, restaurante: str) -> int:
+        current = self._restaurants.get(restaurante)
+        return current.version + 1 if current is not None else 0
+
+    def _apply_prices(self, inventory: RestaurantInventory,
+                      precios: Dict[str, Optional[float]]) -> Tuple[RestaurantInventory, int]:
+        unknown = 0
+        positions, values = [], []
+        for vino, precio in precios.items():
+            found, missing = self.positions([vino])
+            unknown += missing
+            positions.append(found)
+            values.append(np.full(len(found), np.nan if precio is None else float(precio)))
+        if positions:
+            inventory = inventory.with_prices(np.concatenate(positions), np.concatenate(values))
+        return inventory, unknown
+
+    def _from_document(self, restaurante: str, document: Dict) -> RestaurantInventory:
+        positions, unknown = self.positions(document.get('vinos', []))
+        inventory = RestaurantInventory(restaurante, len(self._df_vinos)).with_stock(positions)
+        inventory, unknown_prices = self._apply_prices(
+            inventory, {p['vino']: p['precio'] for p in document.get('precios', [])})
+        if unknown or unknown_prices:
+            logger.warning(f"{restaurante}: {unknown + unknown_prices} vinos del inventario no están en el catálogo")
+        return inventory
+
+    def _commit(self, inventory: RestaurantInventory, unknown: int) -> Dict[str, int]:
+        restaurante = inventory.restaurante
+        stock = self._df_vinos.iloc[inventory.stock_positions()]
+        priced = self._df_vinos.iloc[inventory.price_positions]
+        document = {
+            'vinos': sorted(set(wine_keys(stock))),
+            'precios': [{'vino': vino, 'precio': float(precio)}
+                        for vino, precio in zip(wine_keys(priced), inventory.price_values)],
+        }
+        if self.repository is not None:
+            self.repository.save_inventory(restaurante, document['vinos'], document['precios'])
+        self._documents[restaurante] = document
+        self._restaurants[restaurante] = inventory
+        summary = {'en_stock': len(inventory), 'precios_carta': len(inventory.price_positions),
+                   'desconocidos': unknown, 'version': inventory.version}
+        logger.info(f"Inventario de {restaurante} actualizado: {summary}")
+        return summary
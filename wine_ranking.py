@@ -0,0 +1,78 @@
+from typing import List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Rangos de precio por defecto: (nombre, cuantil superior del rango). Son los
+# mismos cortes (0.33 y 0.66) que usa ``divide_wines_by_price_ranges``.
+PRICE_TIERS: Tuple[Tuple[str, float], ...] = (("Económico", 0.33), ("Intermedio", 0.66), ("Premium", 1.0))
+
+
+def price_tiers(n_tiers: int) -> Tuple[Tuple[str, float], ...]:
+    """Rangos de precio de igual tamaño (por cuantiles); con 3 rangos devuelve ``PRICE_TIERS``"""
+    if n_tiers < 1:
+        raise ValueError("Se necesita al menos un rango de precio")
+    if n_tiers == len(PRICE_TIERS):
+        return PRICE_TIERS
+    return tuple((f"Rango {i + 1}", (i + 1) / n_tiers) for i in range(n_tiers))
+
+
+def score_arrays(df_vinos: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Precio y score = rating * log(num_reviews + 1) de cada vino del catálogo.
+
+    Un score desconocido vale -inf, de modo que nunca gana a un vino con score.
+    """
+    price = pd.to_numeric(df_vinos['price'], errors='coerce').to_numpy(dtype=np.float64)
+    score = (pd.to_numeric(df_vinos['rating'], errors='coerce').to_numpy(dtype=np.float64)
+             * np.log(pd.to_numeric(df_vinos['num_reviews'], errors='coerce').to_numpy(dtype=np.float64) + 1))
+    return price, np.where(np.isnan(score), -np.inf, score)
+
+
+def assign_tiers(prices: np.ndarray, tiers: Sequence[Tuple[str, float]] = PRICE_TIERS) -> np.ndarray:
+    """Rango de precio de cada candidato (-1 si no tiene precio).
+
+    Los cortes son cuantiles de los precios de los propios candidatos: el
+    rango ``i`` contiene los precios ``> corte[i-1]`` y ``<= corte[i]``, y el
+    último todos los que superan el penúltimo corte.
+    """
+    tier_of = np.full(len(prices), -1, dtype=np.int64)
+    valid = ~np.isnan(prices)
+    if not valid.any():
+        return tier_of
+    cuts = [quantile for _, quantile in tiers[:-1]]
+    edges = np.quantile(prices[valid], cuts) if cuts else np.empty(0)
+    tier_of[valid] = np.searchsorted(edges, prices[valid], side='left')
+    return tier_of
+
+
+def top_k(scores: np.ndarray, distances: np.ndarray, positions: np.ndarray, k: int) -> np.ndarray:
+    """Índices de los ``k`` mejores candidatos, en orden.
+
+    Gana el mayor score; a igualdad, el vino más cercano y después el de menor
+    posición en el catálogo. Solo se ordenan los candidatos que alcanzan el
+    k-ésimo mejor score, que se localiza con selección parcial (``np.partition``).
+    """
+    n = len(scores)
+    if n > k:
+        threshold = np.partition(scores, n - k)[n - k]
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(n)
+    order = np.lexsort((positions[candidates], distances[candidates], -scores[candidates]))
+    return candidates[order[:k]]
+
+
+def rank_by_tier(positions: np.ndarray, distances: np.ndarray, prices: np.ndarray, scores: np.ndarray,
+                 tiers: Sequence[Tuple[str, float]] = PRICE_TIERS, k: int = 1) -> List[Tuple[int, np.ndarray]]:
+    """Los ``k`` mejores candidatos de cada rango de precio.
+
+    Returns:
+        ``(rango, índices de los candidatos por orden)`` de cada rango con algún candidato.
+    """
+    tier_of = assign_tiers(prices, tiers)
+    ranked = []
+    for tier in range(len(tiers)):
+        members = np.flatnonzero(tier_of == tier)
+        if members.size:
+            ranked.append((tier, members[top_k(scores[members], distances[members], positions[members], k)]))
+    return ranked
@@ -0,0 +1,148 @@
+import argparse
+import json
+import logging
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+WINE_CSV_PATH = './data/vinos.csv'
+WINE_STORE_PATH = './data/vinos_store'
+
+# Tipos de cada columna en el almacén columnar
+CATEGORICAL_COLUMNS = ['winery', 'wine', 'year', 'country', 'region', 'type']
+FLOAT_COLUMNS = ['rating', 'price', 'body', 'acidity']
+INT_COLUMNS = ['num_reviews']
+
+META_FILE = 'meta.json'
+STORE_FORMAT_VERSION = 2
+
+
+def build_wine_store(csv_path: str = WINE_CSV_PATH, store_path: str = WINE_STORE_PATH) -> str:
+    """Convierte el CSV de vinos limpio en un almacén columnar de ficheros .npy.
+
+    Las columnas de texto se guardan como categóricas (códigos enteros del tamaño mínimo más la
+    lista de categorías en ``meta.json``), las numéricas como float32 y
+    ``num_reviews`` como int32. Cada columna es un array independiente que se
+    puede abrir con ``np.load(mmap_mode='r')`` sin parsear nada. Si a una
+    columna entera le faltan valores se guarda además su máscara de ausentes,
+    para que al cargarla sean NaN (como al leer el CSV) y no 0. Una columna
+    que no figure en ``CATEGORICAL_COLUMNS``, ``FLOAT_COLUMNS`` ni
+    ``INT_COLUMNS`` es un error (``ValueError``) en lugar de adivinar su tipo.
+
+    Returns:
+        La ruta del almacén generado.
+    """
+    df = pd.read_csv(csv_path)
+    if 'type' in df.columns:
+        df['type'] = df['type'].str.lower()
+
+    # Se comprueba antes de escribir nada para no dejar un almacén a medias
+    unknown = [c for c in df.columns if c not in CATEGORICAL_COLUMNS + FLOAT_COLUMNS + INT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Columnas desconocidas en {csv_path}: {unknown}")
+
+    os.makedirs(store_path, exist_ok=True)
+    columns = []
+    for column in df.columns:
+        if column in FLOAT_COLUMNS:
+            array = pd.to_numeric(df[column], errors='coerce').to_numpy(dtype=np.float32)
+            columns.append({'name': column, 'kind': 'float32'})
+        elif column in INT_COLUMNS:
+            values = pd.to_numeric(df[column], errors='coerce')
+            array = values.fillna(0).to_numpy(dtype=np.int32)
+            columns.append({'name': column, 'kind': 'int32'})
+            missing = values.isna().to_numpy()
+            if missing.any():
+                columns[-1]['missing'] = f'{column}.missing.npy'
+                np.save(os.path.join(store_path, columns[-1]['missing']), missing)
+        elif column in CATEGORICAL_COLUMNS:
+            categorical = pd.Categorical(df[column].astype('string'))
+            array = categorical.codes
+            columns.append({'name': column, 'kind': 'category',
+                            'categories': [str(c) for c in categorical.categories]})
+        np.save(os.path.join(store_path, f'{column}.npy'), np.ascontiguousarray(array))
+
+    meta = {
+        'format_version': STORE_FORMAT_VERSION,
+        'rows': len(df),
+        'source': os.path.abspath(csv_path),
+        'source_mtime': os.path.getmtime(csv_path),
+        'columns': columns,
+    }
+    # El fichero de metadatos se escribe al final: un almacén a medio generar no es válido
+    with open(os.path.join(store_path, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    logger.info(f"Almacén de vinos generado en {store_path}: {len(df)} registros, {len(columns)} columnas")
+    return store_path
+
+
+def is_store_fresh(store_path: str = WINE_STORE_PATH, csv_path: Optional[str] = WINE_CSV_PATH) -> bool:
+    """Indica si existe un almacén válido y no es más antiguo que el CSV de origen"""
+    meta_path = os.path.join(store_path, META_FILE)
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get('format_version') != STORE_FORMAT_VERSION:
+        return False
+    if csv_path and os.path.exists(csv_path):
+        return (meta.get('source') == os.path.abspath(csv_path)
+                and os.path.getmtime(csv_path) <= meta.get('source_mtime', 0))
+    return True
+
+
+def load_wine_store(store_path: str = WINE_STORE_PATH) -> pd.DataFrame:
+    """Abre el almacén columnar como DataFrame sin copiar los datos.
+
+    Los arrays se mapean en memoria en modo solo lectura, de modo que varios
+    procesos comparten las mismas páginas del sistema operativo. El DataFrame
+    resultante no debe modificarse in situ. Las columnas enteras con valores
+    ausentes se cargan como float64 con NaN, igual que con ``pd.read_csv``.
+    """
+    with open(os.path.join(store_path, META_FILE), encoding='utf-8') as f:
+        meta = json.load(f)
+
+    data = {}
+    for column in meta['columns']:
+        array = np.load(os.path.join(store_path, f"{column['name']}.npy"), mmap_mode='r')
+        if column['kind'] == 'category':
+            data[column['name']] = pd.Categorical.from_codes(array, categories=column['categories'])
+        elif column.get('missing'):
+            missing = np.load(os.path.join(store_path, column['missing']), mmap_mode='r')
+            data[column['name']] = np.where(missing, np.nan, array)
+        else:
+            data[column['name']] = array
+
+    return pd.DataFrame(data, copy=False)
+
+
+def load_wine_catalogue(csv_path: str = WINE_CSV_PATH, store_path: str = WINE_STORE_PATH) -> pd.DataFrame:
+    """Carga el catálogo desde el almacén columnar si está al día y, si no, desde el CSV"""
+    if is_store_fresh(store_path, csv_path):
+        return load_wine_store(store_path)
+
+    logger.info(f"Almacén de vinos no disponible o desactualizado, se lee {csv_path}")
+    df = pd.read_csv(csv_path)
+    if 'type' in df.columns:
+        df['type'] = df['type'].str.lower()
+    return df
+
+
+def main(argv=None) -> None:
+    """Genera el almacén columnar a partir del CSV de vinos"""
+    parser = argparse.ArgumentParser(description="Genera el almacén columnar del catálogo de vinos")
+    parser.add_argument('--csv', default=WINE_CSV_PATH, help="CSV de vinos limpio")
+    parser.add_argument('--salida', default=WINE_STORE_PATH, help="Directorio del almacén")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    build_wine_store(args.csv, args.salida)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,3 @@
-import pdfplumber
 import os
 import google.generativeai as genai
 from dotenv import load_dotenv
@@ -11,76 +10,51 @@ genai.configure(api_key=api_key)
 
 menu_pdf = 'El Tribut - Fichas platos para Sala.pdf'
 
-texto_extraido = ''
-with pdfplumber.open(menu_pdf) as pdf:
-    for pagina in pdf.pages:
-        texto_extraido += pagina.extract_text() + '\n'
-
-import json
-import re
 from pprint import pprint
 from resources import *
+from menu_extraction import PageTextCache, iter_pdf_pages
+from menu_structuring import split_menu_chunks, structure_menu
+from narratives import GEMINI_MODEL
+from wine_store import load_wine_catalogue
+
 
-if 'texto_extraido' not in globals():
-    raise ValueError('La variable texto_extraido no está definida. Ejecuta la celda que extrae el PDF primero.')
-
-prompt = f"""
-Eres un asistente que convierte texto de menú en JSON estructurado.
-Recibirás a continuación un bloque de texto (en español/ING/otros) que contiene múltiples entradas de platos.
-Devuelve únicamente un JSON (sin texto adicional) con un array de objetos. Cada objeto debe tener EXACTAMENTE estas claves:
-- nombre_plato (string)
-- categoria (string)  # p.ej. Entrante, Principal, Postre
-- ingredientes_clave (array de strings)  # 3-6 ingredientes o componentes clave
-- carne ("Sí" o "No")
-- proteina_principal (string)  # p.ej. Pescado, Ternera, Lácteo, Marisco, N/A
-- salsa (string)  # breve descripción o "N/A"
-- coccion (string)  # p.ej. Frito, Horneado, Crudo / Marinado, etc.
-- alergenos (array de strings)
-
-Normaliza los nombres en español cuando sea posible. No incluyas explicaciones ni texto fuera del JSON.
-Texto a procesar:
-
-
-{texto_extraido}
-
-"""
-model = genai.GenerativeModel('gemini-2.5-flash')
-
-try:
-    response = model.generate_content(prompt)
-    raw = response.text
-except Exception as e:
-    print('Error en la llamada a Gemini:', e)
-    raw = None
-
-menu_data = None
-if raw:
-    # intentar parsear directamente
+def catalogue_wine_types():
+    """Tipos de vino del catálogo, para que los maridajes coincidan con los de la app"""
     try:
-        menu_data = json.loads(raw)
-    except Exception:
-        # intentar extraer primer bloque JSON del texto
-        m = re.search(r"(\[\s*\{[\s\S]*\}\s*\])", raw)
-        if m:
-            try:
-                menu_data = json.loads(m.group(1))
-            except Exception as e:
-                print('Error parseando el bloque JSON extraído:', e)
-        else:
-            print('No se encontró un JSON evidente en la respuesta de Gemini. Mostrando salida cruda:')
-            print(raw[:2000])
-if menu_data:
-    print(f'✅ JSON parseado correctamente. Platos extraídos: {len(menu_data)}')
-    pprint(menu_data[:3])
-    
-    # Guardar cada plato en MongoDB
-    for plato in menu_data:
-        id_guardado = guardar_plato_en_mongodb(plato)
-        if id_guardado:
-            print(f"✅ Plato '{plato['nombre_plato']}' guardado con ID: {id_guardado}")
-    
-    # Guardar en variable global para usar en otras celdas
-    globals()['menu_data'] = menu_data
-else:
-    print('❌ No se pudo generar menu_data. Revisa la salida anterior.')
+        return sorted(load_wine_catalogue()['type'].dropna().astype(str).str.lower().unique())
+    except Exception as e:
+        print(f"⚠️ No se pudo leer el catálogo de vinos ({e}); los maridajes no se restringirán")
+        return None
+
+
+def main():
+    # Las páginas se extraen en paralelo (procesos) y se guardan en caché por huella del PDF
+    paginas = [texto for _, texto in iter_pdf_pages(menu_pdf, PageTextCache())]
+
+    # Cada ficha se estructura por separado: un plato mal formado solo obliga a repetir su fragmento
+    fragmentos = split_menu_chunks(paginas)
+    model = genai.GenerativeModel(GEMINI_MODEL, generation_config={'response_mime_type': 'application/json'})
+    menu_data, fallidos = structure_menu(model, fragmentos, wine_types=catalogue_wine_types(),
+                                         workers=int(os.getenv('MENU_WORKERS', '4')))
+
+    if fallidos:
+        print(f'⚠️ {len(fallidos)} de {len(fragmentos)} fragmentos no se pudieron estructurar:')
+        for fallido in fallidos:
+            print(f"  - Fragmento {fallido['fragmento']}: {fallido['error'][:300]}")
+
+    if menu_data:
+        print(f'✅ JSON validado correctamente. Platos extraídos: {len(menu_data)}')
+        pprint(menu_data[:3])
+
+        # Guardar el menú completo en MongoDB (sin duplicar platos ya ingeridos)
+        guardar_platos_en_mongodb(menu_data, restaurante=os.getenv('RESTAURANTE'))
+
+        # Guardar en variable global para usar en otras celdas
+        globals()['menu_data'] = menu_data
+    else:
+        print('❌ No se pudo generar menu_data. Revisa la salida anterior.')
+
 
+# El pool de procesos vuelve a importar este módulo: solo se ejecuta como script principal
+if __name__ == "__main__":
+    main()